@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.urls import path
 from rest_framework.routers import SimpleRouter
 
+from apps.images.api import async_views as image_async_views
 from apps.images.api import views as image_views
 from apps.images.api import viewsets as image_viewsets
 
@@ -12,7 +14,11 @@ router.register("images", image_viewsets.ImageViewSet, basename="images")
 urlpatterns = [
     path(
         route="images/<uuid:uuid>/<int:height>/",
-        view=image_views.ThumbnailRenderAPIView.as_view(),
+        view=(
+            image_async_views.thumbnail_render_view
+            if settings.IMAGES_ASYNC_VIEWS
+            else image_views.ThumbnailRenderAPIView.as_view()
+        ),
         name="images_render_thumbnail",
     ),
     path(
@@ -22,7 +28,11 @@ urlpatterns = [
     ),
     path(
         route="images/<uuid:uuid>/link/<int:expiry_time>/",
-        view=image_views.ImageExpiringLinkAPIView.as_view(),
+        view=(
+            image_async_views.image_expiring_link_view
+            if settings.IMAGES_ASYNC_VIEWS
+            else image_views.ImageExpiringLinkAPIView.as_view()
+        ),
         name="images_expiring_link",
     ),
 ]
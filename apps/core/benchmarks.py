@@ -0,0 +1,205 @@
+import io
+import math
+import os
+import statistics
+import tempfile
+import threading
+import time
+import uuid as uuid_lib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import PIL.Image
+from django.core.files import File
+from django.core.servers.basehttp import (
+    ThreadedWSGIServer,
+    get_internal_wsgi_application,
+)
+from django.test.testcases import QuietWSGIRequestHandler
+from imagekit.processors import ResizeToFit
+
+from apps.images.api.utils import (
+    THUMBNAIL_FORMAT,
+    create_thumbnails,
+    decode_image,
+    encode_thumbnail,
+)
+
+# Benchmarks of the thumbnail pipeline and of the API endpoints, run by `benchmark` management command.
+# Results are flat mappings of metric names to values: durations are in milliseconds (`_ms` suffix, lower is better)
+# and throughputs in requests per second (`.requests_per_second` suffix, higher is better).
+
+HIGHER_IS_BETTER_SUFFIXES = (".requests_per_second",)
+
+
+def make_synthetic_image(width, height, format):
+    """
+    Returns a synthetic image of given dimensions (px) encoded in a given format (JPEG or PNG). The image is
+    deterministic and mixes smooth gradients with fine detail (a Mandelbrot set), so that it compresses about
+    as well as a photograph.
+    """
+    detail = PIL.Image.effect_mandelbrot(
+        (max(width // 4, 1), max(height // 4, 1)), (-2.0, -1.25, 0.75, 1.25), 100
+    ).resize((width, height))
+    horizontal = PIL.Image.linear_gradient("L").rotate(90).resize((width, height))
+    radial = PIL.Image.radial_gradient("L").resize((width, height))
+    image = PIL.Image.merge("RGB", (horizontal, detail, radial))
+
+    output = io.BytesIO()
+    image.save(output, format=format, **({"quality": 90} if format == "JPEG" else {}))
+    return output.getvalue()
+
+
+def median_ms(durations):
+    """
+    Returns the median of the given durations (seconds) in milliseconds.
+    """
+    return statistics.median(durations) * 1000
+
+
+def percentile(values, percent):
+    """
+    Returns the nearest-rank percentile of the given values.
+    """
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * percent / 100) - 1, 0)]
+
+
+def benchmark_pipeline(source, heights, repeat, format=THUMBNAIL_FORMAT):
+    """
+    Times rendering thumbnails of given heights (px) in a given format from the given encoded source image.
+    Every height is timed in isolation: the source is decoded at the scale of that height, then resized and encoded,
+    unlike `apps.images.api.utils.create_thumbnails` which decodes it once and resizes each height from the previous
+    one. `create_thumbnails_ms` times that function itself (writing to a temporary directory) rendering all heights.
+    Returns the median of `repeat` runs of every stage (ms).
+    """
+    timings = {"decode_ms": [], "create_thumbnails_ms": []}
+    for height in heights:
+        timings[f"h{height}.decode_ms"] = []
+        timings[f"h{height}.resize_ms"] = []
+        timings[f"h{height}.encode_ms"] = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with PIL.Image.open(io.BytesIO(source)) as image:
+            image.load()
+        timings["decode_ms"].append(time.perf_counter() - start)
+
+        for height in heights:
+            start = time.perf_counter()
+            decoded = decode_image(File(io.BytesIO(source), name="source"), height)
+            timings[f"h{height}.decode_ms"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            thumbnail = ResizeToFit(height=height, upscale=True).process(decoded)
+            timings[f"h{height}.resize_ms"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            encode_thumbnail(thumbnail, format=format)
+            timings[f"h{height}.encode_ms"].append(time.perf_counter() - start)
+
+        with tempfile.TemporaryDirectory() as directory:
+            thumbnail_paths = {height: os.path.join(directory, f"{height}.{format.lower()}") for height in heights}
+            start = time.perf_counter()
+            create_thumbnails(File(io.BytesIO(source), name="source"), thumbnail_paths, format=format)
+            timings["create_thumbnails_ms"].append(time.perf_counter() - start)
+
+    return {name: median_ms(durations) for name, durations in timings.items()}
+
+
+def benchmark_endpoint(send, requests, concurrency):
+    """
+    Sends `requests` requests with the given callable (which sends a single request and returns its status code)
+    from `concurrency` threads. Returns the throughput and the median and 99th percentile latencies.
+    Raises RuntimeError if any request fails.
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def timed_send(_):
+        start = time.perf_counter()
+        status = send()
+        latency = time.perf_counter() - start
+        with lock:
+            latencies.append(latency)
+            if status >= 400:
+                errors.append(status)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed_send, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    if errors:
+        raise RuntimeError(f"{len(errors)} of {requests} requests failed (status {errors[0]}).")
+    return {
+        "requests_per_second": requests / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def http_request(url, method="GET", headers=None, data=None):
+    """
+    Sends an HTTP request and returns its status code, after reading the whole response body.
+    """
+    request = Request(url, method=method, headers=headers or {}, data=data)
+    try:
+        with urlopen(request) as response:
+            response.read()
+            return response.status
+    except HTTPError as error:
+        return error.code
+
+
+def encode_multipart(fields, files):
+    """
+    Encodes the given fields (a mapping of field names to values) and files (a list of field name, file name and
+    content tuples) as a multipart form. Returns the body and its content type.
+    """
+    boundary = uuid_lib.uuid4().hex
+    body = io.BytesIO()
+    for field_name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{field_name}"\r\n\r\n{value}\r\n'.encode())
+    for field_name, file_name, content in files:
+        body.write(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{field_name}"; filename="{file_name}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n".encode()
+        )
+        body.write(content)
+        body.write(b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode())
+    return body.getvalue(), f"multipart/form-data; boundary={boundary}"
+
+
+def start_local_server():
+    """
+    Starts a threaded WSGI server of the project on a free local port, in a background thread.
+    Returns the server (stopped with `shutdown()`) and its URL.
+    """
+    server = ThreadedWSGIServer(("127.0.0.1", 0), QuietWSGIRequestHandler, allow_reuse_address=False)
+    server.set_app(get_internal_wsgi_application())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Compares the results with the baseline results and returns regressions: metrics which are worse than
+    in the baseline by more than `tolerance` (a fraction of the baseline value), as (name, baseline value, value)
+    tuples. Metrics missing from the baseline are not compared.
+    """
+    regressions = []
+    for name, value in sorted(results.items()):
+        baseline_value = baseline.get(name)
+        if not baseline_value:
+            continue
+        if name.endswith(HIGHER_IS_BETTER_SUFFIXES):
+            regressed = value < baseline_value * (1 - tolerance)
+        else:
+            regressed = value > baseline_value * (1 + tolerance)
+        if regressed:
+            regressions.append((name, baseline_value, value))
+    return regressions
@@ -0,0 +1,253 @@
+import json
+import os
+import platform
+from urllib.parse import urlsplit
+
+import PIL
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from apps.core.benchmarks import (
+    benchmark_endpoint,
+    benchmark_pipeline,
+    compare_with_baseline,
+    encode_multipart,
+    http_request,
+    make_synthetic_image,
+    start_local_server,
+)
+from apps.images.api.links import get_expiring_link
+from apps.images.models import Image
+from apps.plans.models import Plan
+
+# Resolution and format of the images uploaded to, and served by, the benchmarked endpoints
+ENDPOINT_IMAGE_SIZE = (1280, 960)
+ENDPOINT_IMAGE_FORMAT = "JPEG"
+
+
+def parse_resolution(value):
+    """
+    Parses a `<width>x<height>` resolution argument.
+    """
+    try:
+        width, height = (int(dimension) for dimension in value.lower().split("x"))
+    except ValueError:
+        raise CommandError(f"Invalid resolution {value!r}, expected <width>x<height>, e.g. 1920x1080.")
+    return width, height
+
+
+class Command(BaseCommand):
+    """Django command to benchmark the thumbnail pipeline and the API endpoints against a stored baseline."""
+
+    help = (
+        "Times thumbnail rendering stages on synthetic originals and measures the throughput and latency "
+        "of the API endpoints against a local server, then compares the results with a stored baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--resolutions",
+            nargs="+",
+            type=parse_resolution,
+            default=[(640, 480), (1920, 1080), (4000, 3000)],
+            help="Resolutions of the synthetic originals, e.g. 1920x1080.",
+        )
+        parser.add_argument(
+            "--source-formats",
+            nargs="+",
+            choices=["JPEG", "PNG"],
+            default=["JPEG", "PNG"],
+            help="Formats of the synthetic originals.",
+        )
+        parser.add_argument(
+            "--heights", nargs="+", type=int, default=[200, 400], help="Heights (px) of the rendered thumbnails."
+        )
+        parser.add_argument("--repeat", type=int, default=5, help="Number of runs of every pipeline benchmark.")
+        parser.add_argument("--requests", type=int, default=200, help="Number of requests sent to every endpoint.")
+        parser.add_argument("--concurrency", type=int, default=8, help="Number of concurrent requests.")
+        parser.add_argument(
+            "--server-url",
+            help="URL of a local server of the project, sharing its database and media. A server is started "
+            "in-process if not given.",
+        )
+        parser.add_argument(
+            "--plan", default="Enterprise", help="Name of the plan of the user the endpoints are benchmarked as."
+        )
+        parser.add_argument("--skip-pipeline", action="store_true", help="Do not benchmark the thumbnail pipeline.")
+        parser.add_argument("--skip-endpoints", action="store_true", help="Do not benchmark the API endpoints.")
+        parser.add_argument(
+            "--baseline",
+            default=os.path.join(settings.BASE_DIR, "benchmarks", "baseline.json"),
+            help="Path of the baseline results file.",
+        )
+        parser.add_argument(
+            "--save-baseline", action="store_true", help="Store the results as the new baseline instead of comparing."
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.1,
+            help="Fraction of a baseline value by which a result may be worse before it is flagged as a regression.",
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+
+        self.options = options
+        results = {}
+        if not options["skip_pipeline"]:
+            results.update(self.benchmark_pipeline())
+        if not options["skip_endpoints"]:
+            results.update(self.benchmark_endpoints())
+
+        baseline_path = options["baseline"]
+        if options["save_baseline"]:
+            os.makedirs(os.path.dirname(baseline_path) or ".", exist_ok=True)
+            with open(baseline_path, "w") as baseline_file:
+                json.dump(
+                    {"environment": self.get_environment(), "results": results},
+                    baseline_file,
+                    indent=2,
+                    sort_keys=True,
+                )
+            self.stdout.write(self.style.SUCCESS(f"Baseline saved to {baseline_path}."))
+            return
+
+        if not os.path.exists(baseline_path):
+            self.stdout.write(f"No baseline at {baseline_path}, run with --save-baseline to store one.")
+            return
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline["environment"] != self.get_environment():
+            self.stdout.write(
+                self.style.WARNING(f"The baseline was measured in another environment: {baseline['environment']}.")
+            )
+
+        regressions = compare_with_baseline(results, baseline["results"], options["tolerance"])
+        for name, baseline_value, value in regressions:
+            self.stdout.write(self.style.ERROR(f"Regression of {name}: {value:.2f} (baseline: {baseline_value:.2f})"))
+        if regressions:
+            raise CommandError(f"{len(regressions)} benchmarks regressed by more than {options['tolerance']:.0%}.")
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline!"))
+
+    def get_environment(self):
+        """
+        Describes the environment the results are measured in, as results are only comparable within one.
+        """
+        return {"python": platform.python_version(), "pillow": PIL.__version__, "machine": platform.machine()}
+
+    def benchmark_pipeline(self):
+        """
+        Benchmarks thumbnail rendering stages on synthetic originals of every format and resolution.
+        """
+        results = {}
+        for source_format in self.options["source_formats"]:
+            for width, height in self.options["resolutions"]:
+                source = make_synthetic_image(width, height, source_format)
+                timings = benchmark_pipeline(source, self.options["heights"], self.options["repeat"])
+                for name, value in timings.items():
+                    results[f"pipeline.{source_format}.{width}x{height}.{name}"] = value
+                    self.stdout.write(f"pipeline.{source_format}.{width}x{height}.{name}: {value:.2f}")
+        return results
+
+    def benchmark_endpoints(self):
+        """
+        Benchmarks every endpoint of the API as a temporary user, which is deleted with its images afterwards.
+        """
+        try:
+            plan = Plan.objects.get(name=self.options["plan"])
+        except Plan.DoesNotExist:
+            raise CommandError(f"There is no plan named {self.options['plan']!r}.")
+        user = get_user_model().objects.create_user(
+            username=f"benchmark-{get_random_string(8).lower()}", password=get_random_string(32), plan=plan
+        )
+
+        server = None
+        server_url = self.options["server_url"]
+        if server_url is None:
+            server, server_url = start_local_server()
+        try:
+            return self.benchmark_user_endpoints(user, plan, server_url.rstrip("/"))
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+            for image in user.images.all():
+                image.delete()
+            user.delete()
+
+    def benchmark_user_endpoints(self, user, plan, server_url):
+        """
+        Benchmarks the endpoints of the API on images uploaded by the given user, authenticated by a session.
+        Raises CommandError if the plan does not give access to an endpoint.
+        """
+        image_content = make_synthetic_image(*ENDPOINT_IMAGE_SIZE, ENDPOINT_IMAGE_FORMAT)
+        image = Image.objects.create(
+            account=user, image=SimpleUploadedFile("benchmark.jpg", image_content, content_type="image/jpeg")
+        )
+
+        client = Client()
+        client.force_login(user)
+        csrf_token = get_random_string(32)
+        headers = {
+            "Cookie": f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}; "
+            f"{settings.CSRF_COOKIE_NAME}={csrf_token}",
+            "X-CSRFToken": csrf_token,
+        }
+
+        if not plan.available_thumbnail_heights:
+            raise CommandError(f"The {plan} plan has no thumbnail heights.")
+        thumbnail_height = plan.available_thumbnail_heights[0]
+        if not plan.can_fetch_expiring_link:
+            raise CommandError(f"The {plan} plan cannot fetch expiring links.")
+        expiry_time = (plan.expiring_link_time_range.lower if plan.expiring_link_time_range else None) or 300
+        generate_link_path = reverse(
+            "apiv1:images_generate_link", kwargs={"uuid": image.uuid, "expiry_time": expiry_time}
+        )
+        expiring_link = urlsplit(get_expiring_link(image.uuid, image.image.name, expiry_time))
+        expiring_link_path = f"{expiring_link.path}?{expiring_link.query}"
+
+        upload_body, upload_content_type = encode_multipart(
+            {"account": user.id}, [("image", "benchmark.jpg", image_content)]
+        )
+        batch_body, batch_content_type = encode_multipart(
+            {}, [("images", f"benchmark-{number}.jpg", image_content) for number in range(5)]
+        )
+        endpoints = {
+            "images_list": ("GET", reverse("apiv1:images-list"), None, None),
+            "images_create": ("POST", reverse("apiv1:images-list"), upload_body, upload_content_type),
+            "images_batch": ("POST", reverse("apiv1:images-batch"), batch_body, batch_content_type),
+            "images_detail": ("GET", reverse("apiv1:images-detail", kwargs={"uuid": image.uuid}), None, None),
+            "images_render_thumbnail": (
+                "GET",
+                reverse("apiv1:images_render_thumbnail", kwargs={"uuid": image.uuid, "height": thumbnail_height}),
+                None,
+                None,
+            ),
+            "images_generate_link": ("GET", generate_link_path, None, None),
+            "images_expiring_link": ("GET", expiring_link_path, None, None),
+        }
+
+        results = {}
+        for name, (method, path, body, content_type) in endpoints.items():
+            request_headers = {**headers, "Content-Type": content_type} if content_type else headers
+
+            def send():
+                return http_request(server_url + path, method=method, headers=request_headers, data=body)
+
+            try:
+                measurements = benchmark_endpoint(send, self.options["requests"], self.options["concurrency"])
+            except RuntimeError as error:
+                raise CommandError(f"Benchmark of {name} failed: {error}")
+            for measurement, value in measurements.items():
+                results[f"endpoints.{name}.{measurement}"] = value
+            self.stdout.write(
+                f"endpoints.{name}: {measurements['requests_per_second']:.1f} requests/s, "
+                f"p50 {measurements['p50_ms']:.2f} ms, p99 {measurements['p99_ms']:.2f} ms"
+            )
+        return results
@@ -0,0 +1,148 @@
+import re
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from apps.images.api.utils import (
+    THUMBNAIL_FORMATS,
+    get_rendition_version,
+    index_thumbnail,
+)
+from apps.images.content import THUMBNAILS_DIRECTORY
+from apps.images.models import Image, ThumbnailRendition
+from apps.plans.cache import get_user_plan
+
+THUMBNAIL_FILENAME_PATTERN = re.compile(r"^(?P<height>\d+)-(?P<uuid>[0-9a-f-]{36})\.[a-z]+$")
+SHARED_THUMBNAIL_FILENAME_PATTERN = re.compile(r"^(?P<height>\d+)-(?P<version>[0-9a-f]{8})\.(?P<extension>[a-z]+)$")
+
+
+class Command(BaseCommand):
+    """Django command to reconcile the thumbnail rendition index with thumbnail files in the storage."""
+
+    help = "Indexes thumbnail files missing from ThumbnailRendition index and removes index entries without files."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only report the differences, without changing the index."
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+
+        dry_run = options["dry_run"]
+        self.stdout.write("Reconciling thumbnail renditions with the storage...")
+
+        # Thumbnails of images with identical content share their files, so entries are keyed by image too
+        indexed = {
+            (image_id, storage_key): (rendition_id, size)
+            for rendition_id, image_id, storage_key, size in ThumbnailRendition.objects.values_list(
+                "id", "image_id", "storage_key", "size"
+            )
+        }
+        added = updated = 0
+
+        for storage_key, image_id, height in self.walk_thumbnails():
+            index_entry = indexed.pop((image_id, storage_key), None)
+            if index_entry is not None and index_entry[1] == default_storage.size(storage_key):
+                continue
+
+            if index_entry is None:
+                added += 1
+                self.stdout.write(f"Missing from the index: {storage_key}")
+            else:
+                updated += 1
+                self.stdout.write(f"Changed in the storage: {storage_key}")
+            if not dry_run:
+                index_thumbnail(image_id, height, default_storage.path(storage_key))
+
+        for _, storage_key in indexed:
+            self.stdout.write(f"Missing from the storage: {storage_key}")
+        if not dry_run:
+            ThumbnailRendition.objects.filter(id__in=[rendition_id for rendition_id, _ in indexed.values()]).delete()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Renditions reconciled{' (dry run)' if dry_run else ''}! "
+                f"Added: {added}, updated: {updated}, removed: {len(indexed)}."
+            )
+        )
+
+    def walk_thumbnails(self):
+        """
+        Yields storage key, image id and height of every thumbnail file of an existing image in the storage.
+        """
+        yield from self.walk_image_thumbnails()
+        yield from self.walk_shared_thumbnails()
+
+    def walk_image_thumbnails(self):
+        """
+        Yields thumbnails of images stored before deduplication, stored as
+        `images/<username>/<uuid>/<height>-<uuid>.<extension>`.
+        """
+        if not default_storage.exists("images"):
+            return
+
+        usernames, _ = default_storage.listdir("images")
+        for username in usernames:
+            image_uuids, _ = default_storage.listdir(f"images/{username}")
+            for image_uuid in image_uuids:
+                image_directory = f"images/{username}/{image_uuid}"
+                _, filenames = default_storage.listdir(image_directory)
+
+                thumbnails = []
+                for filename in filenames:
+                    match = THUMBNAIL_FILENAME_PATTERN.match(filename)
+                    if match and match["uuid"] == image_uuid:
+                        thumbnails.append((f"{image_directory}/{filename}", int(match["height"])))
+                if not thumbnails:
+                    continue
+
+                image_id = (
+                    Image.objects.filter(uuid=image_uuid, account__username=username)
+                    .values_list("id", flat=True)
+                    .first()
+                )
+                if image_id is None:
+                    continue
+
+                for storage_key, height in thumbnails:
+                    yield storage_key, image_id, height
+
+    def walk_shared_thumbnails(self):
+        """
+        Yields thumbnails shared by images with identical content, stored as
+        `thumbnails/<prefix>/<content hash>/<height>-<rendition version>.<extension>`. A file is yielded for every
+        image with its content whose plan renders thumbnails with the file's rendition version.
+        """
+        if not default_storage.exists(THUMBNAILS_DIRECTORY):
+            return
+
+        formats = {options["extension"]: format for format, options in THUMBNAIL_FORMATS.items()}
+        prefixes, _ = default_storage.listdir(THUMBNAILS_DIRECTORY)
+        for prefix in prefixes:
+            content_hashes, _ = default_storage.listdir(f"{THUMBNAILS_DIRECTORY}/{prefix}")
+            for content_hash in content_hashes:
+                content_directory = f"{THUMBNAILS_DIRECTORY}/{prefix}/{content_hash}"
+                _, filenames = default_storage.listdir(content_directory)
+
+                thumbnails = []
+                for filename in filenames:
+                    match = SHARED_THUMBNAIL_FILENAME_PATTERN.match(filename)
+                    if match and match["extension"] in formats:
+                        thumbnails.append(
+                            (
+                                f"{content_directory}/{filename}",
+                                int(match["height"]),
+                                match["version"],
+                                formats[match["extension"]],
+                            )
+                        )
+                if not thumbnails:
+                    continue
+
+                for image in Image.objects.filter(content_hash=content_hash).select_related("account"):
+                    plan = get_user_plan(image.account)
+                    encoder_profile = plan.encoder_profile if plan is not None else None
+                    for storage_key, height, version, format in thumbnails:
+                        if version == get_rendition_version(format, encoder_profile):
+                            yield storage_key, image.id, height
@@ -0,0 +1,241 @@
+import datetime
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from apps.images.api.utils import (
+    THUMBNAIL_FORMAT,
+    THUMBNAIL_FORMATS,
+    get_thumbnail_path,
+    index_thumbnail,
+    write_file_atomic,
+)
+from apps.images.models import Image, ThumbnailRendition
+from apps.images.tasks import regenerate_thumbnails
+
+# Interval (seconds) between checks of the load average while the command is paused
+LOAD_CHECK_INTERVAL = 5
+
+
+class Command(BaseCommand):
+    """Django command to render missing and stale thumbnails of all images."""
+
+    help = (
+        "Renders thumbnails of all images which are missing or stale (rendered with other encoder settings) "
+        "for the plans of their owners, in worker processes. Progress is checkpointed after every batch of images, "
+        "so an interrupted run resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--formats",
+            nargs="+",
+            choices=list(THUMBNAIL_FORMATS),
+            default=[THUMBNAIL_FORMAT],
+            help="Formats of the thumbnails to render.",
+        )
+        parser.add_argument(
+            "--force", action="store_true", help="Render all thumbnails again, even those which are up to date."
+        )
+        parser.add_argument(
+            "--workers", type=int, default=os.cpu_count(), help="Number of worker processes rendering thumbnails."
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=100, help="Number of images fetched and checkpointed at once."
+        )
+        parser.add_argument(
+            "--checkpoint",
+            default=os.path.join(settings.BASE_DIR, ".regenerate_thumbnails.json"),
+            help="Path of the file the progress is checkpointed to. It is deleted once all images are processed.",
+        )
+        parser.add_argument(
+            "--restart", action="store_true", help="Ignore the checkpoint and start again from the first image."
+        )
+        parser.add_argument("--max-rate", type=float, help="Maximum number of images rendered per second.")
+        parser.add_argument(
+            "--max-load",
+            type=float,
+            help="Pause while the 1-minute load average per CPU (which counts processes waiting for the CPU "
+            "or for disk IO) is above this value.",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only report the thumbnails to render, without rendering them."
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+
+        self.options = options
+        dry_run = options["dry_run"]
+        checkpoint_path = options["checkpoint"]
+
+        checkpoint = {"last_image_id": 0, "images": 0, "thumbnails": 0, "failed": 0}
+        if not options["restart"] and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+            self.stdout.write(
+                f"Resuming after image {checkpoint['last_image_id']} ({checkpoint['images']} images processed)."
+            )
+
+        remaining = Image.objects.filter(id__gt=checkpoint["last_image_id"]).count()
+        total = checkpoint["images"] + remaining
+        self.stdout.write(f"Regenerating thumbnails of {remaining} images...")
+
+        self.started = time.monotonic()
+        self.processed = self.submitted = 0
+        with ProcessPoolExecutor(max_workers=options["workers"], initializer=django.setup) as executor:
+            for images in self.get_image_batches(checkpoint["last_image_id"]):
+                self.wait_for_load()
+                rendered, failed = self.process_batch(executor, images)
+
+                checkpoint["last_image_id"] = images[-1].id
+                checkpoint["images"] += len(images)
+                checkpoint["thumbnails"] += rendered
+                checkpoint["failed"] += failed
+                if not dry_run:
+                    write_file_atomic(checkpoint_path, json.dumps(checkpoint).encode())
+                self.processed += len(images)
+                self.report_progress(checkpoint, total)
+
+        if not dry_run and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Thumbnails regenerated{' (dry run)' if dry_run else ''}! Images: {checkpoint['images']}, "
+                f"{'to render' if dry_run else 'rendered'}: {checkpoint['thumbnails']}, "
+                f"failed: {checkpoint['failed']}."
+            )
+        )
+
+    def get_image_batches(self, last_image_id):
+        """
+        Yields lists of at most `--batch-size` images (with their owners' plans) after the image of a given id,
+        in keyset order of their ids.
+        """
+        while True:
+            images = list(
+                Image.objects.filter(id__gt=last_image_id)
+                .select_related("account__plan__encoder_profile")
+                .order_by("id")[: self.options["batch_size"]]
+            )
+            if not images:
+                return
+            yield images
+            last_image_id = images[-1].id
+
+    def process_batch(self, executor, images):
+        """
+        Renders missing and stale thumbnails of the given images in the worker processes and indexes them.
+        Returns the numbers of rendered thumbnails (to render, in dry run mode) and of images which failed.
+        """
+        renditions = {
+            (rendition.image_id, rendition.height, rendition.format): rendition
+            for rendition in ThumbnailRendition.objects.filter(
+                image__in=images, format__in=self.options["formats"]
+            ).only("image_id", "height", "format", "storage_key", "generated_at")
+        }
+
+        rendered = 0
+        renders = []
+        for image in images:
+            plan = image.account.plan
+            if plan is None:
+                continue
+            for format in self.options["formats"]:
+                thumbnail_paths, overwrite_heights = self.get_stale_thumbnails(image, plan, format, renditions)
+                if not thumbnail_paths:
+                    continue
+                if self.options["dry_run"]:
+                    rendered += len(thumbnail_paths)
+                    continue
+
+                self.throttle()
+                future = executor.submit(
+                    regenerate_thumbnails,
+                    image.image.path,
+                    thumbnail_paths,
+                    format,
+                    encoder_profile=plan.encoder_profile,
+                    overwrite_heights=overwrite_heights,
+                )
+                renders.append((image, thumbnail_paths, future))
+
+        failed_images = set()
+        for image, thumbnail_paths, future in renders:
+            try:
+                rendered += len(future.result())
+            except Exception as error:
+                failed_images.add(image.id)
+                self.stderr.write(f"Failed to render thumbnails of image {image.uuid}: {error!r}")
+                continue
+            # Thumbnails rendered meanwhile by another process, or for an image with identical content, are indexed too
+            for height, path in thumbnail_paths.items():
+                if os.path.exists(path):
+                    index_thumbnail(image.id, height, path)
+        return rendered, len(failed_images)
+
+    def get_stale_thumbnails(self, image, plan, format, renditions):
+        """
+        Returns the paths of the image's thumbnails in a given format which are missing or stale (mapping their
+        heights to their paths), and the heights of those whose existing files are outdated and must be overwritten.
+        Thumbnails are stale if they are not indexed at their path (which depends on the encoder settings of images
+        stored by content hash) or were rendered before the plan's encoder profile was last changed.
+        """
+        encoder_profile = plan.encoder_profile
+        thumbnail_paths = {}
+        overwrite_heights = []
+        for height in plan.available_thumbnail_heights or []:
+            path = get_thumbnail_path(
+                image.account.username, image.uuid, height, format, image.content_hash, encoder_profile
+            )
+            rendition = renditions.get((image.id, height, format))
+            indexed = rendition is not None and rendition.path == path
+            outdated = indexed and encoder_profile is not None and rendition.generated_at < encoder_profile.modified_at
+            if self.options["force"] or outdated:
+                overwrite_heights.append(height)
+            if self.options["force"] or outdated or not indexed:
+                thumbnail_paths[height] = path
+        return thumbnail_paths, overwrite_heights
+
+    def throttle(self):
+        """
+        Waits before rendering thumbnails of another image, so that at most `--max-rate` images are rendered
+        per second.
+        """
+        max_rate = self.options["max_rate"]
+        if max_rate:
+            delay = self.started + self.submitted / max_rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.submitted += 1
+
+    def wait_for_load(self):
+        """
+        Waits while the load average per CPU is above `--max-load`.
+        """
+        max_load = self.options["max_load"]
+        if max_load is None:
+            return
+        while True:
+            load = os.getloadavg()[0] / os.cpu_count()
+            if load <= max_load:
+                return
+            self.stdout.write(f"Load average per CPU ({load:.2f}) is above {max_load}, pausing...")
+            time.sleep(LOAD_CHECK_INTERVAL)
+
+    def report_progress(self, checkpoint, total):
+        """
+        Reports the number of processed images, the throughput of this run and the estimated time to finish.
+        """
+        elapsed = time.monotonic() - self.started
+        rate = self.processed / elapsed if elapsed else 0.0
+        eta = datetime.timedelta(seconds=round((total - checkpoint["images"]) / rate)) if rate else "unknown"
+        self.stdout.write(
+            f"Processed {checkpoint['images']}/{total} images, {checkpoint['thumbnails']} thumbnails "
+            f"({rate:.1f} images/s, ETA {eta})."
+        )
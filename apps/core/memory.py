@@ -0,0 +1,231 @@
+import contextvars
+import datetime
+import logging
+import threading
+import tracemalloc
+import weakref
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Tracking of the memory high-water mark of requests, run by apps.core.middleware.memory_tracking_middleware.
+# Peaks are measured as the growth of the process' memory above its usage at the start of the request (or of
+# a section of it, see `memory_section`). The peak resident set size is used on Linux, where it can be reset
+# (by writing to /proc/self/clear_refs): unlike tracemalloc, it counts image buffers, which Pillow allocates
+# outside of Python's allocator. Elsewhere, tracemalloc is used. Both are process-wide, so peaks of concurrent
+# requests of a multi-threaded worker are attributed to all of them, and every reset clears the peaks of the others:
+# requests that overlapped other ones are recorded with approximate peaks.
+
+# Cache key of the requests with the highest peaks
+TOP_OFFENDERS_CACHE_KEY = "memory:top_offenders"
+
+_request_memory = contextvars.ContextVar("request_memory", default=None)
+
+# RequestMemory of the requests being tracked in the process (weak, so that an unfinished request is not kept forever)
+_active_requests = weakref.WeakSet()
+_active_requests_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+class RSSProbe:
+    """
+    Resident set size of the process and its high-water mark, read from /proc/self/status (bytes).
+    """
+
+    def reset_peak(self):
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+
+    def read(self):
+        """
+        Returns the current and peak memory usage.
+        """
+        values = {}
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    name, value, _ = line.split()
+                    values[name] = int(value) * 1024
+        return values["VmRSS:"], values["VmHWM:"]
+
+    @classmethod
+    def is_available(cls):
+        probe = cls()
+        try:
+            probe.reset_peak()
+            probe.read()
+        except (OSError, KeyError, ValueError):
+            return False
+        return True
+
+
+class TracemallocProbe:
+    """
+    Memory allocated by Python and its high-water mark, traced by tracemalloc (bytes).
+    """
+
+    def __init__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def reset_peak(self):
+        tracemalloc.reset_peak()
+
+    def read(self):
+        return tracemalloc.get_traced_memory()
+
+
+class RequestMemory:
+    """
+    Memory high-water mark of a request (bytes above the usage at its start), of its sections, and its tags
+    (e.g. the pixel count of the source image). `overlapped` tells whether other requests were tracked at the same
+    time, which makes the peaks approximate.
+    """
+
+    def __init__(self, probe):
+        self.probe = probe
+        self.peak = 0
+        self.sections = {}
+        self.tags = {}
+        self.overlapped = False
+        with _active_requests_lock:
+            if _active_requests:
+                self.overlapped = True
+                for memory in _active_requests:
+                    memory.overlapped = True
+            _active_requests.add(self)
+        self.probe.reset_peak()
+        self.baseline, _ = self.probe.read()
+
+    def checkpoint(self):
+        """
+        Adds the peak since the last reset to the request's peak and returns the current usage.
+        """
+        current, peak = self.probe.read()
+        self.peak = max(self.peak, peak - self.baseline)
+        return current
+
+    @contextmanager
+    def section(self, name):
+        start = self.checkpoint()
+        self.probe.reset_peak()
+        try:
+            yield
+        finally:
+            _, peak = self.probe.read()
+            self.peak = max(self.peak, peak - self.baseline)
+            self.sections[name] = max(self.sections.get(name, 0), peak - start)
+
+    def close(self):
+        """
+        Ends the tracking of the request, so that requests starting afterwards do not overlap it.
+        """
+        with _active_requests_lock:
+            _active_requests.discard(self)
+
+
+@contextmanager
+def track_request_memory(probe):
+    """
+    Tracks the memory high-water mark of the block (and of its sections) and yields its RequestMemory.
+    """
+    memory = RequestMemory(probe)
+    token = _request_memory.set(memory)
+    try:
+        yield memory
+    except BaseException:
+        memory.close()
+        raise
+    finally:
+        _request_memory.reset(token)
+
+
+@contextmanager
+def memory_section(name):
+    """
+    Records the memory high-water mark of the block as a section of a given name of the request being tracked, if any.
+    """
+    memory = _request_memory.get()
+    if memory is None:
+        yield
+        return
+
+    with memory.section(name):
+        yield
+
+
+def tag_memory(**tags):
+    """
+    Tags the request being tracked, if any, with the given values (e.g. the pixel count of the source image).
+    """
+    memory = _request_memory.get()
+    if memory is not None:
+        memory.tags.update(tags)
+
+
+def record_request_memory(request, memory):
+    """
+    Logs the request if its peak is above `MEMORY_TRACKING_THRESHOLD` bytes and adds it to the top offenders,
+    marked as approximate if it overlapped other requests.
+    """
+    memory.checkpoint()
+    memory.close()
+    if memory.peak < settings.MEMORY_TRACKING_THRESHOLD:
+        return
+
+    offender = {
+        "method": request.method,
+        "path": request.path,
+        "peak_bytes": memory.peak,
+        "approximate": memory.overlapped,
+        "sections": memory.sections,
+        **memory.tags,
+        "time": datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+    }
+    logger.warning(
+        "%s %s peaked at %s%s bytes above its start (sections: %s, tags: %s).",
+        request.method,
+        request.path,
+        "about " if memory.overlapped else "",
+        memory.peak,
+        memory.sections,
+        memory.tags,
+    )
+    add_top_offender(offender)
+
+
+def add_top_offender(offender):
+    """
+    Adds the request to the `MEMORY_TRACKING_TOP_OFFENDERS` requests with the highest peaks, kept in
+    the `MEMORY_TRACKING_CACHE_ALIAS` cache. Concurrent updates may drop an offender, which is fine as the
+    list only points at the worst requests.
+    """
+    cache = caches[settings.MEMORY_TRACKING_CACHE_ALIAS]
+    offenders = cache.get(TOP_OFFENDERS_CACHE_KEY, []) + [offender]
+    offenders.sort(key=lambda offender: offender["peak_bytes"], reverse=True)
+    cache.set(TOP_OFFENDERS_CACHE_KEY, offenders[: settings.MEMORY_TRACKING_TOP_OFFENDERS], timeout=None)
+
+
+def get_top_offenders():
+    """
+    Returns the requests with the highest peaks, from the highest one.
+    """
+    return caches[settings.MEMORY_TRACKING_CACHE_ALIAS].get(TOP_OFFENDERS_CACHE_KEY, [])
+
+
+_memory_probe = None
+_memory_probe_lock = threading.Lock()
+
+
+def get_memory_probe():
+    """
+    Returns the process-wide memory probe, preferring the resident set size where its peak can be reset.
+    """
+    global _memory_probe
+
+    with _memory_probe_lock:
+        if _memory_probe is None:
+            _memory_probe = RSSProbe() if RSSProbe.is_available() else TracemallocProbe()
+    return _memory_probe
@@ -0,0 +1,240 @@
+import atexit
+import bisect
+import glob
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import uuid as uuid_lib
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Upper bounds (seconds) of the buckets of latency histograms
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    """
+    Monotonically increasing metric, with a value for every combination of its labels' values.
+    """
+
+    type = "counter"
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def inc(self, amount=1, **labels):
+        """
+        Increments the value of the given labels' values by `amount`.
+        """
+        self.registry.add(f"{self.name}_total", tuple(labels[name] for name in self.labelnames), amount)
+
+
+class Histogram:
+    """
+    Metric counting observed values (e.g. durations in seconds) in buckets of the given upper bounds,
+    with their count and sum, for every combination of its labels' values.
+    """
+
+    type = "histogram"
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        """
+        Records the observed value for the given labels' values.
+        """
+        label_values = tuple(labels[name] for name in self.labelnames)
+        upper_bound = self.buckets[bisect.bisect_left(self.buckets, value)]
+        self.registry.add_many(
+            (
+                (f"{self.name}_bucket", label_values + (upper_bound,), 1),
+                (f"{self.name}_count", label_values, 1),
+                (f"{self.name}_sum", label_values, value),
+            )
+        )
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the duration (seconds) of the block for the given labels' values.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+class MetricsRegistry:
+    """
+    Registry of the metrics of the process, exposed in Prometheus text format (see `render`).
+
+    Recording a value only updates an in-memory mapping. If `METRICS_DIRECTORY` setting is set (which WSGI
+    deployments with several worker processes must do), every process also writes its values to a file of its own
+    in that directory, at most `METRICS_FLUSH_INTERVAL` seconds after they change, and the values of all processes
+    are summed when the metrics are exposed. Files of exited processes are kept, so that counters never go back;
+    the directory should be emptied when the deployment (re)starts.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._reset()
+        # Values inherited by forked worker processes belong to the parent process
+        os.register_at_fork(after_in_child=self._reset)
+        atexit.register(self.flush)
+
+    def _reset(self):
+        self._values = defaultdict(float)
+        self._file_name = f"metrics-{os.getpid()}-{uuid_lib.uuid4().hex}.json"
+        self._flush_timer = None
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def add(self, sample_name, label_values, amount):
+        """
+        Adds `amount` to the sample of a given name and labels' values.
+        """
+        with self._lock:
+            self._values[(sample_name, label_values)] += amount
+            self._schedule_flush()
+
+    def add_many(self, samples):
+        """
+        Adds amounts to several samples at once, given as (sample name, labels' values, amount) tuples.
+        """
+        with self._lock:
+            for sample_name, label_values, amount in samples:
+                self._values[(sample_name, label_values)] += amount
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        # Values are written by a timer thread, so that recording them never waits for the filesystem
+        if self._flush_timer is None and settings.METRICS_DIRECTORY:
+            self._flush_timer = threading.Timer(settings.METRICS_FLUSH_INTERVAL, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self):
+        """
+        Writes the values of the process to its file in `METRICS_DIRECTORY`, if set.
+        """
+        if not settings.METRICS_DIRECTORY:
+            return
+        with self._lock:
+            self._flush_timer = None
+            samples = [[name, list(label_values), value] for (name, label_values), value in self._values.items()]
+        if not samples:
+            return
+
+        os.makedirs(settings.METRICS_DIRECTORY, exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=settings.METRICS_DIRECTORY, prefix=".", suffix=".tmp")
+        with os.fdopen(file_descriptor, "w") as temp_file:
+            json.dump(samples, temp_file)
+        os.replace(temp_path, os.path.join(settings.METRICS_DIRECTORY, self._file_name))
+
+    def collect(self):
+        """
+        Returns the values of all samples (summed over all processes if `METRICS_DIRECTORY` is set), keyed by
+        their names and labels' values.
+        """
+        if not settings.METRICS_DIRECTORY:
+            with self._lock:
+                return dict(self._values)
+
+        self.flush()
+        values = defaultdict(float)
+        for path in glob.glob(os.path.join(settings.METRICS_DIRECTORY, "metrics-*.json")):
+            try:
+                with open(path) as metrics_file:
+                    samples = json.load(metrics_file)
+            except (OSError, ValueError):
+                continue
+            for name, label_values, value in samples:
+                values[(name, tuple(label_values))] += value
+        return values
+
+    def render(self):
+        """
+        Returns all metrics in Prometheus text exposition format.
+        """
+        samples = defaultdict(list)
+        for (sample_name, label_values), value in self.collect().items():
+            samples[sample_name].append((tuple(label_values), value))
+
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            if metric.type == "counter":
+                for label_values, value in sorted(samples[f"{metric.name}_total"]):
+                    lines.append(format_sample(f"{metric.name}_total", metric.labelnames, label_values, value))
+            else:
+                lines.extend(render_histogram(metric, samples))
+        return "\n".join(lines) + "\n"
+
+
+def render_histogram(histogram, samples):
+    """
+    Returns the lines of the histogram's samples, with cumulative bucket counts.
+    """
+    buckets = defaultdict(dict)
+    for label_values, value in samples[f"{histogram.name}_bucket"]:
+        buckets[tuple(label_values[:-1])][float(label_values[-1])] = value
+
+    lines = []
+    sums = dict(samples[f"{histogram.name}_sum"])
+    labelnames = histogram.labelnames + ("le",)
+    for label_values, count in sorted(samples[f"{histogram.name}_count"]):
+        cumulative = 0
+        for upper_bound in histogram.buckets:
+            cumulative += buckets[label_values].get(upper_bound, 0)
+            le = "+Inf" if upper_bound == math.inf else repr(upper_bound)
+            lines.append(format_sample(f"{histogram.name}_bucket", labelnames, label_values + (le,), cumulative))
+        lines.append(format_sample(f"{histogram.name}_count", histogram.labelnames, label_values, count))
+        lines.append(format_sample(f"{histogram.name}_sum", histogram.labelnames, label_values, sums[label_values]))
+    return lines
+
+
+def format_sample(name, labelnames, label_values, value):
+    """
+    Returns a sample line in Prometheus text exposition format.
+    """
+    if labelnames:
+        labels = ",".join(
+            f'{labelname}="{escape_label_value(label_value)}"'
+            for labelname, label_value in zip(labelnames, label_values)
+        )
+        name = f"{name}{{{labels}}}"
+    return f"{name} {int(value) if float(value).is_integer() else repr(float(value))}"
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# Registry of the metrics of the project
+registry = MetricsRegistry()
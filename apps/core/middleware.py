@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.decorators import sync_and_async_middleware
+
+from .memory import get_memory_probe, record_request_memory, track_request_memory
+from .profiling import RequestProfile, get_stack_sampler
+from .timing import start_request_timing
+
+logger = logging.getLogger(__name__)
+
+
+@sync_and_async_middleware
+def server_timing_middleware(get_response):
+    """
+    Times the phases of every request (see apps.core.timing) and reports them in `Server-Timing` response header
+    (if `SERVER_TIMING_HEADER` setting is enabled) and in a log line (if `SERVER_TIMING_LOG` setting is enabled).
+    The middleware is left out of the request handling if both are disabled.
+    Bodies of streamed responses are read after the middleware returns, so their reads are not timed.
+    """
+    if not settings.SERVER_TIMING_HEADER and not settings.SERVER_TIMING_LOG:
+        raise MiddlewareNotUsed()
+
+    if asyncio.iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            start = time.perf_counter()
+            with start_request_timing() as timing:
+                response = await get_response(request)
+            report_timing(request, response, timing, time.perf_counter() - start)
+            return response
+
+    else:
+
+        def middleware(request):
+            start = time.perf_counter()
+            with start_request_timing() as timing:
+                response = get_response(request)
+            report_timing(request, response, timing, time.perf_counter() - start)
+            return response
+
+    return middleware
+
+
+def report_timing(request, response, timing, total):
+    """
+    Adds `Server-Timing` header to the response and logs the timing of the request, as enabled by the settings.
+    """
+    if settings.SERVER_TIMING_HEADER:
+        response["Server-Timing"] = timing.header(total)
+    if settings.SERVER_TIMING_LOG:
+        record = {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "total_ms": round(total * 1000, 1),
+            "spans": {
+                name: {"ms": round(duration * 1000, 1), "count": count}
+                for name, (duration, count) in timing.spans.items()
+            },
+        }
+        logger.info(json.dumps(record), extra={"server_timing": record})
+
+
+@sync_and_async_middleware
+def profiling_middleware(get_response):
+    """
+    Profiles a `PROFILER_SAMPLE_RATE` fraction of requests, and every request taking at least
+    `PROFILER_SLOW_THRESHOLD` seconds (which requires sampling all of them), with the sampling profiler of
+    apps.core.profiling. Profiles are written to `PROFILER_DIRECTORY`, named after the reason, the duration and
+    the view of the request, and tagged with the requested height and the dimensions of the decoded image.
+    The middleware is left out of the request handling unless `PROFILER_DIRECTORY` and a rate or threshold are set.
+    Requests of async views are not profiled, as their event loop thread runs other requests concurrently.
+    """
+    if not settings.PROFILER_DIRECTORY or not (settings.PROFILER_SAMPLE_RATE or settings.PROFILER_SLOW_THRESHOLD):
+        raise MiddlewareNotUsed()
+
+    if asyncio.iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            return await get_response(request)
+
+        return middleware
+
+    def middleware(request):
+        sampled = random.random() < settings.PROFILER_SAMPLE_RATE
+        if not sampled and not settings.PROFILER_SLOW_THRESHOLD:
+            return get_response(request)
+
+        start = time.perf_counter()
+        with RequestProfile(get_stack_sampler()) as profile:
+            response = get_response(request)
+        duration = time.perf_counter() - start
+
+        slow = settings.PROFILER_SLOW_THRESHOLD and duration >= settings.PROFILER_SLOW_THRESHOLD
+        if slow or sampled:
+            write_profile(request, profile, "slow" if slow else "sampled", duration)
+        return response
+
+    return middleware
+
+
+def write_profile(request, profile, reason, duration):
+    """
+    Writes the profile of the request, logging (instead of raising) errors of the profiles directory.
+    """
+    view_name = "unresolved"
+    if request.resolver_match is not None:
+        view = request.resolver_match.func
+        view_name = getattr(view, "view_class", view).__name__
+        if "height" in request.resolver_match.kwargs:
+            profile.tags.setdefault("height", request.resolver_match.kwargs["height"])
+
+    try:
+        profile.write(
+            settings.PROFILER_DIRECTORY,
+            f"{reason}-{round(duration * 1000)}ms-{view_name}",
+            max_files=settings.PROFILER_MAX_FILES,
+        )
+    except OSError:
+        logger.exception("Failed to write the profile of %s request to %s.", request.path, settings.PROFILER_DIRECTORY)
+
+
+@sync_and_async_middleware
+def memory_tracking_middleware(get_response):
+    """
+    Tracks the memory high-water mark of every request, including the streaming of its response body
+    (`stream` section), if `MEMORY_TRACKING` setting is enabled (see apps.core.memory). Requests peaking above
+    `MEMORY_TRACKING_THRESHOLD` bytes are logged and kept as top offenders.
+    The middleware is left out of the request handling if tracking is disabled.
+    """
+    if not settings.MEMORY_TRACKING:
+        raise MiddlewareNotUsed()
+
+    if asyncio.iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            with track_request_memory(get_memory_probe()) as memory:
+                response = await get_response(request)
+            return finish_memory_tracking(request, response, memory)
+
+    else:
+
+        def middleware(request):
+            with track_request_memory(get_memory_probe()) as memory:
+                response = get_response(request)
+            return finish_memory_tracking(request, response, memory)
+
+    return middleware
+
+
+def finish_memory_tracking(request, response, memory):
+    """
+    Records the memory high-water mark of the request, once the body of a streamed response is sent
+    (i.e. when the server closes the response).
+    """
+    if not response.streaming:
+        record_request_memory(request, memory)
+        return response
+
+    stream = ExitStack()
+    stream.enter_context(memory.section("stream"))
+    close = response.close
+
+    def close_and_record():
+        close()
+        stream.close()
+        record_request_memory(request, memory)
+
+    # Set on the instance, as WSGIHandler hands `response.close` to the file wrapper of streamed files
+    response.close = close_and_record
+    return response
@@ -0,0 +1,158 @@
+import contextvars
+import datetime
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid as uuid_lib
+from collections import Counter
+
+from django.conf import settings
+
+# Sampling profiler of requests, run by apps.core.middleware.profiling_middleware. A single thread per process
+# samples the stacks of the threads handling profiled requests every `PROFILER_INTERVAL` seconds, so profiling costs
+# little enough to run on every request when slow ones must be captured. Profiles are written to
+# `PROFILER_DIRECTORY` in collapsed stack format (one `frame;frame;frame count` line per stack), which flame graph
+# tools (e.g. flamegraph.pl or speedscope) read.
+
+# Suffix of the profile files
+PROFILE_SUFFIX = ".collapsed"
+
+_profile_tags = contextvars.ContextVar("profile_tags", default=None)
+
+
+def tag_profile(**tags):
+    """
+    Tags the profile of the request being profiled, if any, with the given values (e.g. dimensions of the image),
+    which are added to its file name.
+    """
+    profile_tags = _profile_tags.get()
+    if profile_tags is not None:
+        profile_tags.update(tags)
+
+
+class StackSampler:
+    """
+    Thread sampling the stacks of the registered threads every `interval` seconds. It runs only while any thread
+    is registered.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, thread_id):
+        """
+        Starts sampling the stacks of the thread of a given id.
+        """
+        with self._lock:
+            self._samples[thread_id] = Counter()
+            # The thread is not inherited by forked worker processes, so it is started again in them
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+
+    def stop(self, thread_id):
+        """
+        Stops sampling the stacks of the thread of a given id and returns the number of samples of every stack.
+        """
+        with self._lock:
+            return self._samples.pop(thread_id)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._samples:
+                    self._thread = None
+                    return
+                frames = sys._current_frames()
+                for thread_id, samples in self._samples.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[format_stack(frame)] += 1
+
+
+def format_stack(frame):
+    """
+    Returns the stack of the frame, from the outermost call, in collapsed stack format.
+    """
+    calls = []
+    while frame is not None:
+        code = frame.f_code
+        calls.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(calls))
+
+
+class RequestProfile:
+    """
+    Profile of a request handled by the current thread, sampled while the profile is open.
+    """
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+        self.tags = {}
+        self.samples = Counter()
+
+    def __enter__(self):
+        self._thread_id = threading.get_ident()
+        self._token = _profile_tags.set(self.tags)
+        self.sampler.start(self._thread_id)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.samples = self.sampler.stop(self._thread_id)
+        _profile_tags.reset(self._token)
+
+    def write(self, directory, name, max_files):
+        """
+        Writes the profile to a file of a given name (with a timestamp prefix and the tags) in the directory,
+        then deletes the oldest profiles beyond `max_files`. Returns the path of the file.
+        """
+        tags = "-".join(f"{key}_{value}" for key, value in self.tags.items())
+        timestamp = datetime.datetime.now(tz=datetime.timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        file_name = "-".join(filter(None, (timestamp, name, tags, uuid_lib.uuid4().hex[:8]))) + PROFILE_SUFFIX
+
+        os.makedirs(directory, exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        with os.fdopen(file_descriptor, "w") as temp_file:
+            for stack, count in sorted(self.samples.items()):
+                temp_file.write(f"{stack} {count}\n")
+        path = os.path.join(directory, file_name)
+        os.replace(temp_path, path)
+
+        rotate_profiles(directory, max_files)
+        return path
+
+
+def rotate_profiles(directory, max_files):
+    """
+    Deletes the oldest profiles in the directory beyond `max_files`.
+    """
+    profiles = sorted(file_name for file_name in os.listdir(directory) if file_name.endswith(PROFILE_SUFFIX))
+    for file_name in profiles[: max(len(profiles) - max_files, 0)]:
+        try:
+            os.remove(os.path.join(directory, file_name))
+        except FileNotFoundError:
+            # Deleted meanwhile by another process
+            pass
+
+
+_stack_sampler = None
+_stack_sampler_lock = threading.Lock()
+
+
+def get_stack_sampler():
+    """
+    Returns the process-wide stack sampler, creating it from settings on first use.
+    """
+    global _stack_sampler
+
+    with _stack_sampler_lock:
+        if _stack_sampler is None:
+            _stack_sampler = StackSampler(interval=settings.PROFILER_INTERVAL)
+    return _stack_sampler
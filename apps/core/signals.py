@@ -0,0 +1,18 @@
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .timing import span
+
+
+def time_query(execute, sql, params, many, context):
+    with span("db"):
+        return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def add_query_timing(sender, connection, **kwargs):
+    """
+    Times the queries of every new database connection as `db` span of the request being timed (see apps.core.timing).
+    """
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
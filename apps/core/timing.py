@@ -0,0 +1,75 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Timing spans of the phases of a request (database queries, storage I/O, image decoding, resizing and encoding),
+# reported in `Server-Timing` response header and in a log line by apps.core.middleware.server_timing_middleware.
+# Spans are recorded only while a request is being timed, so they cost a single context variable lookup otherwise.
+
+_request_timing = contextvars.ContextVar("request_timing", default=None)
+
+
+class RequestTiming:
+    """
+    Total duration (seconds) and number of the spans of every phase of a request. Spans may be recorded
+    from worker threads running parts of the request (see `copy_context`).
+    """
+
+    def __init__(self):
+        self.spans = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, duration):
+        with self._lock:
+            total, count = self.spans.get(name, (0.0, 0))
+            self.spans[name] = (total + duration, count + 1)
+
+    def header(self, total):
+        """
+        Returns the value of `Server-Timing` header, with the durations (ms) of the phases and of the whole request.
+        """
+        metrics = [
+            f'{name};desc="{count}x";dur={duration * 1000:.1f}' for name, (duration, count) in self.spans.items()
+        ]
+        metrics.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(metrics)
+
+
+@contextmanager
+def start_request_timing():
+    """
+    Times the spans of the block (including those of the worker threads it copies its context to) and yields
+    their RequestTiming.
+    """
+    timing = RequestTiming()
+    token = _request_timing.set(timing)
+    try:
+        yield timing
+    finally:
+        _request_timing.reset(token)
+
+
+@contextmanager
+def span(name):
+    """
+    Adds the duration of the block to the span of a given name of the request being timed, if any.
+    """
+    timing = _request_timing.get()
+    if timing is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, time.perf_counter() - start)
+
+
+def copy_context():
+    """
+    Returns a copy of the current context, in which callables submitted to worker threads run with
+    `Context.run()` to record their spans in the request being timed.
+    """
+    return contextvars.copy_context()
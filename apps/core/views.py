@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import require_GET
+
+from .memory import get_top_offenders
+from .metrics import registry
+
+# Content type of Prometheus text exposition format
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@require_GET
+def metrics_view(request):
+    """
+    Returns the metrics of all processes in Prometheus text format, to staff users and to requests authorized
+    by `METRICS_AUTH_TOKEN` bearer token.
+    """
+    authorization = request.headers.get("Authorization", "")
+    token_authorized = settings.METRICS_AUTH_TOKEN and constant_time_compare(
+        authorization, f"Bearer {settings.METRICS_AUTH_TOKEN}"
+    )
+    if not token_authorized and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@require_GET
+def memory_offenders_view(request):
+    """
+    Returns the requests with the highest memory high-water marks (see apps.core.memory) to staff users.
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    return JsonResponse(
+        {
+            "tracking": settings.MEMORY_TRACKING,
+            "threshold_bytes": settings.MEMORY_TRACKING_THRESHOLD,
+            "offenders": get_top_offenders(),
+        }
+    )
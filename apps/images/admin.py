@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Image
+from .models import Image, ThumbnailRendition
 
 # Register your models here.
 
@@ -12,3 +12,12 @@ class ImageAdmin(admin.ModelAdmin):
     """
 
     list_display = ["account", "image", "alt", "uuid", "id"]
+
+
+@admin.register(ThumbnailRendition)
+class ThumbnailRenditionAdmin(admin.ModelAdmin):
+    """
+    Base admin for ThumbnailRendition model.
+    """
+
+    list_display = ["image", "height", "width", "format", "size", "storage_key", "generated_at"]
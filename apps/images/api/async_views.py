@@ -0,0 +1,288 @@
+import asyncio
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import Http404, JsonResponse
+from django.utils.cache import patch_vary_headers
+from PIL.Image import DecompressionBombError
+from rest_framework.exceptions import APIException, NotAcceptable, NotAuthenticated
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from apps.core.timing import copy_context
+from apps.plans.cache import get_user_plan
+
+from ..cache import get_thumbnail_cache
+from ..metrics import record_async_responses, thumbnail_requests
+from ..models import Image, ThumbnailRendition
+from ..tasks import get_render_executor, get_thumbnail_pool
+from .links import InvalidLink, get_link_time_to_expire, verify_expiring_link
+from .renderers import THUMBNAIL_RENDERER_CLASSES
+from .responses import afile_response, bytes_response
+from .utils import (
+    THUMBNAIL_FORMATS,
+    get_thumbnail_path,
+    index_thumbnail,
+    render_thumbnail,
+)
+from .views import (
+    get_expiring_link_cache_control,
+    get_image_content_type,
+    get_indexed_thumbnail_path,
+    get_thumbnail_cache_key,
+)
+
+# Async variants of ThumbnailRenderAPIView and ImageExpiringLinkAPIView (mounted instead of them when
+# `IMAGES_ASYNC_VIEWS` setting is enabled). The event loop only serves responses: database queries run through
+# `sync_to_async`, and file reads and thumbnail renders run in worker threads, so that a slow render does not hold
+# up other requests. Users are authenticated by `DEFAULT_AUTHENTICATION_CLASSES` of Django REST Framework, as in the
+# sync views; expiring links are verified by their signature alone.
+
+
+class ViewError(Exception):
+    """
+    Raised to answer the request with an error in the format of Django REST Framework.
+    """
+
+    def __init__(self, detail, status, headers=None):
+        super().__init__(detail)
+        self.detail = detail
+        self.status = status
+        self.headers = headers or {}
+
+    def response(self):
+        response = JsonResponse({"detail": self.detail}, status=self.status)
+        for header, value in self.headers.items():
+            response[header] = value
+        return response
+
+
+def require_safe(view):
+    """
+    Decorator of async views answering requests of other methods than GET and HEAD with 405 Method Not Allowed
+    (`django.views.decorators.http.require_safe` only decorates sync views in Django 3.2).
+    """
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return ViewError(
+                f'Method "{request.method}" not allowed.', status=405, headers={"Allow": "GET, HEAD"}
+            ).response()
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+@record_async_responses("thumbnail")
+@require_safe
+async def thumbnail_render_view(request, uuid, height):
+    """
+    Checks if the user has permission to generate and view thumbnails of requested height:
+    - if yes, looks the thumbnail up in the rendition index (if it is not indexed, waits for its background
+    render or generates and saves it in a worker thread) and returns it in the negotiated format,
+    - if not, returns 403 Forbidden.
+    """
+    try:
+        user = await sync_to_async(get_authenticated_user)(request)
+        thumbnail_format = get_thumbnail_format(request)
+        available_heights, encoder_profile = await sync_to_async(get_thumbnail_settings)(user)
+        if height not in available_heights:
+            raise ViewError(
+                f"Requested thumbnail height is not available for your user plan. "
+                f"Supported heights (px): {available_heights}.",
+                status=403,
+            )
+
+        # Serves the thumbnail from the in-memory cache, if enabled, without touching the filesystem
+        thumbnail_cache = get_thumbnail_cache()
+        cache_key = None
+        if thumbnail_cache is not None:
+            cache_key = await sync_to_async(get_thumbnail_cache_key)(
+                user, uuid, height, thumbnail_format, encoder_profile
+            )
+        cached_thumbnail = thumbnail_cache.get(cache_key) if cache_key is not None else None
+        if cached_thumbnail is not None and cached_thumbnail.owner == user.username:
+            thumbnail_requests.inc(source="memory")
+            return cached_thumbnail_response(request, cached_thumbnail, thumbnail_format)
+
+        thumbnail_file_path = await get_thumbnail_file_path(user, uuid, height, thumbnail_format, encoder_profile)
+        try:
+            return await thumbnail_response(
+                request, user, thumbnail_file_path, thumbnail_format, thumbnail_cache, cache_key
+            )
+        except FileNotFoundError:
+            # The index is stale (the file was removed from storage), so the thumbnail is generated again
+            await sync_to_async(
+                ThumbnailRendition.objects.filter(
+                    image__uuid=uuid, image__account=user, height=height, format=thumbnail_format
+                ).delete
+            )()
+            thumbnail_file_path = await get_thumbnail_file_path(user, uuid, height, thumbnail_format, encoder_profile)
+            return await thumbnail_response(
+                request, user, thumbnail_file_path, thumbnail_format, thumbnail_cache, cache_key
+            )
+
+    except ViewError as error:
+        return error.response()
+
+
+@record_async_responses("expiring_link")
+@require_safe
+async def image_expiring_link_view(request, uuid, expiry_time):
+    """
+    Checks if the provided link is valid and has not yet expired (verifying its signature, without any
+    database query). If the link is valid, returns the desired image (or its requested byte ranges).
+    """
+    try:
+        link = verify_expiring_link(uuid, request.GET)
+    except InvalidLink:
+        return ViewError("This link is not valid or has expired.", status=403).response()
+
+    expiry_time = min(expiry_time, get_link_time_to_expire(link))
+    try:
+        return await afile_response(
+            request,
+            default_storage.path(link.name),
+            content_type=get_image_content_type(link.name),
+            cache_control=get_expiring_link_cache_control(expiry_time),
+            accept_ranges=True,
+        )
+    except FileNotFoundError:
+        return ViewError("Not found.", status=404).response()
+
+
+def get_thumbnail_format(request):
+    """
+    Returns the thumbnail format negotiated from `Accept` header or `?format=` query parameter, in the same way
+    as ThumbnailRenderAPIView does, raising ViewError if none of the formats is acceptable.
+    """
+    negotiator = api_settings.DEFAULT_CONTENT_NEGOTIATION_CLASS()
+    renderers = [renderer_class() for renderer_class in THUMBNAIL_RENDERER_CLASSES]
+    try:
+        renderer, _ = negotiator.select_renderer(Request(request), renderers)
+    except NotAcceptable as error:
+        raise ViewError(str(error.detail), status=406)
+    except Http404:
+        raise ViewError("Not found.", status=404)
+    return renderer.image_format
+
+
+def get_thumbnail_settings(user):
+    """
+    Returns thumbnail heights (px) available to the user's plan and the plan's encoder profile.
+    """
+    plan = get_user_plan(user)
+    return plan.available_thumbnail_heights, plan.encoder_profile
+
+
+def get_authenticated_user(request):
+    """
+    Returns the user authenticated by `DEFAULT_AUTHENTICATION_CLASSES` of Django REST Framework, raising ViewError
+    if there is none or the given credentials are invalid.
+    """
+    authenticators = [authentication_class() for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    api_request = Request(request, authenticators=authenticators)
+    try:
+        user = api_request.user
+        if not user or not user.is_authenticated:
+            raise NotAuthenticated()
+    except APIException as error:
+        # As in APIView, the first authenticator decides between 401 Unauthorized (with its challenge) and 403
+        authenticate_header = authenticators[0].authenticate_header(api_request) if authenticators else None
+        if authenticate_header:
+            raise ViewError(str(error.detail), status=401, headers={"WWW-Authenticate": authenticate_header})
+        raise ViewError(str(error.detail), status=403)
+    return user
+
+
+async def get_thumbnail_file_path(user, uuid, height, thumbnail_format, encoder_profile=None):
+    """
+    Returns the path of the thumbnail in a given format of a given height (px) for the user's image of a given uuid.
+    Looks the thumbnail up in ThumbnailRendition index (see `get_indexed_thumbnail_path`). If it is not indexed,
+    waits for its background render or generates it with the given encoder profile in a worker thread (only once
+    for all concurrent requests) and indexes it.
+    """
+    indexed_thumbnail_file_path = await sync_to_async(get_indexed_thumbnail_path)(
+        user, uuid, height, thumbnail_format, encoder_profile
+    )
+    if indexed_thumbnail_file_path is not None:
+        thumbnail_requests.inc(source="index")
+        return indexed_thumbnail_file_path
+
+    source_image = await sync_to_async(Image.objects.filter(uuid=uuid).first)()
+    if source_image is None:
+        raise ViewError("Not found.", status=404)
+    if source_image.account_id != user.id:
+        raise ViewError("You are not authorized to view this thumbnail.", status=403)
+
+    thumbnail_file_path = get_thumbnail_path(
+        user, uuid, height, thumbnail_format, source_image.content_hash, encoder_profile
+    )
+    # The render runs in the request's context, so that its timing spans are recorded in the request
+    future = get_render_executor().submit(
+        copy_context().run,
+        wait_and_render_thumbnail,
+        source_image.image,
+        height,
+        thumbnail_file_path,
+        thumbnail_format,
+        encoder_profile,
+    )
+    if future is None:
+        raise ViewError("Too many thumbnails are being generated, please try again later.", status=503)
+    try:
+        rendered = await asyncio.wrap_future(future)
+    except DecompressionBombError:
+        raise ViewError("The image is too large to generate a thumbnail.", status=400)
+    thumbnail_requests.inc(source="render" if rendered else "file")
+
+    await sync_to_async(index_thumbnail)(source_image.id, height, thumbnail_file_path)
+    return thumbnail_file_path
+
+
+def wait_and_render_thumbnail(image_file, height, path, format, encoder_profile=None):
+    """
+    Waits for a queued background render of the thumbnail, if any, and renders it if it still does not exist.
+    Returns whether it was rendered.
+    """
+    get_thumbnail_pool().wait(path, timeout=settings.THUMBNAIL_WAIT_TIMEOUT)
+    return render_thumbnail(
+        image_file=image_file, height=height, path=path, format=format, encoder_profile=encoder_profile
+    )
+
+
+async def thumbnail_response(request, user, thumbnail_file_path, thumbnail_format, thumbnail_cache, cache_key):
+    """
+    Returns the rendered thumbnail, caching it in memory if the cache is enabled and the thumbnail is small enough.
+    """
+    if thumbnail_cache is not None and cache_key is not None:
+        cached_thumbnail = await sync_to_async(thumbnail_cache.load, thread_sensitive=False)(
+            cache_key, thumbnail_file_path, owner=user.username
+        )
+        if cached_thumbnail is not None:
+            return cached_thumbnail_response(request, cached_thumbnail, thumbnail_format)
+
+    response = await afile_response(
+        request,
+        thumbnail_file_path,
+        content_type=THUMBNAIL_FORMATS[thumbnail_format]["content_type"],
+        cache_control=settings.THUMBNAIL_CACHE_CONTROL,
+    )
+    patch_vary_headers(response, ["Accept"])
+    return response
+
+
+def cached_thumbnail_response(request, cached_thumbnail, thumbnail_format):
+    response = bytes_response(
+        request,
+        cached_thumbnail.data,
+        content_type=THUMBNAIL_FORMATS[thumbnail_format]["content_type"],
+        etag=cached_thumbnail.etag,
+        last_modified=cached_thumbnail.last_modified,
+        cache_control=settings.THUMBNAIL_CACHE_CONTROL,
+    )
+    patch_vary_headers(response, ["Accept"])
+    return response
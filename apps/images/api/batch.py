@@ -0,0 +1,137 @@
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.utils.datastructures import MultiValueDict
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.parsers import BaseParser, DataAndFiles
+
+from ..content import get_content_hash
+from .serializers import ImageBatchItemSerializer
+
+# Size (bytes) of the chunks in which archives are copied
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+class ZipArchiveParser(BaseParser):
+    """
+    Parses a request body holding a zip archive of images (`Content-Type: application/zip`).
+    The body is streamed to a temporary file (kept in memory up to `FILE_UPLOAD_MAX_MEMORY_SIZE` bytes) and exposed
+    as `archive` file. Bodies larger than `IMAGE_BATCH_MAX_BYTES` setting are refused without being read further.
+    """
+
+    media_type = "application/zip"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        archive = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        try:
+            size = copy_bounded(stream, archive, settings.IMAGE_BATCH_MAX_BYTES)
+        except ValueError:
+            archive.close()
+            raise ParseError(f"The archive is larger than {settings.IMAGE_BATCH_MAX_BYTES} bytes.")
+        return DataAndFiles({}, MultiValueDict({"archive": [UploadedFile(archive, name="archive.zip", size=size)]}))
+
+
+def copy_bounded(source, destination, max_size):
+    """
+    Copies the source file-like object to the destination one in chunks and returns the number of bytes copied.
+    Raises ValueError as soon as more than `max_size` bytes are read.
+    """
+    size = 0
+    while True:
+        chunk = source.read(COPY_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_size:
+            raise ValueError(f"More than {max_size} bytes read.")
+        destination.write(chunk)
+    destination.seek(0)
+    return size
+
+
+def get_batch_files(request):
+    """
+    Returns the image files of a batch upload: `images` parts of a multipart request, followed by the members
+    of a zip archive (`archive` part of a multipart request, or the body of an `application/zip` request).
+    Raises ValidationError if the batch has no files, or more files or bytes than `IMAGE_BATCH_MAX_FILES` and
+    `IMAGE_BATCH_MAX_BYTES` settings allow. Limits of the archive are checked against its directory, before any
+    of its members is extracted.
+    """
+    files = request.FILES.getlist("images")
+    archive = request.FILES.get("archive")
+    if archive is not None:
+        files += get_archive_files(archive)
+
+    if not files:
+        raise ValidationError({"images": "No images were uploaded."})
+    check_batch_limits(len(files), sum(file.size for file in files))
+    return files
+
+
+def check_batch_limits(count, size):
+    """
+    Raises ValidationError if a batch of `count` files of `size` bytes in total exceeds the batch limits.
+    """
+    if count > settings.IMAGE_BATCH_MAX_FILES:
+        raise ValidationError({"images": f"At most {settings.IMAGE_BATCH_MAX_FILES} images can be uploaded at once."})
+    if size > settings.IMAGE_BATCH_MAX_BYTES:
+        raise ValidationError(
+            {"images": f"At most {settings.IMAGE_BATCH_MAX_BYTES} bytes of images can be uploaded at once."}
+        )
+
+
+def get_archive_files(archive):
+    """
+    Extracts the files of the given zip archive (skipping directories and hidden files, e.g. macOS metadata)
+    into temporary files and returns them as uploaded files named after the members (without their directories).
+    """
+    try:
+        zip_file = zipfile.ZipFile(archive)
+    except zipfile.BadZipFile:
+        raise ValidationError({"archive": "The archive is not a valid zip file."})
+
+    with zip_file:
+        members = [member for member in zip_file.infolist() if is_archived_image(member)]
+        # Sizes declared by the archive are checked first, so that no zip bomb is ever extracted
+        check_batch_limits(len(members), sum(member.file_size for member in members))
+
+        files = []
+        for member in members:
+            extracted = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+            with zip_file.open(member) as source:
+                try:
+                    # The declared size is enforced, in case the archive lies about it
+                    size = copy_bounded(source, extracted, member.file_size)
+                except (ValueError, zipfile.BadZipFile):
+                    raise ValidationError({"archive": f"The archive member {member.filename} is corrupted."})
+            files.append(UploadedFile(extracted, name=os.path.basename(member.filename), size=size))
+        return files
+
+
+def is_archived_image(member):
+    """
+    Whether the zip archive member is a file which is not hidden (nor in a hidden directory).
+    """
+    hidden = any(part.startswith(".") or part == "__MACOSX" for part in member.filename.split("/"))
+    return not member.is_dir() and not hidden
+
+
+def validate_batch_files(files):
+    """
+    Validates the given image files in parallel (with `IMAGE_BATCH_VALIDATION_WORKERS` threads), in the same way
+    as single uploads are validated, and hashes the content of valid ones (see apps.images.content).
+    Returns validated data, or validation errors, of every file, in the order of the files.
+    """
+
+    def validate(file):
+        serializer = ImageBatchItemSerializer(data={"image": file})
+        if serializer.is_valid():
+            return {**serializer.validated_data, "content_hash": get_content_hash(file)}, None
+        return None, serializer.errors
+
+    with ThreadPoolExecutor(max_workers=settings.IMAGE_BATCH_VALIDATION_WORKERS) as executor:
+        return list(executor.map(validate, files))
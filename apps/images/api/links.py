@@ -0,0 +1,79 @@
+import math
+import time
+from collections import namedtuple
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+# Variant of the image an expiring link gives access to
+ORIGINAL_VARIANT = "original"
+
+SignedLink = namedtuple("SignedLink", ["uuid", "name", "expires", "variant"])
+
+
+class InvalidLink(Exception):
+    """
+    Raised when an expiring link is malformed, has an invalid signature or has expired.
+    """
+
+
+def get_link_signature(key_id, uuid, name, expires, variant):
+    """
+    Returns HMAC-SHA256 signature of the link's parameters with the signing key of a given id.
+    Raises KeyError if there is no such key in `EXPIRING_LINK_SIGNING_KEYS` setting.
+    """
+    value = f"{uuid}\n{name}\n{expires}\n{variant}"
+    key = settings.EXPIRING_LINK_SIGNING_KEYS[key_id]
+    return salted_hmac("apps.images.api.links", value, secret=key, algorithm="sha256").hexdigest()
+
+
+def get_expiring_link(uuid, name, expiry_time, variant=ORIGINAL_VARIANT):
+    """
+    Returns a link to the image of a given uuid, whose file is stored under the given name, valid for
+    at least `expiry_time` seconds. The link carries its expiry timestamp, variant, storage name and signature
+    (made with `EXPIRING_LINK_SIGNING_KEY_ID` key), so it is verified without any database query.
+    """
+    expires = math.ceil(time.time()) + expiry_time
+    key_id = settings.EXPIRING_LINK_SIGNING_KEY_ID
+    query_string = urlencode(
+        {
+            "expires": expires,
+            "variant": variant,
+            "name": name,
+            "key": key_id,
+            "signature": get_link_signature(key_id, uuid, name, expires, variant),
+        }
+    )
+    return settings.DEFAULT_MEDIA_DOMAIN + f"/api/v1/images/{uuid}/link/{expiry_time}/?{query_string}"
+
+
+def verify_expiring_link(uuid, query_params, variant=ORIGINAL_VARIANT):
+    """
+    Verifies the expiring link to the given variant of the image of a given uuid, given its query parameters.
+    Links signed with any key still listed in `EXPIRING_LINK_SIGNING_KEYS` setting are accepted, so signing keys
+    can be rotated without breaking links that have not expired yet.
+    Returns the verified SignedLink or raises InvalidLink.
+    """
+    try:
+        expires = int(query_params["expires"])
+        name = query_params["name"]
+        signature = get_link_signature(query_params["key"], uuid, name, expires, query_params["variant"])
+    except (KeyError, ValueError):
+        raise InvalidLink("The link is malformed or its signing key was revoked.")
+
+    if not constant_time_compare(signature, query_params.get("signature", "")):
+        raise InvalidLink("The link has an invalid signature.")
+    if query_params["variant"] != variant:
+        raise InvalidLink("The link does not give access to this variant of the image.")
+    if expires <= time.time():
+        raise InvalidLink("The link has expired.")
+
+    return SignedLink(uuid=uuid, name=name, expires=expires, variant=variant)
+
+
+def get_link_time_to_expire(link):
+    """
+    Returns the number of seconds (rounded up) the verified expiring link stays valid for.
+    """
+    return math.ceil(link.expires - time.time())
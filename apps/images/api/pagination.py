@@ -0,0 +1,21 @@
+from rest_framework.pagination import CursorPagination
+
+from apps.plans.cache import get_user_plan
+
+
+class ImageCursorPagination(CursorPagination):
+    """
+    Keyset (cursor) pagination for images, newest first.
+    Pages are fetched with the (account, created_at, id) index, so a deep page costs the same as the first one,
+    and no total count of images is queried.
+    Page size can be set per user plan (`Plan.images_page_size`); `page_size` is used otherwise.
+    """
+
+    ordering = ("-created_at", "-id")
+    page_size = 50
+
+    def get_page_size(self, request):
+        plan = get_user_plan(request.user) if request.user.is_authenticated else None
+        if plan is not None and plan.images_page_size:
+            return plan.images_page_size
+        return self.page_size
@@ -1,5 +1,7 @@
 from rest_framework import renderers
 
+from .utils import THUMBNAIL_FORMATS
+
 
 class JPEGRenderer(renderers.BaseRenderer):
     """
@@ -8,6 +10,7 @@ class JPEGRenderer(renderers.BaseRenderer):
 
     media_type = "image/jpeg"
     format = "jpg"
+    image_format = "JPEG"
     charset = None
     render_style = "binary"
 
@@ -22,8 +25,48 @@ class PNGRenderer(renderers.BaseRenderer):
 
     media_type = "image/png"
     format = "png"
+    image_format = "PNG"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, media_type=None, renderer_context=None):
+        return data
+
+
+class WebPRenderer(renderers.BaseRenderer):
+    """
+    Renderer for WebP type images.
+    """
+
+    media_type = "image/webp"
+    format = "webp"
+    image_format = "WEBP"
     charset = None
     render_style = "binary"
 
     def render(self, data, media_type=None, renderer_context=None):
         return data
+
+
+class AVIFRenderer(renderers.BaseRenderer):
+    """
+    Renderer for AVIF type images.
+    """
+
+    media_type = "image/avif"
+    format = "avif"
+    image_format = "AVIF"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, media_type=None, renderer_context=None):
+        return data
+
+
+# Renderers of the thumbnail formats supported by Pillow. The format is negotiated from `Accept` header or `?format=`
+# query parameter; JPEG comes first, as the default for clients accepting any image type.
+THUMBNAIL_RENDERER_CLASSES = [
+    renderer_class
+    for renderer_class in (JPEGRenderer, WebPRenderer, AVIFRenderer)
+    if renderer_class.image_format in THUMBNAIL_FORMATS
+]
@@ -0,0 +1,264 @@
+import os
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from apps.core.timing import span
+
+# Requests for more byte ranges than this are served the whole file, which guards against abusive range lists
+MAX_RANGES = 16
+RANGE_CHUNK_SIZE = 64 * 1024
+
+
+def get_file_validators(path):
+    """
+    Returns strong ETag and Last-Modified timestamp of the file at the given path, derived from its mtime and size.
+    """
+    with span("storage"):
+        stat = os.stat(path)
+    etag = quote_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+    return etag, int(stat.st_mtime)
+
+
+def file_response(request, path, content_type, cache_control=None, accept_ranges=False):
+    """
+    Returns a response serving the file at the given absolute path without reading it into memory.
+
+    Depending on `MEDIA_SENDFILE_BACKEND` setting, the file is:
+    - streamed by Django with FileResponse, which lets the WSGI server use `wsgi.file_wrapper` (i.e. `sendfile`),
+    - handed over to nginx with `X-Accel-Redirect` header pointing to `MEDIA_ACCEL_REDIRECT_PREFIX` location,
+    - handed over to Apache or lighttpd with `X-Sendfile` header.
+
+    The response carries `ETag`, `Last-Modified` and `Cache-Control` (built from `cache_control` directives) headers.
+    If the request's `If-None-Match` or `If-Modified-Since` precondition matches the file, `304 Not Modified`
+    is returned instead and the file is not opened at all.
+
+    If `accept_ranges` is True, `Range` requests (with `If-Range` validation) are answered with `206 Partial Content`
+    streaming only the requested byte ranges (see `get_requested_ranges`). The web servers of the sendfile backends
+    handle `Range` requests on their own.
+    """
+    etag, last_modified = get_file_validators(path)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        if settings.MEDIA_SENDFILE_BACKEND:
+            response = _file_response(path, content_type)
+        else:
+            ranges = get_requested_ranges(request, path, etag, last_modified) if accept_ranges else None
+            if ranges is not None:
+                response = _range_response(path, content_type, ranges)
+            else:
+                response = _file_response(path, content_type)
+                if accept_ranges:
+                    response["Accept-Ranges"] = "bytes"
+
+    return _patch_response(response, etag, last_modified, cache_control)
+
+
+async def afile_response(request, path, content_type, cache_control=None, accept_ranges=False):
+    """
+    Async variant of `file_response`, for async views. The file is either handed over to the web server
+    (see `MEDIA_SENDFILE_BACKEND` setting) or read in a worker thread and served from memory, as ASGI servers
+    would otherwise read a streamed file on the event loop. Only the requested byte ranges are read for `Range`
+    requests. Files (or byte ranges) larger than `IMAGES_ASYNC_MAX_BUFFERED_BYTES` setting are streamed instead,
+    so that they are never held in memory as a whole.
+    """
+    etag, last_modified = await sync_to_async(get_file_validators, thread_sensitive=False)(path)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        if settings.MEDIA_SENDFILE_BACKEND:
+            response = _file_response(path, content_type)
+        else:
+            ranges = None
+            if accept_ranges:
+                ranges = await sync_to_async(get_requested_ranges, thread_sensitive=False)(
+                    request, path, etag, last_modified
+                )
+            if ranges is not None:
+                size = sum(last - first + 1 for first, last in ranges)
+            else:
+                size = await sync_to_async(os.path.getsize, thread_sensitive=False)(path)
+            buffered = size <= settings.IMAGES_ASYNC_MAX_BUFFERED_BYTES
+
+            if ranges is not None:
+                response = await sync_to_async(_range_response, thread_sensitive=False)(
+                    path, content_type, ranges, streaming=not buffered
+                )
+            else:
+                if buffered:
+                    data = await sync_to_async(_read_file, thread_sensitive=False)(path)
+                    response = HttpResponse(data, content_type=content_type)
+                else:
+                    response = await sync_to_async(_file_response, thread_sensitive=False)(path, content_type)
+                if accept_ranges:
+                    response["Accept-Ranges"] = "bytes"
+
+    return _patch_response(response, etag, last_modified, cache_control)
+
+
+def bytes_response(request, data, content_type, etag, last_modified, cache_control=None):
+    """
+    Returns a response serving the given in-memory file content with the given validators.
+    Handles conditional requests and `Cache-Control` header in the same way as `file_response`.
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = HttpResponse(data, content_type=content_type)
+
+    return _patch_response(response, etag, last_modified, cache_control)
+
+
+def get_requested_ranges(request, path, etag, last_modified):
+    """
+    Returns the byte ranges of the file at the given path requested by `Range` header, as a sorted list of
+    (first, last) byte positions with overlapping ranges merged, or an empty list if none of them is satisfiable.
+    Returns None, meaning that the whole file is served, if the header is missing, malformed, lists more than
+    `MAX_RANGES` ranges, or if `If-Range` precondition does not match the file's current ETag or Last-Modified.
+    """
+    header = request.META.get("HTTP_RANGE")
+    if not header or request.method not in ("GET", "HEAD"):
+        return None
+
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if if_range is not None:
+        if if_range.startswith(("W/", '"')):
+            # Ranges are only served for an entity tag matching strongly (weak tags never match)
+            if if_range != etag:
+                return None
+        elif parse_http_date_safe(if_range) != last_modified:
+            return None
+
+    return parse_range_header(header, os.path.getsize(path))
+
+
+def parse_range_header(header, size):
+    """
+    Parses `Range` header of a request for a file of a given size (bytes). See `get_requested_ranges`.
+    """
+    unit, _, range_set = header.partition("=")
+    specs = range_set.split(",")
+    if unit.strip().lower() != "bytes" or len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        first, separator, last = spec.strip().partition("-")
+        if not separator or not (first + last).isdigit():
+            return None
+
+        if not first:
+            # Suffix range: the last `last` bytes of the file
+            if int(last) > 0 and size > 0:
+                ranges.append((max(size - int(last), 0), size - 1))
+            continue
+
+        first, last = int(first), int(last) if last else None
+        if last is not None and last < first:
+            return None
+        if first < size:
+            ranges.append((first, size - 1 if last is None else min(last, size - 1)))
+
+    merged_ranges = []
+    for first, last in sorted(ranges):
+        if merged_ranges and first <= merged_ranges[-1][1] + 1:
+            merged_ranges[-1] = (merged_ranges[-1][0], max(merged_ranges[-1][1], last))
+        else:
+            merged_ranges.append((first, last))
+    return merged_ranges
+
+
+def _range_response(path, content_type, ranges, streaming=True):
+    """
+    Returns `206 Partial Content` response with the given byte ranges of the file (a single part or
+    `multipart/byteranges`), streamed from the file unless `streaming` is False, or `416 Range Not Satisfiable`
+    if there are no ranges.
+    """
+    size = os.path.getsize(path)
+    if not ranges:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    if len(ranges) == 1:
+        # Every part is a (header, first, last) triple; a single range is sent as is, with no part header
+        parts = [(b"", *ranges[0])]
+        closing = b""
+        response_content_type = content_type
+    else:
+        boundary = uuid.uuid4().hex
+        parts = [
+            (
+                (b"\r\n" if number else b"")
+                + f"--{boundary}\r\nContent-Type: {content_type}\r\n".encode()
+                + f"Content-Range: bytes {first}-{last}/{size}\r\n\r\n".encode(),
+                first,
+                last,
+            )
+            for number, (first, last) in enumerate(ranges)
+        ]
+        closing = f"\r\n--{boundary}--\r\n".encode()
+        response_content_type = f"multipart/byteranges; boundary={boundary}"
+
+    content = _iter_ranges(path, parts, closing)
+    if streaming:
+        response = StreamingHttpResponse(content, status=206, content_type=response_content_type)
+    else:
+        response = HttpResponse(b"".join(content), status=206, content_type=response_content_type)
+
+    if len(ranges) == 1:
+        response["Content-Range"] = f"bytes {ranges[0][0]}-{ranges[0][1]}/{size}"
+    response["Content-Length"] = sum(len(header) + last - first + 1 for header, first, last in parts) + len(closing)
+    response["Accept-Ranges"] = "bytes"
+    return response
+
+
+def _iter_ranges(path, parts, closing):
+    with open(path, "rb") as file:
+        for header, first, last in parts:
+            yield header
+            file.seek(first)
+            remaining = last - first + 1
+            while remaining > 0:
+                chunk = file.read(min(RANGE_CHUNK_SIZE, remaining))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+    yield closing
+
+
+def _patch_response(response, etag, last_modified, cache_control):
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    if cache_control:
+        patch_cache_control(response, **cache_control)
+    return response
+
+
+def _read_file(path):
+    with span("storage"), open(path, "rb") as file:
+        return file.read()
+
+
+def _file_response(path, content_type):
+    backend = settings.MEDIA_SENDFILE_BACKEND
+
+    if backend == "x-accel-redirect":
+        response = HttpResponse(content_type=content_type)
+        relative_path = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, "/")
+        response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + relative_path
+        return response
+
+    if backend == "x-sendfile":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = os.fspath(path)
+        return response
+
+    with span("storage"):
+        file = open(path, "rb")
+    return FileResponse(file, content_type=content_type)
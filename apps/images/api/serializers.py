@@ -1,8 +1,20 @@
 from django.conf import settings
 from rest_framework import serializers
-from rest_framework.serializers import ValidationError
 
-from ..models import Image
+from apps.plans.cache import get_account_plan, get_user_plan
+
+from ..models import Image, ThumbnailRendition
+from ..validators import validate_image_file
+
+
+class ThumbnailRenditionSerializer(serializers.ModelSerializer):
+    """
+    Serializer for ThumbnailRendition model.
+    """
+
+    class Meta:
+        model = ThumbnailRendition
+        fields = ["height", "width", "format", "size", "generated_at"]
 
 
 class ImageSerializer(serializers.ModelSerializer):
@@ -10,32 +22,32 @@ class ImageSerializer(serializers.ModelSerializer):
     Serializer for Image model.
     """
 
+    # A plain file field, validated in a single pass reading only the file's header (see `validate_image_file`),
+    # instead of an image field, which reads the whole upload into memory to verify it with Pillow
+    image = serializers.FileField(validators=[validate_image_file], help_text=Image._meta.get_field("image").help_text)
+
     class Meta:
         model = Image
         fields = ["id", "account", "image", "alt", "uuid"]
 
-    def validate_image(self, value):
-        """
-        Validates that the image field contains a file with PNG or JPEG extension.
-        """
-        valid_extensions = [".png", ".jpg", ".jpeg"]
-        image_filename = value.name.lower()
-        for extension in valid_extensions:
-            if image_filename.endswith(extension):
-                return value
-        else:
-            raise ValidationError("Unsupported file extension. Only PNG and JPEG files are supported.")
-
     def to_representation(self, instance):
         """
-        Adds `thumbnails` field to json response and checks if the requesting user's plan:
+        Adds `thumbnails` field to json response and checks if the image owner's plan
+        (taken from `plan` in serializer context, if provided):
         - authorizes to access original image; if yes, returns a link for the original image,
-        - provides possible thumbnail heights; if yes, returns links to thumbnails of given heights.
+        - provides possible thumbnail heights; if yes, returns links to thumbnails of given heights
+        and details of the thumbnails already rendered (from ThumbnailRendition index).
         """
         representation = super().to_representation(instance)
 
         # Check if the user can access original image and if no, hides its link
-        plan = instance.account.plan
+        plan = self.context.get("plan")
+        if plan is None:
+            # Looks the plan up by the owner's id (from the plan cache), unless the owner is loaded already
+            if Image.account.field.is_cached(instance):
+                plan = get_user_plan(instance.account)
+            else:
+                plan = get_account_plan(instance.account_id)
         if not plan.can_access_original_image:
             representation["image"] = "Original image is not available for your user plan."
 
@@ -47,7 +59,23 @@ class ImageSerializer(serializers.ModelSerializer):
                 representation["thumbnails"][f"{height}px"] = (
                     settings.DEFAULT_MEDIA_DOMAIN + f"/api/v1/images/{instance.uuid}/{height}/"
                 )
+            renditions = [
+                rendition for rendition in instance.renditions.all() if rendition.height in available_heights
+            ]
+            representation["renditions"] = ThumbnailRenditionSerializer(renditions, many=True).data
         else:
             representation["thumbnails"] = "Thumbnails are not available for your user plan."
+            representation["renditions"] = []
 
         return representation
+
+
+class ImageBatchItemSerializer(ImageSerializer):
+    """
+    Serializer validating a single image file of a batch upload (see apps.images.api.batch), in the same way as
+    ImageSerializer validates uploaded images. The owner is always the requesting user, so validation makes no
+    database queries and can run in worker threads.
+    """
+
+    class Meta(ImageSerializer.Meta):
+        fields = ["image"]
@@ -1,19 +1,423 @@
-from imagekit import ImageSpec
+import datetime
+import fcntl
+import hashlib
+import io
+import logging
+import math
+import os
+import tempfile
+import time
+from array import array
+from contextlib import ExitStack, contextmanager
+
+import PIL
+from django.conf import settings
 from imagekit.processors import ResizeToFit
+from imagekit.utils import open_image, process_image
+from PIL import ImageMath, features
+from PIL.Image import DecompressionBombError
+
+from apps.core.memory import memory_section, tag_memory
+from apps.core.profiling import tag_profile
+from apps.core.timing import span
+
+from ..content import get_thumbnail_directory
+from ..metrics import thumbnail_decode_seconds, thumbnail_render_seconds
+from ..models import ThumbnailRendition
+
+# Default thumbnail format, served unless another one is requested (see apps.images.api.renderers)
+THUMBNAIL_FORMAT = "JPEG"
+
+# Encoder settings of the thumbnail formats (Pillow format names), with their file extensions and content types
+THUMBNAIL_FORMATS = {
+    "JPEG": {"extension": "jpg", "content_type": "image/jpeg", "options": {"quality": 60}},
+    "WEBP": {"extension": "webp", "content_type": "image/webp", "options": {"quality": 60, "method": 4}},
+    "AVIF": {"extension": "avif", "content_type": "image/avif", "options": {"quality": 50}},
+}
+if not features.check("avif"):
+    # AVIF encoding is only available in recent Pillow builds
+    del THUMBNAIL_FORMATS["AVIF"]
+
+# Image modes supported by `PIL.Image.reduce()`
+REDUCIBLE_MODES = ("L", "LA", "RGB", "RGBA", "CMYK", "YCbCr", "I", "F")
+
+# Size (px) of the blocks over which structural similarity is computed, and its stabilizing constants
+SSIM_BLOCK_SIZE = 8
+SSIM_C1 = (0.01 * 255) ** 2
+SSIM_C2 = (0.03 * 255) ** 2
+
+# Number of lock files the thumbnail paths are hashed to (see `get_thumbnail_lock_path`)
+THUMBNAIL_LOCK_COUNT = 1024
+
+logger = logging.getLogger(__name__)
+
+
+def get_rendition_version(format=THUMBNAIL_FORMAT, encoder_profile=None):
+    """
+    Returns a short identifier of the encoder settings of thumbnails in a given format (with the given encoder
+    profile, if any), which changes whenever rendered thumbnails would.
+    """
+    encoder_settings = f"{format}:{sorted(get_encoder_options(format, encoder_profile).items())}"
+    if encoder_profile is not None:
+        encoder_settings += (
+            f":{encoder_profile.strip_metadata}:{encoder_profile.target_bits_per_pixel}:{encoder_profile.target_ssim}"
+            f":{encoder_profile.min_quality}:{encoder_profile.max_quality}"
+        )
+    return hashlib.md5(encoder_settings.encode()).hexdigest()[:8]
+
+
+def get_encoder_options(format, encoder_profile=None, quality=None):
+    """
+    Returns Pillow encoder options of thumbnails in a given format with the given encoder profile
+    (apps.plans.models.EncoderProfile), or the default options of the format if there is no profile.
+    `quality` overrides the quality of the profile.
+    """
+    if encoder_profile is None:
+        return dict(THUMBNAIL_FORMATS[format]["options"])
+
+    options = {"quality": encoder_profile.quality if quality is None else quality}
+    if format == "JPEG":
+        options["optimize"] = encoder_profile.optimize
+        options["progressive"] = encoder_profile.progressive
+    elif format == "WEBP":
+        options["method"] = 6 if encoder_profile.optimize else 4
+    elif format == "AVIF":
+        options["speed"] = 4 if encoder_profile.optimize else 6
+    return options
+
+
+def get_thumbnail_path(username, uuid, height, format=THUMBNAIL_FORMAT, content_hash="", encoder_profile=None):
+    """
+    Returns the absolute path of the thumbnail in a given format of a given height (px) for the image of a given uuid.
+    Thumbnails of images stored by content hash are shared by all images with identical content: they are stored
+    by the hash, height and rendition version (see `get_rendition_version`) instead of the image's uuid.
+    """
+    extension = THUMBNAIL_FORMATS[format]["extension"]
+    if content_hash:
+        version = get_rendition_version(format, encoder_profile)
+        return os.path.join(
+            settings.MEDIA_ROOT, get_thumbnail_directory(content_hash), f"{height}-{version}.{extension}"
+        )
+    return os.path.join(settings.MEDIA_ROOT, f"images/{username}/{uuid}/{height}-{uuid}.{extension}")
+
+
+def write_file_atomic(path, data):
+    """
+    Writes data to a temporary file next to the given path and atomically renames it into place,
+    so that readers never observe a partially written file.
+    """
+    directory, filename = os.path.split(path)
+    with span("storage"):
+        os.makedirs(directory, exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{filename}.", suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "wb") as temp_file:
+                temp_file.write(data)
+            os.chmod(temp_path, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+
+def get_thumbnail_lock_path(path):
+    """
+    Returns the path of the lock file of the thumbnail at the given path, in `THUMBNAIL_LOCK_DIRECTORY`.
+    Thumbnail paths are hashed to one of `THUMBNAIL_LOCK_COUNT` lock files, so that their number stays bounded;
+    thumbnails sharing a lock file are merely never rendered at the same time.
+    """
+    number = int.from_bytes(hashlib.sha256(os.fsencode(path)).digest()[:4], "big") % THUMBNAIL_LOCK_COUNT
+    return os.path.join(settings.THUMBNAIL_LOCK_DIRECTORY, f"{number}.lock")
+
+
+@contextmanager
+def thumbnail_lock(path, timeout=None):
+    """
+    Holds an exclusive lock for generating the thumbnail at the given path, shared by all threads and worker
+    processes on the host (`flock` on its lock file, see `get_thumbnail_lock_path`).
+    Waits at most `timeout` seconds (forever if None) and yields whether the lock was acquired.
+    """
+    with file_lock(get_thumbnail_lock_path(path), timeout=timeout) as acquired:
+        yield acquired
+
+
+@contextmanager
+def thumbnail_locks(paths, timeout=None):
+    """
+    Holds `thumbnail_lock` of all the given paths, acquired in a fixed order to avoid deadlocks (and only once for
+    paths sharing a lock file). Yields the paths whose locks were acquired.
+    """
+    lock_paths = {path: get_thumbnail_lock_path(path) for path in paths}
+    with ExitStack() as stack:
+        acquired_lock_paths = {
+            lock_path
+            for lock_path in sorted(set(lock_paths.values()))
+            if stack.enter_context(file_lock(lock_path, timeout=timeout))
+        }
+        yield [path for path in sorted(lock_paths) if lock_paths[path] in acquired_lock_paths]
+
+
+@contextmanager
+def file_lock(lock_path, timeout=None):
+    """
+    Holds an exclusive `flock` on the file at the given path (created if needed), waiting at most `timeout` seconds
+    (forever if None), and yields whether the lock was acquired.
+    """
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, "a") as lock_file:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | (0 if deadline is None else fcntl.LOCK_NB))
+                acquired = True
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    acquired = False
+                    break
+                time.sleep(0.05)
+
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def decode_image(image_file, height):
+    """
+    Decodes the given image at the smallest scale that still covers the given height (px).
+    JPEG images are decoded at a reduced resolution (DCT scaling in draft mode). Other formats are decoded fully
+    and then reduced by the largest integer factor that keeps them at least `height` px tall.
+    Raises DecompressionBombError before decoding if the image has more pixels than `IMAGE_MAX_PIXELS` setting.
+    """
+    img = open_image(image_file)
+    full_width, full_height = img.size
+    tag_profile(source=f"{full_width}x{full_height}")
+    tag_memory(source_pixels=full_width * full_height)
+    if full_width * full_height > settings.IMAGE_MAX_PIXELS:
+        raise DecompressionBombError(
+            f"Image size ({full_width * full_height} pixels) exceeds limit of {settings.IMAGE_MAX_PIXELS} pixels."
+        )
+
+    if height >= full_height:
+        img.load()
+        return img
+
+    target_size = (math.ceil(full_width * height / full_height), height)
+    img.draft(None, target_size)  # no-op for formats other than JPEG
+    img.load()
+
+    factor = min(img.width // target_size[0], img.height // target_size[1])
+    if factor >= 2 and img.mode in REDUCIBLE_MODES:
+        img = img.reduce(factor)
+    return img
+
+
+def get_structural_similarity(reference, image):
+    """
+    Returns the structural similarity (SSIM) of the luma of the given image to the reference image of the same size,
+    averaged over blocks of `SSIM_BLOCK_SIZE` px (1.0 for identical images).
+    """
+    x = reference.convert("L").convert("F")
+    y = image.convert("L").convert("F")
+    # Means of x, y, x², y² and xy over every block
+    block_means = [
+        array("f", block_image.reduce(SSIM_BLOCK_SIZE).tobytes())
+        for block_image in (x, y, multiply_images(x, x), multiply_images(y, y), multiply_images(x, y))
+    ]
+
+    total = 0.0
+    for mean_x, mean_y, mean_xx, mean_yy, mean_xy in zip(*block_means):
+        variance_x = mean_xx - mean_x**2
+        variance_y = mean_yy - mean_y**2
+        covariance = mean_xy - mean_x * mean_y
+        total += ((2 * mean_x * mean_y + SSIM_C1) * (2 * covariance + SSIM_C2)) / (
+            (mean_x**2 + mean_y**2 + SSIM_C1) * (variance_x + variance_y + SSIM_C2)
+        )
+    return total / len(block_means[0])
+
+
+def multiply_images(a, b):
+    """
+    Returns the pixel-wise product of two images of "F" mode.
+    """
+    if hasattr(ImageMath, "lambda_eval"):
+        return ImageMath.lambda_eval(lambda args: args["a"] * args["b"], a=a, b=b)
+    # Pillow < 10.3
+    return ImageMath.eval("a * b", a=a, b=b)
+
+
+def encode_thumbnail(thumbnail, format=THUMBNAIL_FORMAT, encoder_profile=None):
+    """
+    Encodes the thumbnail in a given format with the settings of the given encoder profile
+    (the default settings of the format if there is no profile) and returns the encoded data.
+
+    If the profile sets a byte budget, the quality is binary-searched for the highest one whose thumbnail fits in it.
+    If it sets a structural similarity target, the quality is binary-searched for the lowest one (up to the one
+    fitting the byte budget) whose thumbnail reaches it. Both searches stay within the profile's quality range.
+    """
+    extra_options = {}
+    if encoder_profile is not None and not encoder_profile.strip_metadata:
+        extra_options = {key: thumbnail.info[key] for key in ("exif", "icc_profile") if thumbnail.info.get(key)}
+
+    encoded = {}
+
+    def encode(quality=None):
+        if quality not in encoded:
+            options = {**get_encoder_options(format, encoder_profile, quality=quality), **extra_options}
+            encoded[quality] = process_image(thumbnail, format=format, options=options).read()
+        return encoded[quality]
+
+    if encoder_profile is None or not encoder_profile.searches_quality:
+        return encode()
+
+    quality = encoder_profile.max_quality
+    if encoder_profile.target_bits_per_pixel is not None:
+        max_size = encoder_profile.target_bits_per_pixel * thumbnail.width * thumbnail.height / 8
+        fitting_quality = search_quality(encoder_profile.min_quality, quality, lambda q: len(encode(q)) <= max_size)
+        quality = encoder_profile.min_quality if fitting_quality is None else fitting_quality
+    if encoder_profile.target_ssim is not None:
+
+        def is_below_target(q):
+            decoded = PIL.Image.open(io.BytesIO(encode(q)))
+            return get_structural_similarity(thumbnail, decoded) < encoder_profile.target_ssim
 
+        # The quality next to the highest one still short of the target is the lowest one reaching it
+        below_quality = search_quality(encoder_profile.min_quality, quality, is_below_target)
+        if below_quality is None:
+            quality = encoder_profile.min_quality
+        elif below_quality < quality:
+            quality = below_quality + 1
+    return encode(quality)
 
-def create_thumbnail(image_file, height, path):
+
+def search_quality(min_quality, max_quality, predicate):
+    """
+    Binary-searches for the highest quality between `min_quality` and `max_quality` (inclusive) for which
+    `predicate(quality)` holds, given that it holds for all qualities below some threshold and for none above it.
+    Returns None if it does not hold for any of them.
+    """
+    found = None
+    while min_quality <= max_quality:
+        quality = (min_quality + max_quality) // 2
+        if predicate(quality):
+            found = quality
+            min_quality = quality + 1
+        else:
+            max_quality = quality - 1
+    return found
+
+
+def create_thumbnails(image_file, thumbnail_paths, format=THUMBNAIL_FORMAT, encoder_profile=None):
     """
-    Creates thumbnail from the given image of a given height (px) and saves it to the given path.
+    Creates thumbnails of several heights (px) in a given format from the given image and saves each of them
+    to its path, encoded with the given encoder profile (see `encode_thumbnail`).
+    `thumbnail_paths` maps every height to the path of its thumbnail.
+
+    The original image is decoded only once, at the smallest scale that covers the largest height (see `decode_image`).
+    Thumbnails are rendered from the largest height to the smallest one, each of them resized from the previous
+    (larger) thumbnail instead of the decoded original. Upscaled thumbnails are never used as a source.
+    Returns the time (seconds) spent decoding the original and rendering (resize, encode, write) each height,
+    the size (bytes) of each thumbnail and, with an encoder profile and `THUMBNAIL_REPORT_BYTES_SAVED` setting enabled,
+    the bytes it saved on each of them compared to the default encoder settings (negative if the thumbnail is larger).
     """
+    timings = {"decode": 0.0, "heights": {}, "sizes": {}, "bytes_saved": {}}
+
+    start = time.perf_counter()
+    closed = image_file.closed
+    if closed:
+        image_file.open()
+    try:
+        with span("decode"):
+            original = decode_image(image_file, max(thumbnail_paths))
+    finally:
+        if closed:
+            image_file.close()
+    timings["decode"] = time.perf_counter() - start
+    thumbnail_decode_seconds.observe(timings["decode"])
+
+    source = original
+    for height in sorted(thumbnail_paths, reverse=True):
+        start = time.perf_counter()
+
+        # Heights above the previous thumbnail (i.e. upscaled ones) are derived from the original instead
+        if source.height < height:
+            source = original
+        with span("resize"):
+            thumbnail = ResizeToFit(height=height, upscale=True).process(source)
+        with span("encode"):
+            data = encode_thumbnail(thumbnail, format=format, encoder_profile=encoder_profile)
+
+        write_file_atomic(thumbnail_paths[height], data)
+
+        source = thumbnail if thumbnail.height <= original.height else original
+        timings["heights"][height] = time.perf_counter() - start
+        timings["sizes"][height] = len(data)
+        thumbnail_render_seconds.observe(timings["heights"][height], format=format)
+
+        if encoder_profile is not None and settings.THUMBNAIL_REPORT_BYTES_SAVED:
+            # Reported outside of the render timing, as the thumbnail is encoded again with the default settings
+            with span("encode"):
+                bytes_saved = len(encode_thumbnail(thumbnail, format=format)) - len(data)
+            timings["bytes_saved"][height] = bytes_saved
+            logger.info(
+                "Encoded %spx %s thumbnail with %r encoder profile in %s bytes (%s bytes saved).",
+                height,
+                format,
+                encoder_profile.name,
+                len(data),
+                bytes_saved,
+            )
 
-    class Thumbnail(ImageSpec):
-        processors = [ResizeToFit(height=height, upscale=True)]
-        format = "JPEG"
-        options = {"quality": 60}
+    return timings
 
-    thumbnail_generator = Thumbnail(source=image_file)
-    data = thumbnail_generator.generate()
 
-    with open(path, "wb") as thumbnail:
-        thumbnail.write(data.read())
+def render_thumbnail(image_file, height, path, format=THUMBNAIL_FORMAT, encoder_profile=None):
+    """
+    Creates thumbnail in a given format from the given image of a given height (px) at the given path, unless it
+    exists already. Renders it only once for all concurrent threads and processes, which wait for the winner's
+    result instead. Returns whether the thumbnail was rendered by this call.
+    """
+    with thumbnail_lock(path, timeout=settings.THUMBNAIL_LOCK_TIMEOUT):
+        with span("storage"):
+            exists = os.path.exists(path)
+        if exists:
+            return False
+        create_thumbnail(
+            image_file=image_file, height=height, path=path, format=format, encoder_profile=encoder_profile
+        )
+        return True
+
+
+def index_thumbnail(image_id, height, path):
+    """
+    Records the thumbnail file of a given height (px) at the given path in ThumbnailRendition index
+    (creating or updating its entry). Reads only the file's header and metadata.
+    """
+    with span("storage"):
+        with PIL.Image.open(path) as thumbnail:
+            width = thumbnail.width
+            format = thumbnail.format
+        stat = os.stat(path)
+
+    rendition, _ = ThumbnailRendition.objects.update_or_create(
+        image_id=image_id,
+        height=height,
+        format=format,
+        defaults={
+            "width": width,
+            "size": stat.st_size,
+            "storage_key": os.path.relpath(path, settings.MEDIA_ROOT),
+            "generated_at": datetime.datetime.fromtimestamp(stat.st_mtime, tz=datetime.timezone.utc),
+        },
+    )
+    return rendition
+
+
+def create_thumbnail(image_file, height, path, format=THUMBNAIL_FORMAT, encoder_profile=None):
+    """
+    Creates thumbnail in a given format from the given image of a given height (px) and saves it to the given path.
+    """
+    with memory_section("render"):
+        return create_thumbnails(image_file, {height: path}, format=format, encoder_profile=encoder_profile)
@@ -1,59 +1,94 @@
-import os
-
 from django.conf import settings
 from django.core.files.storage import default_storage
-from rest_framework.exceptions import PermissionDenied
+from django.utils.cache import patch_vary_headers
+from PIL.Image import DecompressionBombError
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 from rest_framework.generics import RetrieveAPIView
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
-from sesame.utils import get_query_string, get_user
 
-from ..models import Image
+from apps.plans.cache import get_user_plan
+
+from ..cache import get_thumbnail_cache
+from ..metrics import record_response, thumbnail_requests
+from ..models import Image, ThumbnailRendition
+from ..tasks import get_thumbnail_pool
+from .links import (
+    InvalidLink,
+    get_expiring_link,
+    get_link_time_to_expire,
+    verify_expiring_link,
+)
 from .permissions import IsOwner
-from .renderers import JPEGRenderer, PNGRenderer
-from .utils import create_thumbnail
+from .renderers import THUMBNAIL_RENDERER_CLASSES, JPEGRenderer, PNGRenderer
+from .responses import bytes_response, file_response
+from .utils import (
+    THUMBNAIL_FORMATS,
+    get_rendition_version,
+    get_thumbnail_path,
+    index_thumbnail,
+    render_thumbnail,
+)
 
 
 class ThumbnailRenderAPIView(RetrieveAPIView):
     """
     Base detail view for viewing a rendered thumbnail.
-    Output in JPEG format.
+    Output in JPEG, WebP or AVIF format, negotiated from `Accept` header or `?format=` query parameter.
     """
 
     permission_classes = (IsAuthenticated, IsOwner)
-    renderer_classes = [JPEGRenderer]
+    renderer_classes = THUMBNAIL_RENDERER_CLASSES
 
     def get(self, request, *args, **kwargs):
         """
         Checks if the user has permission to generate and view thumbnails of requested height:
-        - if yes, checks if such thumbnail exists at MEDIA ROOT (if not, generates and saves it)
-        and returns it in JPEG format,
+        - if yes, looks the thumbnail up in the rendition index (if it is not indexed, waits for its background
+        render or generates and saves it) and returns it in the negotiated format,
         - if not, raises PermissionDenied error.
         """
         request_height = self.kwargs["height"]
         request_uuid = self.kwargs["uuid"]
-        available_heights = request.user.plan.available_thumbnail_heights
+        thumbnail_format = request.accepted_renderer.image_format
+        plan = get_user_plan(request.user)
+        available_heights = plan.available_thumbnail_heights
+        encoder_profile = plan.encoder_profile
 
         # Checks if the requested height is available and if yes, returns a response with the thumbnail
         if request_height in available_heights:
-            thumbnail_file_path = os.path.join(
-                settings.MEDIA_ROOT, f"images/{request.user}/{request_uuid}/{request_height}-{request_uuid}.jpg"
-            )
+            # Serves the thumbnail from the in-memory cache, if enabled, without touching the filesystem
+            thumbnail_cache = get_thumbnail_cache()
+            cache_key = None
+            if thumbnail_cache is not None:
+                cache_key = get_thumbnail_cache_key(
+                    request.user, request_uuid, request_height, thumbnail_format, encoder_profile
+                )
+            cached_thumbnail = thumbnail_cache.get(cache_key) if cache_key is not None else None
+            if cached_thumbnail is not None and cached_thumbnail.owner == request.user.username:
+                thumbnail_requests.inc(source="memory")
+                return self.cached_thumbnail_response(request, cached_thumbnail, thumbnail_format)
 
-            # Checks if the thumbnail file exists and if not, creates it
-            thumbnail_exists = default_storage.exists(thumbnail_file_path)
-            if not thumbnail_exists:
-                source_image = Image.objects.get(uuid=self.kwargs["uuid"])
-                if source_image.account == request.user:
-                    source_image_file = source_image.image
-                    create_thumbnail(image_file=source_image_file, height=request_height, path=thumbnail_file_path)
-                else:
-                    raise PermissionDenied("You are not authorized to view this thumbnail.")
-
-            # Returns the rendered thumbnail
-            with open(thumbnail_file_path, "rb") as thumbnail:
-                data = thumbnail.read()
-                return Response(data, content_type="image/jpeg")
+            thumbnail_file_path = self.get_thumbnail_file_path(
+                request, request_uuid, request_height, thumbnail_format, encoder_profile
+            )
+            try:
+                return self.thumbnail_response(
+                    request, thumbnail_file_path, thumbnail_format, thumbnail_cache, cache_key
+                )
+            except FileNotFoundError:
+                # The index is stale (the file was removed from storage), so the thumbnail is generated again
+                ThumbnailRendition.objects.filter(
+                    image__uuid=request_uuid,
+                    image__account=request.user,
+                    height=request_height,
+                    format=thumbnail_format,
+                ).delete()
+                thumbnail_file_path = self.get_thumbnail_file_path(
+                    request, request_uuid, request_height, thumbnail_format, encoder_profile
+                )
+                return self.thumbnail_response(
+                    request, thumbnail_file_path, thumbnail_format, thumbnail_cache, cache_key
+                )
 
         else:
             raise PermissionDenied(
@@ -61,6 +96,82 @@ class ThumbnailRenderAPIView(RetrieveAPIView):
                 f"Supported heights (px): {available_heights}."
             )
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        record_response("thumbnail", response)
+        return response
+
+    def get_thumbnail_file_path(self, request, uuid, height, thumbnail_format, encoder_profile=None):
+        """
+        Returns the path of the thumbnail in a given format of a given height (px) for the requesting user's image
+        of a given uuid. Looks the thumbnail up in ThumbnailRendition index (see `get_indexed_thumbnail_path`).
+        If it is not indexed, waits for its background render or generates it with the given encoder profile
+        (only once for all concurrent requests) and indexes it.
+        """
+        indexed_thumbnail_file_path = get_indexed_thumbnail_path(
+            request.user, uuid, height, thumbnail_format, encoder_profile
+        )
+        if indexed_thumbnail_file_path is not None:
+            thumbnail_requests.inc(source="index")
+            return indexed_thumbnail_file_path
+
+        source_image = Image.objects.filter(uuid=uuid).first()
+        if source_image is None:
+            raise NotFound()
+        if source_image.account_id != request.user.id:
+            raise PermissionDenied("You are not authorized to view this thumbnail.")
+
+        thumbnail_file_path = get_thumbnail_path(
+            request.user, uuid, height, thumbnail_format, source_image.content_hash, encoder_profile
+        )
+        get_thumbnail_pool().wait(thumbnail_file_path, timeout=settings.THUMBNAIL_WAIT_TIMEOUT)
+
+        try:
+            rendered = render_thumbnail(
+                image_file=source_image.image,
+                height=height,
+                path=thumbnail_file_path,
+                format=thumbnail_format,
+                encoder_profile=encoder_profile,
+            )
+        except DecompressionBombError:
+            raise ValidationError("The image is too large to generate a thumbnail.")
+        thumbnail_requests.inc(source="render" if rendered else "file")
+        index_thumbnail(source_image.id, height, thumbnail_file_path)
+
+        return thumbnail_file_path
+
+    def thumbnail_response(self, request, thumbnail_file_path, thumbnail_format, thumbnail_cache, cache_key):
+        """
+        Returns the rendered thumbnail, caching it in memory if the cache is enabled and the thumbnail is small enough.
+        """
+        if thumbnail_cache is not None and cache_key is not None:
+            cached_thumbnail = thumbnail_cache.load(cache_key, thumbnail_file_path, owner=request.user.username)
+            if cached_thumbnail is not None:
+                return self.cached_thumbnail_response(request, cached_thumbnail, thumbnail_format)
+
+        response = file_response(
+            request,
+            thumbnail_file_path,
+            content_type=THUMBNAIL_FORMATS[thumbnail_format]["content_type"],
+            cache_control=settings.THUMBNAIL_CACHE_CONTROL,
+        )
+        # The format depends on Accept header, so caches must not serve it to clients accepting other formats
+        patch_vary_headers(response, ["Accept"])
+        return response
+
+    def cached_thumbnail_response(self, request, cached_thumbnail, thumbnail_format):
+        response = bytes_response(
+            request,
+            cached_thumbnail.data,
+            content_type=THUMBNAIL_FORMATS[thumbnail_format]["content_type"],
+            etag=cached_thumbnail.etag,
+            last_modified=cached_thumbnail.last_modified,
+            cache_control=settings.THUMBNAIL_CACHE_CONTROL,
+        )
+        patch_vary_headers(response, ["Accept"])
+        return response
+
 
 class ImageGenerateLinkAPIView(RetrieveAPIView):
     """
@@ -78,15 +189,16 @@ class ImageGenerateLinkAPIView(RetrieveAPIView):
         uuid = self.kwargs["uuid"]
         expiry_time = self.kwargs["expiry_time"]
 
-        expiry_time_bounds = request.user.plan.expiring_link_time_range
-        if request.user.plan.can_fetch_expiring_link:
+        plan = get_user_plan(request.user)
+        expiry_time_bounds = plan.expiring_link_time_range
+        if plan.can_fetch_expiring_link:
             if (not expiry_time_bounds.lower or expiry_time_bounds.lower <= expiry_time) and (
                 not expiry_time_bounds.upper or expiry_time_bounds.upper >= expiry_time
             ):
-                unique_query_string = get_query_string(request.user)
-                expiring_link = (
-                    settings.DEFAULT_MEDIA_DOMAIN + f"/api/v1/images/{uuid}/link/{expiry_time}/" + unique_query_string
-                )
+                image = Image.objects.filter(uuid=uuid, account=request.user).only("image").first()
+                if image is None:
+                    raise NotFound()
+                expiring_link = get_expiring_link(uuid, image.image.name, expiry_time)
 
                 content = {
                     "Expiring link": expiring_link,
@@ -108,26 +220,92 @@ class ImageExpiringLinkAPIView(RetrieveAPIView):
     Base view for displaying an image, provided a valid expiring link was given.
     """
 
+    # The link itself authorizes the request, so neither the session nor the user is loaded
+    authentication_classes = ()
     permission_classes = (AllowAny,)
     renderer_classes = [JPEGRenderer, PNGRenderer]
 
     def get(self, request, *args, **kwargs):
         """
-        Checks if the provided link is valid and has not yet expired.
-        If the link is valid, renders the desired image.
+        Checks if the provided link is valid and has not yet expired (verifying its signature, without any
+        database query). If the link is valid, streams the desired image (or its requested byte ranges).
         """
-        user = get_user(request, max_age=self.kwargs["expiry_time"])
-        if user is None:
+        try:
+            link = verify_expiring_link(self.kwargs["uuid"], request.query_params)
+        except InvalidLink:
             raise PermissionDenied("This link is not valid or has expired.")
 
-        else:
-            queryset = Image.objects.get(uuid=self.kwargs["uuid"]).image
-            data = queryset
+        expiry_time = min(self.kwargs["expiry_time"], get_link_time_to_expire(link))
+        try:
+            return file_response(
+                request,
+                default_storage.path(link.name),
+                content_type=get_image_content_type(link.name),
+                cache_control=get_expiring_link_cache_control(expiry_time),
+                accept_ranges=True,
+            )
+        except FileNotFoundError:
+            raise NotFound()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        record_response("expiring_link", response)
+        return response
 
-            image_name = data.name
-            if image_name.endswith(".png"):
-                content_type = "image/png"
-            else:
-                content_type = "image/jpeg"
 
-            return Response(data, content_type=content_type)
+def get_thumbnail_cache_key(user, uuid, height, thumbnail_format, encoder_profile=None):
+    """
+    Returns the key of the thumbnail in a given format of a given height (px) for the user's image of a given uuid
+    in the in-memory thumbnail cache (see apps.images.cache), or None if the user has no such image.
+    The key includes the content hash of the image, so that thumbnails of a replaced file are never served.
+    """
+    content_hash = Image.objects.filter(uuid=uuid, account=user).values_list("content_hash", flat=True).first()
+    if content_hash is None:
+        return None
+    return (uuid, height, thumbnail_format, get_rendition_version(thumbnail_format, encoder_profile), content_hash)
+
+
+def get_indexed_thumbnail_path(user, uuid, height, thumbnail_format, encoder_profile=None):
+    """
+    Returns the path of the thumbnail in a given format of a given height (px) for the user's image of a given uuid,
+    as recorded in ThumbnailRendition index. Returns None if it is not indexed, or if the indexed thumbnail is not
+    the one rendered with the given encoder profile (e.g. the plan's encoder profile has changed since), so that
+    the thumbnail is rendered again.
+    """
+    rendition = (
+        ThumbnailRendition.objects.filter(
+            image__uuid=uuid, image__account=user, height=height, format=thumbnail_format
+        )
+        .select_related("image")
+        .only("storage_key", "image__content_hash")
+        .first()
+    )
+    if rendition is None:
+        return None
+
+    # Thumbnails rendered with other encoder settings are stored at another path (see `get_thumbnail_path`)
+    thumbnail_file_path = get_thumbnail_path(
+        user, uuid, height, thumbnail_format, rendition.image.content_hash, encoder_profile
+    )
+    if rendition.path != thumbnail_file_path:
+        return None
+    return thumbnail_file_path
+
+
+def get_image_content_type(image_name):
+    """
+    Returns the content type of the original image of a given file name.
+    """
+    if image_name.endswith(".png"):
+        return "image/png"
+    return "image/jpeg"
+
+
+def get_expiring_link_cache_control(expiry_time):
+    """
+    Returns Cache-Control directives of the image served by an expiring link, which is cached for no longer
+    than the link is valid.
+    """
+    cache_control = dict(settings.EXPIRING_LINK_CACHE_CONTROL)
+    cache_control["max_age"] = min(cache_control.get("max_age", expiry_time), expiry_time)
+    return cache_control
@@ -1,7 +1,20 @@
-from rest_framework import viewsets
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from apps.plans.cache import get_user_plan
 
-from ..models import Image
+from ..models import Image, ImageContent
+from ..tasks import queue_thumbnail_pregeneration
+from .batch import ZipArchiveParser, get_batch_files, validate_batch_files
+from .pagination import ImageCursorPagination
 from .permissions import IsOwner
 from .serializers import ImageSerializer
 
@@ -15,8 +28,66 @@ class ImageViewSet(viewsets.ModelViewSet):
     queryset = Image.objects.all()
     permission_classes = (IsAuthenticated, IsOwner)
     serializer_class = ImageSerializer
+    pagination_class = ImageCursorPagination
     lookup_field = "uuid"
 
     def get_queryset(self):
         queryset = super().get_queryset().filter(account=self.request.user)
+        queryset = queryset.select_related("account").prefetch_related("renditions")
         return queryset
+
+    def get_serializer_context(self):
+        """
+        Adds the requesting user's plan to the serializer context, so that it is fetched once per request
+        instead of once per serialized image (the images listed always belong to the requesting user).
+        """
+        context = super().get_serializer_context()
+        if self.request.user.is_authenticated:
+            context["plan"] = get_user_plan(self.request.user)
+        return context
+
+    @action(detail=False, methods=["post"], parser_classes=[MultiPartParser, ZipArchiveParser])
+    def batch(self, request):
+        """
+        Creates many images of the requesting user at once, from `images` parts of a multipart request and/or
+        a zip archive (see apps.images.api.batch). Files are validated in parallel and the valid ones are inserted
+        with a single query; invalid files are reported without failing the others.
+        Returns the result of every file, in the order of the files: the created image or the validation errors.
+        """
+        files = get_batch_files(request)
+        try:
+            validated = validate_batch_files(files)
+            images = [Image(account=request.user, **data) for data, errors in validated if errors is None]
+            self.create_images(images)
+        finally:
+            for file in files:
+                file.close()
+
+        context = self.get_serializer_context()
+        prefetch_related_objects(images, "renditions")
+        created_images = iter(images)
+        results = []
+        for file, (data, errors) in zip(files, validated):
+            if errors is None:
+                image_data = ImageSerializer(next(created_images), context=context).data
+                results.append({"name": file.name, "status": "created", "image": image_data})
+            else:
+                results.append({"name": file.name, "status": "invalid", "errors": errors})
+
+        content = {"created": len(images), "invalid": len(files) - len(images), "results": results}
+        return Response(content, status=status.HTTP_201_CREATED if images else status.HTTP_400_BAD_REQUEST)
+
+    def create_images(self, images):
+        """
+        Saves the files of the given images and inserts them with `bulk_create`, which neither calls `Image.save()`
+        nor sends signals: references to the images' content are counted (see ImageContent) and their thumbnails
+        are queued for pre-generation here. Files saved by a failed insert are stored by content hash, so they are
+        reused by the next upload of the same content.
+        """
+        with transaction.atomic():
+            ImageContent.acquire(Counter(image.content_hash for image in images))
+            Image.objects.bulk_create(images)
+            if settings.THUMBNAIL_PREGENERATE:
+                plan = get_user_plan(self.request.user)
+                for image in images:
+                    queue_thumbnail_pregeneration(image, plan)
@@ -0,0 +1,146 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+from apps.core.timing import span
+
+from .api.responses import get_file_validators
+from .metrics import thumbnail_cache_evictions, thumbnail_cache_lookups
+
+CachedThumbnail = namedtuple("CachedThumbnail", ["owner", "data", "etag", "last_modified", "expires_at"])
+
+
+class ThumbnailCache:
+    """
+    Per-process LRU cache of thumbnail bytes, keyed by (uuid, height, format, rendition version, content hash).
+
+    The total size of cached thumbnails never exceeds `max_bytes`; least recently used thumbnails are evicted first.
+    Thumbnails larger than `max_item_bytes` are not cached. Entries expire after `ttl` seconds (never if None),
+    which bounds staleness when a thumbnail is regenerated by another process.
+    """
+
+    def __init__(self, max_bytes, max_item_bytes, ttl=None):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the cached thumbnail stored under the given key, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at is not None and entry.expires_at <= time.monotonic():
+                self._remove(key)
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                thumbnail_cache_lookups.inc(result="miss")
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            thumbnail_cache_lookups.inc(result="hit")
+            return entry
+
+    def load(self, key, path, owner):
+        """
+        Reads the thumbnail file at the given path and caches it under the given key, together with its owner's
+        username and validators. Returns the cached thumbnail, or None if the file is too large to be cached.
+        """
+        etag, last_modified = get_file_validators(path)
+        with span("storage"), open(path, "rb") as thumbnail:
+            data = thumbnail.read(self.max_item_bytes + 1)
+        if len(data) > self.max_item_bytes:
+            return None
+
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        entry = CachedThumbnail(owner, data, etag, last_modified, expires_at)
+        self.set(key, entry)
+        return entry
+
+    def set(self, key, entry):
+        """
+        Caches the given thumbnail under the given key, evicting least recently used thumbnails to make room for it.
+        """
+        if len(entry.data) > self.max_item_bytes or len(entry.data) > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while self._size + len(entry.data) > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+                thumbnail_cache_evictions.inc()
+
+            self._entries[key] = entry
+            self._size += len(entry.data)
+
+    def invalidate(self, uuid):
+        """
+        Removes all cached thumbnails of the image of a given uuid.
+        """
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == uuid]:
+                self._remove(key)
+
+    def clear(self):
+        """
+        Removes all cached thumbnails.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        """
+        Returns counters describing the cache usage and effectiveness (of this instance). Lookups and evictions
+        of the caches of all processes are exposed by the metrics endpoint too (see apps.images.metrics).
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "items": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._size -= len(entry.data)
+
+
+_thumbnail_cache = None
+_thumbnail_cache_lock = threading.Lock()
+
+
+def get_thumbnail_cache():
+    """
+    Returns the process-wide thumbnail cache, creating it from settings on first use.
+    Returns None if the cache is disabled (`THUMBNAIL_MEMORY_CACHE_MAX_BYTES` is 0).
+    """
+    global _thumbnail_cache
+
+    if not settings.THUMBNAIL_MEMORY_CACHE_MAX_BYTES:
+        return None
+
+    with _thumbnail_cache_lock:
+        if _thumbnail_cache is None:
+            _thumbnail_cache = ThumbnailCache(
+                max_bytes=settings.THUMBNAIL_MEMORY_CACHE_MAX_BYTES,
+                max_item_bytes=settings.THUMBNAIL_MEMORY_CACHE_MAX_ITEM_BYTES,
+                ttl=settings.THUMBNAIL_MEMORY_CACHE_TTL,
+            )
+    return _thumbnail_cache
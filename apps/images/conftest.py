@@ -6,11 +6,15 @@ import uuid as uuid_lib
 
 import pytest
 from django.conf import settings
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import override_settings
+from django.urls import reverse
 from rest_framework.test import APIClient
 
+from apps.images.content import get_thumbnail_directory
 from apps.images.models import Image
+from apps.plans.cache import get_plan_cache
 from apps.plans.models import Plan
 from config.settings.base import AUTH_USER_MODEL
 
@@ -24,6 +28,17 @@ def api_client():
     return APIClient()
 
 
+@pytest.fixture(autouse=True)
+def plan_cache_clear():
+    """
+    Clears the plan cache after each test, so that plans changed by a test (and rolled back) do not leak into others.
+    """
+    yield
+    plan_cache = get_plan_cache()
+    if plan_cache is not None:
+        plan_cache.clear()
+
+
 # Account fixtures
 
 
@@ -66,12 +81,56 @@ def account_enterprise_fixture(db, django_user_model: AUTH_USER_MODEL, api_clien
 # Image fixtures
 
 
+def delete_image_files(image):
+    """
+    Deletes the original and thumbnail files of the image, stored either by its content hash or in the folder
+    of its owner.
+    """
+    shutil.rmtree(os.path.join(settings.MEDIA_ROOT, f"images/{image.account.username}/"), ignore_errors=True)
+    remove_empty_directories(os.path.join(settings.MEDIA_ROOT, "images"))
+    if image.content_hash:
+        thumbnail_directory = default_storage.path(get_thumbnail_directory(image.content_hash))
+        shutil.rmtree(thumbnail_directory, ignore_errors=True)
+        default_storage.delete(image.image.name)
+        remove_empty_directories(os.path.dirname(thumbnail_directory))
+        remove_empty_directories(os.path.dirname(default_storage.path(image.image.name)))
+
+
+def remove_empty_directories(directory):
+    """
+    Removes the directory and its parents within MEDIA_ROOT, as long as they are empty.
+    """
+    media_root = os.path.abspath(settings.MEDIA_ROOT)
+    directory = os.path.abspath(directory)
+    while directory.startswith(media_root + os.sep):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            # Not empty (or already removed)
+            return
+        directory = os.path.dirname(directory)
+
+
+def get_thumbnail_height(image):
+    """
+    Returns the smallest thumbnail height (px) available in the plan of the image's owner.
+    """
+    return image.account.plan.available_thumbnail_heights[0]
+
+
+def get_thumbnail_url(image):
+    """
+    Returns the URL rendering the image's thumbnail of the height given by `get_thumbnail_height`.
+    """
+    return reverse("apiv1:images_render_thumbnail", kwargs={"uuid": image.uuid, "height": get_thumbnail_height(image)})
+
+
 @override_settings(MEDIA_ROOT=MEDIA_ROOT_TEST)
 @pytest.fixture
 def image_basic_account_fixture(account_basic_fixture: AUTH_USER_MODEL, request) -> Image:
     """
     Creates Image instance for a user with a Basic account and creates image file in `media` folder.
-    After the tests are run, deletes the temp folder.
+    After the tests are run, deletes the image files.
     """
     image = Image.objects.create(
         account=account_basic_fixture,
@@ -82,11 +141,7 @@ def image_basic_account_fixture(account_basic_fixture: AUTH_USER_MODEL, request)
         modified_at=datetime.datetime.now(),
     )
 
-    def delete_image_folder():
-        folder_path = os.path.join(settings.MEDIA_ROOT, f"images/{account_basic_fixture}/")
-        shutil.rmtree(folder_path)
-
-    request.addfinalizer(delete_image_folder)
+    request.addfinalizer(lambda: delete_image_files(image))
     return image
 
 
@@ -95,7 +150,7 @@ def image_basic_account_fixture(account_basic_fixture: AUTH_USER_MODEL, request)
 def image_premium_account_fixture(account_premium_fixture: AUTH_USER_MODEL, request) -> Image:
     """
     Creates Image instance for a user with Premium account and creates image file in `media` folder.
-    After the tests are run, deletes the temp folder.
+    After the tests are run, deletes the image files.
     """
     image = Image.objects.create(
         account=account_premium_fixture,
@@ -106,11 +161,7 @@ def image_premium_account_fixture(account_premium_fixture: AUTH_USER_MODEL, requ
         modified_at=datetime.datetime.now(),
     )
 
-    def delete_image_folder():
-        folder_path = os.path.join(settings.MEDIA_ROOT, f"images/{account_premium_fixture}/")
-        shutil.rmtree(folder_path)
-
-    request.addfinalizer(delete_image_folder)
+    request.addfinalizer(lambda: delete_image_files(image))
     return image
 
 
@@ -119,7 +170,7 @@ def image_premium_account_fixture(account_premium_fixture: AUTH_USER_MODEL, requ
 def image_enterprise_account_fixture(account_enterprise_fixture: AUTH_USER_MODEL, request) -> Image:
     """
     Creates Image instance for a user with Enterprise account and creates image file in `media` folder.
-    After the tests are run, deletes the temp folder.
+    After the tests are run, deletes the image files.
     """
     image = Image.objects.create(
         account=account_enterprise_fixture,
@@ -130,11 +181,7 @@ def image_enterprise_account_fixture(account_enterprise_fixture: AUTH_USER_MODEL
         modified_at=datetime.datetime.now(),
     )
 
-    def delete_image_folder():
-        folder_path = os.path.join(settings.MEDIA_ROOT, f"images/{account_enterprise_fixture}/")
-        shutil.rmtree(folder_path)
-
-    request.addfinalizer(delete_image_folder)
+    request.addfinalizer(lambda: delete_image_files(image))
     return image
 
 
@@ -180,3 +227,13 @@ def image_serializer_invalid_data_fixture(account_premium_fixture: AUTH_USER_MOD
         "modified_at": datetime.datetime.now(),
     }
     return image_serializer_data
+
+
+@pytest.fixture
+def batch_upload_cleanup(account_premium_fixture):
+    """
+    Deletes the files of images uploaded in batches by the Premium account after the test.
+    """
+    yield
+    for image in Image.objects.filter(account=account_premium_fixture):
+        delete_image_files(image)
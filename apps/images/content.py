@@ -0,0 +1,55 @@
+import hashlib
+import os
+
+# Originals and thumbnails stored by content hash are shared by all images with identical content.
+# Originals are stored as `originals/<h[:2]>/<h[2:4]>/<h>.<extension>` and their thumbnails in
+# `thumbnails/<h[:2]>/<h>/` (see apps.images.api.utils.get_thumbnail_path), where <h> is the SHA-256 hash
+# of the original's content.
+ORIGINALS_DIRECTORY = "originals"
+THUMBNAILS_DIRECTORY = "thumbnails"
+
+# Size (bytes) of the chunks in which files are hashed
+HASH_CHUNK_SIZE = 64 * 1024
+
+# File extensions stored for the extensions of uploaded files, so that identical content is stored under one name
+NORMALIZED_EXTENSIONS = {".jpeg": ".jpg"}
+
+
+def get_content_hash(file):
+    """
+    Returns the SHA-256 hash (hex digest) of the file's content. Uploaded files are hashed while they stream in
+    (see apps.images.uploadhandlers); other files are read in chunks and rewound.
+    """
+    content_hash = getattr(file, "content_hash", None)
+    if content_hash:
+        return content_hash
+
+    sha256 = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b""):
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+def get_original_name(content_hash, filename):
+    """
+    Returns the storage name of the original file of a given content hash, uploaded under the given file name.
+    """
+    _, extension = os.path.splitext(filename.lower())
+    extension = NORMALIZED_EXTENSIONS.get(extension, extension)
+    return f"{ORIGINALS_DIRECTORY}/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}{extension}"
+
+
+def get_thumbnail_directory(content_hash):
+    """
+    Returns the storage name of the directory of thumbnails of the content of a given hash.
+    """
+    return f"{THUMBNAILS_DIRECTORY}/{content_hash[:2]}/{content_hash}"
+
+
+def is_content_addressed(name):
+    """
+    Whether the storage name is the name of an original stored by content hash.
+    """
+    return name.startswith(f"{ORIGINALS_DIRECTORY}/")
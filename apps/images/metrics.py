@@ -0,0 +1,75 @@
+import functools
+
+from apps.core.metrics import registry
+
+# Metrics of thumbnails and images, exposed by the metrics endpoint (see apps.core.views.metrics_view)
+
+thumbnail_requests = registry.counter(
+    "thumbnail_requests",
+    "Thumbnail requests by the source of the thumbnail: memory (in-memory cache), index (rendition index), "
+    "file (a file rendered before, e.g. in the background) or render (rendered for the request).",
+    labelnames=("source",),
+)
+thumbnail_decode_seconds = registry.histogram(
+    "thumbnail_decode_seconds", "Time spent decoding originals to render thumbnails."
+)
+thumbnail_render_seconds = registry.histogram(
+    "thumbnail_render_seconds",
+    "Time spent rendering (resizing, encoding and writing) a thumbnail of a single height.",
+    labelnames=("format",),
+)
+response_bytes = registry.counter(
+    "response_bytes",
+    "Bytes of response bodies sent by Django, by endpoint. Files handed over to the web server (see "
+    "MEDIA_SENDFILE_BACKEND setting) are not counted.",
+    labelnames=("endpoint",),
+)
+responses = registry.counter("responses", "Responses by endpoint and status code.", labelnames=("endpoint", "status"))
+upload_validations = registry.counter(
+    "upload_validations", "Validations of uploaded images by result (valid or invalid).", labelnames=("result",)
+)
+upload_validation_seconds = registry.histogram("upload_validation_seconds", "Time spent validating uploaded images.")
+thumbnail_cache_lookups = registry.counter(
+    "thumbnail_cache_lookups",
+    "Lookups in the in-memory thumbnail cache (see apps.images.cache) by result (hit or miss).",
+    labelnames=("result",),
+)
+thumbnail_cache_evictions = registry.counter(
+    "thumbnail_cache_evictions", "Thumbnails evicted from the in-memory thumbnail cache to make room for others."
+)
+
+
+def record_response(endpoint, response):
+    """
+    Counts the response of a given endpoint and the bytes of its body. Responses which are not rendered yet
+    (e.g. errors of Django REST Framework views) are counted once they are rendered.
+    """
+    if not getattr(response, "is_rendered", True):
+        response.add_post_render_callback(lambda rendered_response: record_response(endpoint, rendered_response))
+        return
+
+    responses.inc(endpoint=endpoint, status=str(response.status_code))
+    if response.has_header("Content-Length"):
+        size = int(response["Content-Length"])
+    elif not response.streaming:
+        size = len(response.content)
+    else:
+        size = 0
+    response_bytes.inc(size, endpoint=endpoint)
+
+
+def record_async_responses(endpoint):
+    """
+    Decorator of async views counting their responses as those of a given endpoint (see `record_response`).
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            response = await view(request, *args, **kwargs)
+            record_response(endpoint, response)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.8 on 2026-10-17 11:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThumbnailRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+                ('height', models.PositiveSmallIntegerField(help_text='Height of the thumbnail in pixels (px).')),
+                ('width', models.PositiveIntegerField(help_text='Width of the thumbnail in pixels (px).')),
+                ('format', models.CharField(help_text='Image format of the thumbnail file, e.g. JPEG.', max_length=10)),
+                ('size', models.PositiveIntegerField(help_text='Size of the thumbnail file in bytes.')),
+                ('storage_key', models.CharField(help_text='Path of the thumbnail file relative to MEDIA_ROOT.', max_length=255)),
+                ('generated_at', models.DateTimeField(help_text='Time the thumbnail file was generated.')),
+                ('image', models.ForeignKey(help_text='Image the thumbnail was rendered from.', on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='images.image')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='thumbnailrendition',
+            constraint=models.UniqueConstraint(fields=('image', 'height', 'format'), name='unique_thumbnail_rendition'),
+        ),
+    ]
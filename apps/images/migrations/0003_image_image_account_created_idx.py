@@ -0,0 +1,17 @@
+# Generated by Django 3.2.8 on 2026-10-17 11:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0002_thumbnailrendition'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['account', '-created_at', '-id'], name='image_account_created_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.8 on 2026-10-17 12:00
+
+import apps.images.models
+import apps.images.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0003_image_image_account_created_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='image',
+            name='image',
+            field=models.ImageField(help_text='Original image file uploaded by the user.', upload_to=apps.images.models.image_directory_path, validators=[apps.images.validators.validate_image_file]),
+        ),
+    ]
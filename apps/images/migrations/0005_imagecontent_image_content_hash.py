@@ -0,0 +1,31 @@
+# Generated by Django 3.2.8 on 2026-10-17 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('images', '0004_alter_image_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageContent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+                ('content_hash', models.CharField(help_text='SHA-256 hash of the file content.', max_length=64, unique=True)),
+                ('reference_count', models.PositiveIntegerField(default=0, help_text='Number of images with this content.')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, help_text='SHA-256 hash of the original file content (see ImageContent). Empty for images stored before deduplication.', max_length=64),
+        ),
+    ]
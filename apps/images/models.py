@@ -1,22 +1,95 @@
+import os
+import shutil
 import uuid as uuid_lib
 
 from django.conf import settings
-from django.db import models
+from django.core.files.storage import default_storage
+from django.db import connection, models, transaction
+from django.utils import timezone
 
 from apps.core.models import TimeStampedModel
 
-from .validators import validate_content_type
+from .cache import get_thumbnail_cache
+from .content import get_content_hash, get_original_name, get_thumbnail_directory
+from .validators import validate_image_file
 
 # Create your models here.
 
 
 def image_directory_path(instance, filename):
     """
-    Sets a default path for the image uploads directory.
+    Sets a default path for the image uploads directory. Images are stored by the hash of their content
+    (see apps.images.content), so that identical uploads share a single file. Images without a content hash
+    are stored in a directory of their own.
     """
+    if instance.content_hash:
+        return get_original_name(instance.content_hash, filename)
     return f"images/{instance.account.username}/{instance.uuid}/{filename}"
 
 
+class ImageContent(TimeStampedModel):
+    """
+    Model for the content of original image files, stored once for all images with identical content,
+    counting the images which reference it.
+    """
+
+    content_hash = models.CharField(max_length=64, unique=True, help_text="SHA-256 hash of the file content.")
+    reference_count = models.PositiveIntegerField(default=0, help_text="Number of images with this content.")
+
+    def __str__(self):
+        return self.content_hash
+
+    @classmethod
+    def acquire(cls, counts):
+        """
+        Counts more images referencing the contents of the given hashes (a mapping of content hashes to the numbers
+        of images), with a single upsert. Must be called in the transaction saving the images, before their files
+        are saved: the contents' rows stay locked until the transaction ends, so that their files are not deleted
+        meanwhile (see `delete_unreferenced`).
+        """
+        # Raw SQL, as Django 3.2 has no upsert (bulk_create(update_conflicts=...) comes with Django 4.1): a single
+        # INSERT ... ON CONFLICT counts all contents of a batch upload in one query, and is atomic when the same
+        # content is uploaded concurrently, where get_or_create() would need a savepoint and a retry per content.
+        # Rows are locked in a fixed order, to avoid deadlocks with concurrent transactions
+        rows = sorted(counts.items())
+        if not rows:
+            return
+        table = connection.ops.quote_name(cls._meta.db_table)
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (created_at, modified_at, content_hash, reference_count) "
+                f"VALUES {', '.join(['(%s, %s, %s, %s)'] * len(rows))} "
+                f"ON CONFLICT (content_hash) DO UPDATE SET modified_at = EXCLUDED.modified_at, "
+                f"reference_count = {table}.reference_count + EXCLUDED.reference_count",
+                [value for content_hash, count in rows for value in (now, now, content_hash, count)],
+            )
+
+    @classmethod
+    def release(cls, content_hash, original_name):
+        """
+        Counts one image less referencing the content of a given hash. Once the transaction is committed,
+        deletes the content's original file (stored under the given name) and thumbnails if no image references it.
+        """
+        cls.objects.filter(content_hash=content_hash, reference_count__gt=0).update(
+            reference_count=models.F("reference_count") - 1
+        )
+        transaction.on_commit(lambda: cls.delete_unreferenced(content_hash, original_name))
+
+    @classmethod
+    def delete_unreferenced(cls, content_hash, original_name):
+        """
+        Deletes the content of a given hash, with its original file and thumbnails, if no image references it.
+        Files are deleted while the content's row is locked, so a concurrent upload of the same content waits and
+        then stores its file again.
+        """
+        with transaction.atomic():
+            deleted, _ = cls.objects.filter(content_hash=content_hash, reference_count=0).delete()
+            if deleted:
+                default_storage.delete(original_name)
+                shutil.rmtree(default_storage.path(get_thumbnail_directory(content_hash)), ignore_errors=True)
+
+
 class Image(TimeStampedModel):
     """
     Model for images uploaded by the users.
@@ -30,7 +103,7 @@ class Image(TimeStampedModel):
     )
     image = models.ImageField(
         upload_to=image_directory_path,
-        validators=[validate_content_type],
+        validators=[validate_image_file],
         help_text="Original image file uploaded by the user.",
     )
     alt = models.CharField(
@@ -42,3 +115,96 @@ class Image(TimeStampedModel):
         editable=False,
         help_text="UUID field used mainly for url lookups of the image.",
     )
+    content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        db_index=True,
+        editable=False,
+        help_text="SHA-256 hash of the original file content (see ImageContent). Empty for images stored before "
+        "deduplication.",
+    )
+
+    class Meta:
+        indexes = [
+            # Used by keyset pagination of the user's images (see apps.images.api.pagination)
+            models.Index(fields=["account", "-created_at", "-id"], name="image_account_created_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+        Saves the image. A newly uploaded file is stored by the hash of its content, referencing the content
+        (see ImageContent); the content of a replaced file is released, together with the thumbnails of the image
+        (also removed from the in-memory thumbnail cache).
+        """
+        if not self.image or self.image._committed:
+            return super().save(*args, **kwargs)
+
+        previous = Image.objects.filter(pk=self.pk).first() if self.pk is not None else None
+        self.content_hash = get_content_hash(self.image.file)
+        with transaction.atomic(savepoint=False):
+            ImageContent.acquire({self.content_hash: 1})
+            super().save(*args, **kwargs)
+            if previous is not None:
+                previous.release_files()
+                if previous.content_hash != self.content_hash:
+                    self.renditions.all().delete()
+                    # Dropped from the in-memory cache only once committed, so that a rolled back save keeps them
+                    thumbnail_cache = get_thumbnail_cache()
+                    if thumbnail_cache is not None:
+                        uuid = self.uuid
+                        transaction.on_commit(lambda: thumbnail_cache.invalidate(uuid))
+
+    def release_files(self):
+        """
+        Releases the files of the image once the current transaction is committed: its content, whose original and
+        thumbnails are deleted once no other image references it, or, for an image stored before deduplication,
+        its own original and thumbnail files (as recorded in ThumbnailRendition index).
+        """
+        if self.content_hash:
+            ImageContent.release(self.content_hash, self.image.name)
+            return
+
+        storage_keys = list(self.renditions.values_list("storage_key", flat=True))
+        if self.image:
+            storage_keys.append(self.image.name)
+
+        def delete_files():
+            for storage_key in storage_keys:
+                default_storage.delete(storage_key)
+
+        if storage_keys:
+            transaction.on_commit(delete_files)
+
+
+class ThumbnailRendition(TimeStampedModel):
+    """
+    Model for thumbnails rendered from the images, used as an index of the existing thumbnail files.
+    """
+
+    image = models.ForeignKey(
+        Image,
+        on_delete=models.CASCADE,
+        related_name="renditions",
+        help_text="Image the thumbnail was rendered from.",
+    )
+    height = models.PositiveSmallIntegerField(help_text="Height of the thumbnail in pixels (px).")
+    width = models.PositiveIntegerField(help_text="Width of the thumbnail in pixels (px).")
+    format = models.CharField(max_length=10, help_text="Image format of the thumbnail file, e.g. JPEG.")
+    size = models.PositiveIntegerField(help_text="Size of the thumbnail file in bytes.")
+    storage_key = models.CharField(max_length=255, help_text="Path of the thumbnail file relative to MEDIA_ROOT.")
+    generated_at = models.DateTimeField(help_text="Time the thumbnail file was generated.")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["image", "height", "format"], name="unique_thumbnail_rendition"),
+        ]
+
+    def __str__(self):
+        return self.storage_key
+
+    @property
+    def path(self):
+        """
+        Absolute path of the thumbnail file.
+        """
+        return os.path.join(settings.MEDIA_ROOT, self.storage_key)
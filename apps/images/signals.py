@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from apps.plans.cache import get_user_plan
+
+from .cache import get_thumbnail_cache
+from .models import Image
+from .tasks import queue_thumbnail_pregeneration
+
+
+@receiver(post_save, sender=Image)
+def pregenerate_thumbnails(sender, instance, created, **kwargs):
+    """
+    Queues generation of all thumbnails available to the owner's plan once a new image is committed.
+    """
+    if created and settings.THUMBNAIL_PREGENERATE:
+        queue_thumbnail_pregeneration(instance, get_user_plan(instance.account))
+
+
+@receiver(pre_delete, sender=Image)
+def delete_image_files(sender, instance, **kwargs):
+    """
+    Releases the original file and thumbnail files of the deleted image once the deletion is committed
+    (see Image.release_files); files shared with images of identical content are deleted with the last of them.
+    Expiring links are verified without database queries, so the original is deleted to stop serving it by links
+    which have not expired yet.
+    """
+    instance.release_files()
+
+
+@receiver(post_delete, sender=Image)
+def invalidate_cached_thumbnails(sender, instance, **kwargs):
+    """
+    Removes thumbnails of the deleted image from the in-memory thumbnail cache.
+    """
+    thumbnail_cache = get_thumbnail_cache()
+    if thumbnail_cache is not None:
+        thumbnail_cache.invalidate(instance.uuid)
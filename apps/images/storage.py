@@ -0,0 +1,42 @@
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+
+from .content import is_content_addressed
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage which keeps a single copy of files stored by content hash (see apps.images.content):
+    saving such a file under a name which exists already keeps the existing file instead of writing another copy
+    under a new name. Other files are stored as by FileSystemStorage.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        if is_content_addressed(name):
+            return name
+        return super().get_available_name(name, max_length=max_length)
+
+    def _save(self, name, content):
+        if not is_content_addressed(name):
+            return super()._save(name, content)
+        if self.exists(name):
+            return name
+
+        # Written to a temporary file which is renamed into place, so that concurrent uploads of the same content
+        # never observe (nor write) a partial file
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix=".upload.", suffix=".tmp")
+        try:
+            with os.fdopen(file_descriptor, "wb") as temp_file:
+                for chunk in content.chunks():
+                    temp_file.write(chunk)
+            os.chmod(temp_path, self.file_permissions_mode or 0o644)
+            os.replace(temp_path, full_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return name
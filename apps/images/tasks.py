@@ -0,0 +1,259 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connection, transaction
+from PIL.Image import DecompressionBombError
+
+from .api.utils import (
+    create_thumbnails,
+    get_thumbnail_path,
+    index_thumbnail,
+    thumbnail_locks,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ThumbnailWorkerPool:
+    """
+    Bounded pool of worker threads that generate thumbnails in the background.
+
+    At most `max_workers` renders run at once and at most `max_queue_size` more wait for a free worker;
+    submissions beyond that are dropped (the thumbnail view renders them on demand instead).
+    Failed renders are retried up to `max_retries` times with a linear backoff of `retry_delay` seconds.
+    Thumbnails that already exist, or are being rendered by another process, are skipped (see `thumbnail_lock`).
+    """
+
+    def __init__(self, max_workers, max_queue_size, max_retries=0, retry_delay=0, lock_timeout=None):
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.lock_timeout = lock_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumbnails")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue_size)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def submit(self, source_path, thumbnail_paths, image_id=None, encoder_profile=None):
+        """
+        Queues generation of thumbnails from the source image file at `source_path`, encoded with the given
+        encoder profile (apps.plans.models.EncoderProfile, or the default encoder settings if None).
+        `thumbnail_paths` maps every height (px) to the path of its thumbnail; all of them are rendered
+        from a single decode of the source. Thumbnails already queued are skipped.
+        If `image_id` is given, rendered thumbnails are recorded in ThumbnailRendition index of that image.
+        Returns the render's future, or None if nothing was queued.
+        """
+        with self._lock:
+            thumbnail_paths = {height: path for height, path in thumbnail_paths.items() if path not in self._pending}
+            if not thumbnail_paths:
+                return None
+
+            if not self._slots.acquire(blocking=False):
+                logger.warning("Thumbnail queue is full, skipping pre-generation of %s.", source_path)
+                return None
+
+            future = self._executor.submit(self._render, source_path, thumbnail_paths, image_id, encoder_profile)
+            for path in thumbnail_paths.values():
+                self._pending[path] = future
+
+        future.add_done_callback(lambda _future: self._release(thumbnail_paths.values()))
+        return future
+
+    def wait(self, path, timeout=None):
+        """
+        Blocks until a queued render of the thumbnail at `path` finishes.
+        Returns True if the thumbnail was rendered and False if it was not queued or the render failed.
+        """
+        with self._lock:
+            future = self._pending.get(path)
+        if future is None:
+            return False
+
+        try:
+            future.result(timeout=timeout)
+        except Exception:
+            return False
+        return True
+
+    def _release(self, paths):
+        with self._lock:
+            for path in paths:
+                self._pending.pop(path, None)
+        self._slots.release()
+
+    def _render(self, source_path, thumbnail_paths, image_id=None, encoder_profile=None):
+        try:
+            result = self._render_with_retries(source_path, thumbnail_paths, encoder_profile)
+            if image_id is not None:
+                self._index(image_id, thumbnail_paths)
+            return result
+        finally:
+            # Worker threads are long-lived, so their database connections are not left open between renders
+            connection.close()
+
+    def _index(self, image_id, thumbnail_paths):
+        # The index is a best-effort optimization: the thumbnail view indexes missing thumbnails on its own
+        try:
+            for height, path in thumbnail_paths.items():
+                if os.path.exists(path):
+                    index_thumbnail(image_id, height, path)
+        except Exception:
+            logger.exception("Failed to index thumbnails of image %s.", image_id)
+
+    def _render_with_retries(self, source_path, thumbnail_paths, encoder_profile=None):
+        attempt = 0
+        while True:
+            try:
+                with thumbnail_locks(thumbnail_paths.values(), timeout=self.lock_timeout) as locked_paths:
+                    # Skips thumbnails rendered (or being rendered) meanwhile by another thread or process
+                    missing_paths = {
+                        height: path
+                        for height, path in thumbnail_paths.items()
+                        if path in locked_paths and not os.path.exists(path)
+                    }
+                    if not missing_paths:
+                        return {"decode": 0.0, "heights": {}, "sizes": {}, "bytes_saved": {}}
+
+                    with open(source_path, "rb") as source:
+                        return create_thumbnails(
+                            image_file=File(source), thumbnail_paths=missing_paths, encoder_profile=encoder_profile
+                        )
+            except DecompressionBombError:
+                logger.warning("Refused to generate thumbnails of %s: the image is too large.", source_path)
+                raise
+            except Exception:
+                if attempt >= self.max_retries:
+                    logger.exception("Failed to generate thumbnails of %s.", source_path)
+                    raise
+                attempt += 1
+                logger.warning(
+                    "Failed to generate thumbnails of %s, retrying (%s/%s).", source_path, attempt, self.max_retries
+                )
+                time.sleep(self.retry_delay * attempt)
+
+
+class BoundedExecutor:
+    """
+    Pool of worker threads running at most `max_workers` tasks at once, with at most `max_queue_size` more tasks
+    waiting for a free worker. Used by the async views to run blocking thumbnail renders off the event loop
+    (see apps.images.api.async_views).
+    """
+
+    def __init__(self, max_workers, max_queue_size, thread_name_prefix=""):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue_size)
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Schedules the given callable. Returns its future, or None if the queue is full.
+        """
+        if not self._slots.acquire(blocking=False):
+            return None
+
+        return self._executor.submit(self._run, fn, *args, **kwargs)
+
+    def _run(self, fn, *args, **kwargs):
+        # Frees the slot before the future completes, so that it is available to whoever awaits the result
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._slots.release()
+
+
+def regenerate_thumbnails(source_path, thumbnail_paths, format, encoder_profile=None, overwrite_heights=()):
+    """
+    Renders thumbnails in a given format from the source image file at `source_path`, encoded with the given
+    encoder profile. `thumbnail_paths` maps every height (px) to the path of its thumbnail; thumbnails which exist
+    already are rendered again only if their height is in `overwrite_heights`, and those being rendered by another
+    process are skipped.
+    Used by `regenerate_thumbnails` management command in its worker processes, so it does not touch the database.
+    Returns the heights (px) of the rendered thumbnails.
+    """
+    with thumbnail_locks(thumbnail_paths.values(), timeout=settings.THUMBNAIL_LOCK_TIMEOUT) as locked_paths:
+        stale_paths = {
+            height: path
+            for height, path in thumbnail_paths.items()
+            if path in locked_paths and (height in overwrite_heights or not os.path.exists(path))
+        }
+        if stale_paths:
+            with open(source_path, "rb") as source:
+                create_thumbnails(
+                    image_file=File(source),
+                    thumbnail_paths=stale_paths,
+                    format=format,
+                    encoder_profile=encoder_profile,
+                )
+        return sorted(stale_paths)
+
+
+def queue_thumbnail_pregeneration(image, plan):
+    """
+    Queues generation of all thumbnails available to the given plan of the image's owner (encoded with the plan's
+    encoder profile) once the current transaction is committed.
+    """
+    available_heights = (plan.available_thumbnail_heights if plan else None) or []
+    encoder_profile = plan.encoder_profile if plan else None
+    source_path = image.image.path
+    thumbnail_paths = {
+        height: get_thumbnail_path(
+            image.account.username,
+            image.uuid,
+            height,
+            content_hash=image.content_hash,
+            encoder_profile=encoder_profile,
+        )
+        for height in available_heights
+    }
+
+    if thumbnail_paths:
+        transaction.on_commit(
+            lambda: get_thumbnail_pool().submit(
+                source_path, thumbnail_paths, image_id=image.id, encoder_profile=encoder_profile
+            )
+        )
+
+
+_thumbnail_pool = None
+_thumbnail_pool_lock = threading.Lock()
+
+
+def get_thumbnail_pool():
+    """
+    Returns the process-wide thumbnail worker pool, creating it from settings on first use.
+    """
+    global _thumbnail_pool
+
+    with _thumbnail_pool_lock:
+        if _thumbnail_pool is None:
+            _thumbnail_pool = ThumbnailWorkerPool(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                max_queue_size=settings.THUMBNAIL_QUEUE_SIZE,
+                max_retries=settings.THUMBNAIL_MAX_RETRIES,
+                retry_delay=settings.THUMBNAIL_RETRY_DELAY,
+                lock_timeout=settings.THUMBNAIL_LOCK_TIMEOUT,
+            )
+    return _thumbnail_pool
+
+
+_render_executor = None
+_render_executor_lock = threading.Lock()
+
+
+def get_render_executor():
+    """
+    Returns the process-wide executor of the async views' thumbnail renders, creating it from settings on first use.
+    """
+    global _render_executor
+
+    with _render_executor_lock:
+        if _render_executor is None:
+            _render_executor = BoundedExecutor(
+                max_workers=settings.THUMBNAIL_RENDER_WORKERS,
+                max_queue_size=settings.THUMBNAIL_RENDER_QUEUE_SIZE,
+                thread_name_prefix="thumbnail-renders",
+            )
+    return _render_executor
@@ -0,0 +1,205 @@
+import base64
+import io
+import json
+import uuid as uuid_lib
+
+import PIL
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser
+
+from apps.images.api.async_views import image_expiring_link_view, thumbnail_render_view
+from apps.images.api.links import get_expiring_link
+from apps.images.models import ThumbnailRendition
+
+
+class TestThumbnailRenderView:
+    def test_render_height_available(self, rf, image_premium_account_fixture):
+        """
+        Assert that the async thumbnail view renders and indexes the thumbnail when given height is available
+        to the Image owner's plan.
+        """
+        available_height = image_premium_account_fixture.account.plan.available_thumbnail_heights[0]
+        request = rf.get("/")
+        request.user = image_premium_account_fixture.account
+
+        response = async_to_sync(thumbnail_render_view)(
+            request, uuid=image_premium_account_fixture.uuid, height=available_height
+        )
+        rendered_image = PIL.Image.open(io.BytesIO(response.content))
+
+        assert response.status_code == 200
+        assert rendered_image.height == available_height
+        assert ThumbnailRendition.objects.filter(image=image_premium_account_fixture, height=available_height).exists()
+
+    def test_render_negotiated_format(self, rf, image_premium_account_fixture):
+        """
+        Assert that the async thumbnail view renders the thumbnail in the format accepted by the client.
+        """
+        available_height = image_premium_account_fixture.account.plan.available_thumbnail_heights[0]
+        request = rf.get("/", HTTP_ACCEPT="image/webp")
+        request.user = image_premium_account_fixture.account
+
+        response = async_to_sync(thumbnail_render_view)(
+            request, uuid=image_premium_account_fixture.uuid, height=available_height
+        )
+
+        assert response["Content-Type"] == "image/webp"
+        assert response["Vary"] == "Accept"
+        assert PIL.Image.open(io.BytesIO(response.content)).format == "WEBP"
+
+    def test_render_not_modified(self, rf, image_premium_account_fixture):
+        """
+        Assert that the async thumbnail view answers a matching conditional request with 304 Not Modified.
+        """
+        available_height = image_premium_account_fixture.account.plan.available_thumbnail_heights[0]
+        request = rf.get("/")
+        request.user = image_premium_account_fixture.account
+        response = async_to_sync(thumbnail_render_view)(
+            request, uuid=image_premium_account_fixture.uuid, height=available_height
+        )
+
+        request = rf.get("/", HTTP_IF_NONE_MATCH=response["ETag"])
+        request.user = image_premium_account_fixture.account
+        response = async_to_sync(thumbnail_render_view)(
+            request, uuid=image_premium_account_fixture.uuid, height=available_height
+        )
+
+        assert response.status_code == 304
+
+    def test_render_height_unavailable(self, rf, image_premium_account_fixture):
+        """
+        Assert that the async thumbnail view refuses heights unavailable to the Image owner's plan.
+        """
+        request = rf.get("/")
+        request.user = image_premium_account_fixture.account
+
+        response = async_to_sync(thumbnail_render_view)(request, uuid=image_premium_account_fixture.uuid, height=1)
+
+        assert response.status_code == 403
+        assert "not available" in json.loads(response.content)["detail"]
+
+    def test_render_wrong_user(self, rf, image_premium_account_fixture, account_enterprise_fixture):
+        """
+        Assert that the async thumbnail view refuses to render thumbnails of another user's image.
+        """
+        request = rf.get("/")
+        request.user = account_enterprise_fixture
+
+        response = async_to_sync(thumbnail_render_view)(request, uuid=image_premium_account_fixture.uuid, height=200)
+
+        assert response.status_code == 403
+
+    def test_render_unknown_image(self, rf, account_premium_fixture):
+        """
+        Assert that the async thumbnail view answers 404 when no Image has the requested uuid.
+        """
+        request = rf.get("/")
+        request.user = account_premium_fixture
+        available_height = account_premium_fixture.plan.available_thumbnail_heights[0]
+
+        response = async_to_sync(thumbnail_render_view)(request, uuid=uuid_lib.uuid4(), height=available_height)
+
+        assert response.status_code == 404
+
+    def test_render_anonymous(self, rf, image_premium_account_fixture):
+        """
+        Assert that the async thumbnail view refuses unauthenticated requests.
+        """
+        request = rf.get("/")
+        request.user = AnonymousUser()
+
+        response = async_to_sync(thumbnail_render_view)(request, uuid=image_premium_account_fixture.uuid, height=200)
+
+        assert response.status_code == 403
+
+    def test_render_basic_authentication(self, rf, image_premium_account_fixture):
+        """
+        Assert that the async thumbnail view authenticates users with the authentication classes of the API,
+        e.g. HTTP Basic authentication.
+        """
+        available_height = image_premium_account_fixture.account.plan.available_thumbnail_heights[0]
+        credentials = base64.b64encode(b"account_premium:testpass123").decode()
+        request = rf.get("/", HTTP_AUTHORIZATION=f"Basic {credentials}")
+        request.user = AnonymousUser()
+
+        response = async_to_sync(thumbnail_render_view)(
+            request, uuid=image_premium_account_fixture.uuid, height=available_height
+        )
+
+        assert response.status_code == 200
+
+    def test_render_invalid_credentials(self, rf, image_premium_account_fixture):
+        """
+        Assert that the async thumbnail view refuses requests with invalid credentials.
+        """
+        credentials = base64.b64encode(b"account_premium:wrong").decode()
+        request = rf.get("/", HTTP_AUTHORIZATION=f"Basic {credentials}")
+        request.user = AnonymousUser()
+
+        response = async_to_sync(thumbnail_render_view)(request, uuid=image_premium_account_fixture.uuid, height=200)
+
+        assert response.status_code == 403
+        assert json.loads(response.content)["detail"] == "Invalid username/password."
+
+    def test_render_method_not_allowed(self, rf, image_premium_account_fixture):
+        """
+        Assert that the async thumbnail view answers requests of other methods than GET and HEAD with 405.
+        """
+        request = rf.post("/")
+        request.user = image_premium_account_fixture.account
+
+        response = async_to_sync(thumbnail_render_view)(request, uuid=image_premium_account_fixture.uuid, height=200)
+
+        assert response.status_code == 405
+        assert response["Allow"] == "GET, HEAD"
+
+    def test_render_queue_full(self, rf, monkeypatch, image_premium_account_fixture):
+        """
+        Assert that the async thumbnail view answers with 503 when the render queue is full.
+        """
+
+        class FullExecutor:
+            def submit(self, fn, *args, **kwargs):
+                return None
+
+        monkeypatch.setattr("apps.images.api.async_views.get_render_executor", FullExecutor)
+        available_height = image_premium_account_fixture.account.plan.available_thumbnail_heights[0]
+        request = rf.get("/")
+        request.user = image_premium_account_fixture.account
+
+        response = async_to_sync(thumbnail_render_view)(
+            request, uuid=image_premium_account_fixture.uuid, height=available_height
+        )
+
+        assert response.status_code == 503
+
+
+class TestImageExpiringLinkView:
+    def test_expiring_link_valid(self, rf, image_enterprise_account_fixture):
+        """
+        Assert that the async expiring link view returns the image for a valid link.
+        """
+        expiring_link = get_expiring_link(
+            image_enterprise_account_fixture.uuid, image_enterprise_account_fixture.image.name, 450
+        )
+        request = rf.get("/" + expiring_link.split("/", 3)[3])
+
+        response = async_to_sync(image_expiring_link_view)(
+            request, uuid=image_enterprise_account_fixture.uuid, expiry_time=450
+        )
+
+        assert response.status_code == 200
+        assert response.content == open(image_enterprise_account_fixture.image.path, "rb").read()
+        assert "max-age=450" in response["Cache-Control"]
+
+    def test_expiring_link_invalid(self, rf, image_enterprise_account_fixture):
+        """
+        Assert that the async expiring link view refuses an invalid link.
+        """
+        request = rf.get("/?expires=1&variant=original&name=image.jpg&key=default&signature=invalid")
+
+        response = async_to_sync(image_expiring_link_view)(
+            request, uuid=image_enterprise_account_fixture.uuid, expiry_time=450
+        )
+
+        assert response.status_code == 403
@@ -0,0 +1,136 @@
+import io
+import uuid as uuid_lib
+
+import PIL
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+
+from apps.images.cache import CachedThumbnail, ThumbnailCache
+from apps.images.conftest import delete_image_files
+from apps.images.models import Image
+
+
+def cached_thumbnail(size, expires_at=None):
+    return CachedThumbnail("account", b"x" * size, '"etag"', 0, expires_at)
+
+
+class TestThumbnailCache:
+    def test_get_set(self):
+        """
+        Assert that a cached thumbnail is returned under its key and that hits and misses are counted.
+        """
+        thumbnail_cache = ThumbnailCache(max_bytes=100, max_item_bytes=100)
+        key = (uuid_lib.uuid4(), 200, "version")
+        entry = cached_thumbnail(10)
+
+        assert thumbnail_cache.get(key) is None
+        thumbnail_cache.set(key, entry)
+
+        assert thumbnail_cache.get(key) == entry
+        assert thumbnail_cache.stats()["hits"] == 1
+        assert thumbnail_cache.stats()["misses"] == 1
+
+    def test_evicts_least_recently_used(self):
+        """
+        Assert that least recently used thumbnails are evicted once the total size exceeds the budget.
+        """
+        thumbnail_cache = ThumbnailCache(max_bytes=30, max_item_bytes=30)
+        first_key, second_key, third_key = [(uuid_lib.uuid4(), 200, "version") for _ in range(3)]
+        thumbnail_cache.set(first_key, cached_thumbnail(10))
+        thumbnail_cache.set(second_key, cached_thumbnail(10))
+        thumbnail_cache.get(first_key)
+
+        thumbnail_cache.set(third_key, cached_thumbnail(15))
+
+        assert thumbnail_cache.get(second_key) is None
+        assert thumbnail_cache.get(first_key) is not None
+        assert thumbnail_cache.stats()["evictions"] == 1
+        assert thumbnail_cache.stats()["bytes"] == 25
+
+    def test_skips_items_over_size_cap(self):
+        """
+        Assert that thumbnails larger than the per-item size cap are not cached.
+        """
+        thumbnail_cache = ThumbnailCache(max_bytes=100, max_item_bytes=10)
+        key = (uuid_lib.uuid4(), 200, "version")
+
+        thumbnail_cache.set(key, cached_thumbnail(11))
+
+        assert thumbnail_cache.get(key) is None
+
+    def test_expired_items(self):
+        """
+        Assert that expired thumbnails are not returned.
+        """
+        thumbnail_cache = ThumbnailCache(max_bytes=100, max_item_bytes=100)
+        key = (uuid_lib.uuid4(), 200, "version")
+
+        thumbnail_cache.set(key, cached_thumbnail(10, expires_at=0))
+
+        assert thumbnail_cache.get(key) is None
+
+    def test_invalidate(self):
+        """
+        Assert that invalidating an image removes all of its cached thumbnails only.
+        """
+        thumbnail_cache = ThumbnailCache(max_bytes=100, max_item_bytes=100)
+        uuid, other_uuid = uuid_lib.uuid4(), uuid_lib.uuid4()
+        for height in [200, 400]:
+            thumbnail_cache.set((uuid, height, "version"), cached_thumbnail(10))
+        thumbnail_cache.set((other_uuid, 200, "version"), cached_thumbnail(10))
+
+        thumbnail_cache.invalidate(uuid)
+
+        assert thumbnail_cache.stats()["items"] == 1
+        assert thumbnail_cache.get((other_uuid, 200, "version")) is not None
+
+
+class TestThumbnailCacheViews:
+    def test_retrieve_render_cached(self, api_client, monkeypatch, image_premium_account_fixture):
+        """
+        Assert that a repeated thumbnail request is served from the in-memory cache.
+        """
+        thumbnail_cache = ThumbnailCache(max_bytes=1024 * 1024, max_item_bytes=1024 * 1024)
+        monkeypatch.setattr("apps.images.api.views.get_thumbnail_cache", lambda: thumbnail_cache)
+        available_height = image_premium_account_fixture.account.plan.available_thumbnail_heights[0]
+        url = reverse(
+            "apiv1:images_render_thumbnail",
+            kwargs={"uuid": image_premium_account_fixture.uuid, "height": available_height},
+        )
+
+        first_response = api_client.get(url)
+        second_response = api_client.get(url)
+
+        assert second_response.status_code == 200
+        assert second_response.content == first_response.content
+        assert thumbnail_cache.stats()["hits"] == 1
+
+    def test_retrieve_render_replaced_file(self, api_client, monkeypatch, image_premium_account_fixture):
+        """
+        Assert that the thumbnail of a replaced image file is served instead of the cached thumbnail of the previous
+        file.
+        """
+        thumbnail_cache = ThumbnailCache(max_bytes=1024 * 1024, max_item_bytes=1024 * 1024)
+        monkeypatch.setattr("apps.images.api.views.get_thumbnail_cache", lambda: thumbnail_cache)
+        available_height = image_premium_account_fixture.account.plan.available_thumbnail_heights[0]
+        url = reverse(
+            "apiv1:images_render_thumbnail",
+            kwargs={"uuid": image_premium_account_fixture.uuid, "height": available_height},
+        )
+        api_client.get(url)
+        replacement = io.BytesIO()
+        PIL.Image.new("RGB", (400, 300), "blue").save(replacement, format="JPEG")
+
+        response = api_client.patch(
+            reverse("apiv1:images-detail", kwargs={"uuid": image_premium_account_fixture.uuid}),
+            {"image": SimpleUploadedFile("blue.jpg", replacement.getvalue(), content_type="image/jpeg")},
+            format="multipart",
+        )
+        image = Image.objects.get(pk=image_premium_account_fixture.pk)
+        thumbnail_response = api_client.get(url)
+        delete_image_files(image)
+
+        assert response.status_code == 200
+        assert thumbnail_response.status_code == 200
+        red, _, blue = PIL.Image.open(io.BytesIO(thumbnail_response.content)).convert("RGB").getpixel((0, 0))
+        assert red < 50 and blue > 200
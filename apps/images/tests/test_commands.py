@@ -0,0 +1,176 @@
+import json
+import os
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.urls import reverse
+
+from apps.core.benchmarks import compare_with_baseline
+from apps.images.api.utils import get_thumbnail_path
+from apps.images.models import ThumbnailRendition
+from apps.plans.models import EncoderProfile
+
+
+class TestReconcileRenditions:
+    def test_reconcile_renditions(self, api_client, image_premium_account_fixture):
+        """
+        Assert that the command indexes thumbnail files missing from the index and removes entries without files.
+        """
+        heights = image_premium_account_fixture.account.plan.available_thumbnail_heights
+        for height in heights:
+            api_client.get(
+                reverse(
+                    "apiv1:images_render_thumbnail",
+                    kwargs={"uuid": image_premium_account_fixture.uuid, "height": height},
+                )
+            )
+        ThumbnailRendition.objects.filter(height=heights[0]).delete()
+        os.remove(ThumbnailRendition.objects.get(height=heights[1]).path)
+
+        output = StringIO()
+        call_command("reconcile_renditions", stdout=output)
+
+        assert list(ThumbnailRendition.objects.values_list("height", flat=True)) == [heights[0]]
+        assert "Added: 1, updated: 0, removed: 1." in output.getvalue()
+
+    def test_reconcile_renditions_dry_run(self, api_client, image_premium_account_fixture):
+        """
+        Assert that the command does not change the index in dry run mode.
+        """
+        height = image_premium_account_fixture.account.plan.available_thumbnail_heights[0]
+        api_client.get(
+            reverse(
+                "apiv1:images_render_thumbnail",
+                kwargs={"uuid": image_premium_account_fixture.uuid, "height": height},
+            )
+        )
+        ThumbnailRendition.objects.all().delete()
+
+        output = StringIO()
+        call_command("reconcile_renditions", "--dry-run", stdout=output)
+
+        assert ThumbnailRendition.objects.count() == 0
+        assert "Added: 1, updated: 0, removed: 0." in output.getvalue()
+
+
+class TestRegenerateThumbnails:
+    def regenerate_thumbnails(self, tmp_path, *args):
+        output = StringIO()
+        call_command(
+            "regenerate_thumbnails",
+            "--workers=1",
+            f"--checkpoint={tmp_path / 'checkpoint.json'}",
+            *args,
+            stdout=output,
+            stderr=StringIO(),
+        )
+        return output.getvalue()
+
+    def test_regenerate_missing_thumbnails(self, tmp_path, image_premium_account_fixture):
+        """
+        Assert that the command renders and indexes all thumbnails of the owner's plan missing from the index,
+        and deletes its checkpoint once done.
+        """
+        heights = image_premium_account_fixture.account.plan.available_thumbnail_heights
+
+        output = self.regenerate_thumbnails(tmp_path)
+
+        renditions = ThumbnailRendition.objects.filter(image=image_premium_account_fixture)
+        assert sorted(renditions.values_list("height", flat=True)) == sorted(heights)
+        assert all(os.path.exists(rendition.path) for rendition in renditions)
+        assert f"Images: 1, rendered: {len(heights)}, failed: 0." in output
+        assert "ETA" in output
+        assert not (tmp_path / "checkpoint.json").exists()
+
+    def test_regenerate_stale_thumbnails(self, tmp_path, image_premium_account_fixture):
+        """
+        Assert that the command renders again thumbnails rendered with other encoder settings than those
+        of the owner's plan.
+        """
+        self.regenerate_thumbnails(tmp_path)
+        plan = image_premium_account_fixture.account.plan
+        plan.encoder_profile = EncoderProfile.objects.create(name="Progressive", progressive=True)
+        plan.save()
+
+        output = self.regenerate_thumbnails(tmp_path)
+
+        for height in plan.available_thumbnail_heights:
+            rendition = ThumbnailRendition.objects.get(image=image_premium_account_fixture, height=height)
+            assert rendition.path == get_thumbnail_path(
+                image_premium_account_fixture.account.username,
+                image_premium_account_fixture.uuid,
+                height,
+                content_hash=image_premium_account_fixture.content_hash,
+                encoder_profile=plan.encoder_profile,
+            )
+        assert f"rendered: {len(plan.available_thumbnail_heights)}" in output
+        assert "rendered: 0" in self.regenerate_thumbnails(tmp_path)
+
+    def test_regenerate_resumes_from_checkpoint(self, tmp_path, image_premium_account_fixture):
+        """
+        Assert that the command resumes after the last image recorded in its checkpoint.
+        """
+        checkpoint = {"last_image_id": image_premium_account_fixture.id, "images": 1, "thumbnails": 0, "failed": 0}
+        (tmp_path / "checkpoint.json").write_text(json.dumps(checkpoint))
+
+        output = self.regenerate_thumbnails(tmp_path)
+
+        assert f"Resuming after image {image_premium_account_fixture.id}" in output
+        assert not ThumbnailRendition.objects.exists()
+
+    def test_regenerate_dry_run(self, tmp_path, image_premium_account_fixture):
+        """
+        Assert that the command only reports the thumbnails to render in dry run mode.
+        """
+        heights = image_premium_account_fixture.account.plan.available_thumbnail_heights
+
+        output = self.regenerate_thumbnails(tmp_path, "--dry-run")
+
+        assert not ThumbnailRendition.objects.exists()
+        assert f"to render: {len(heights)}" in output
+
+
+class TestBenchmark:
+    def benchmark(self, tmp_path, *args):
+        output = StringIO()
+        call_command(
+            "benchmark",
+            "--skip-endpoints",
+            "--resolutions=64x48",
+            "--heights=20",
+            "--repeat=1",
+            f"--baseline={tmp_path / 'baseline.json'}",
+            *args,
+            stdout=output,
+        )
+        return output.getvalue()
+
+    def test_benchmark_baseline(self, tmp_path):
+        """
+        Assert that the command stores the pipeline results as a baseline and flags results worse than it.
+        """
+        self.benchmark(tmp_path, "--save-baseline")
+        baseline = json.loads((tmp_path / "baseline.json").read_text())
+
+        assert "pipeline.PNG.64x48.h20.encode_ms" in baseline["results"]
+        assert "pipeline.PNG.64x48.create_thumbnails_ms" in baseline["results"]
+        assert "No regressions" in self.benchmark(tmp_path, "--tolerance=1000")
+
+        baseline["results"] = {name: value / 10000 for name, value in baseline["results"].items()}
+        (tmp_path / "baseline.json").write_text(json.dumps(baseline))
+        with pytest.raises(CommandError, match="regressed"):
+            self.benchmark(tmp_path)
+
+    def test_compare_with_baseline(self):
+        """
+        Assert that slower latencies and lower throughputs beyond the tolerance are flagged as regressions.
+        """
+        baseline = {"a.p50_ms": 10.0, "a.requests_per_second": 100.0, "b.p50_ms": 10.0, "b.requests_per_second": 100.0}
+        results = {"a.p50_ms": 10.5, "a.requests_per_second": 95.0, "b.p50_ms": 12.0, "b.requests_per_second": 80.0}
+
+        assert compare_with_baseline(results, baseline, tolerance=0.1) == [
+            ("b.p50_ms", 10.0, 12.0),
+            ("b.requests_per_second", 100.0, 80.0),
+        ]
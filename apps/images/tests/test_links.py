@@ -0,0 +1,88 @@
+import uuid as uuid_lib
+from urllib.parse import parse_qsl, urlsplit
+
+import pytest
+
+from apps.images.api.links import (
+    InvalidLink,
+    get_expiring_link,
+    get_link_time_to_expire,
+    verify_expiring_link,
+)
+
+
+def get_query_params(expiring_link):
+    return dict(parse_qsl(urlsplit(expiring_link).query))
+
+
+class TestExpiringLinks:
+    def test_verify_expiring_link(self):
+        """
+        Assert that a generated link is verified and carries the image's storage name and expiry timestamp.
+        """
+        uuid = uuid_lib.uuid4()
+        query_params = get_query_params(get_expiring_link(uuid, "images/account/image.jpg", 450))
+
+        link = verify_expiring_link(uuid, query_params)
+
+        assert link.name == "images/account/image.jpg"
+        assert 449 <= get_link_time_to_expire(link) <= 451
+
+    @pytest.mark.parametrize("param, value", [("name", "images/other/image.jpg"), ("expires", "9999999999")])
+    def test_verify_tampered_link(self, param, value):
+        """
+        Assert that a link whose parameters were altered after signing is refused.
+        """
+        uuid = uuid_lib.uuid4()
+        query_params = get_query_params(get_expiring_link(uuid, "images/account/image.jpg", 450))
+        query_params[param] = value
+
+        with pytest.raises(InvalidLink):
+            verify_expiring_link(uuid, query_params)
+
+    def test_verify_link_of_other_image(self):
+        """
+        Assert that a link signed for one image is refused for another one.
+        """
+        query_params = get_query_params(get_expiring_link(uuid_lib.uuid4(), "images/account/image.jpg", 450))
+
+        with pytest.raises(InvalidLink):
+            verify_expiring_link(uuid_lib.uuid4(), query_params)
+
+    def test_verify_link_of_other_variant(self):
+        """
+        Assert that a link is refused for a variant of the image it was not signed for.
+        """
+        uuid = uuid_lib.uuid4()
+        query_params = get_query_params(get_expiring_link(uuid, "images/account/image.jpg", 450))
+
+        with pytest.raises(InvalidLink):
+            verify_expiring_link(uuid, query_params, variant="200")
+
+    def test_verify_expired_link(self):
+        """
+        Assert that an expired link is refused.
+        """
+        uuid = uuid_lib.uuid4()
+        query_params = get_query_params(get_expiring_link(uuid, "images/account/image.jpg", -1))
+
+        with pytest.raises(InvalidLink):
+            verify_expiring_link(uuid, query_params)
+
+    def test_verify_link_after_key_rotation(self, settings):
+        """
+        Assert that links signed with a previous key are accepted as long as the key is listed, and refused after.
+        """
+        settings.EXPIRING_LINK_SIGNING_KEYS = {"old": "old-secret"}
+        settings.EXPIRING_LINK_SIGNING_KEY_ID = "old"
+        uuid = uuid_lib.uuid4()
+        query_params = get_query_params(get_expiring_link(uuid, "images/account/image.jpg", 450))
+
+        settings.EXPIRING_LINK_SIGNING_KEYS = {"old": "old-secret", "new": "new-secret"}
+        settings.EXPIRING_LINK_SIGNING_KEY_ID = "new"
+        verify_expiring_link(uuid, query_params)
+        assert get_query_params(get_expiring_link(uuid, "images/account/image.jpg", 450))["key"] == "new"
+
+        settings.EXPIRING_LINK_SIGNING_KEYS = {"new": "new-secret"}
+        with pytest.raises(InvalidLink):
+            verify_expiring_link(uuid, query_params)
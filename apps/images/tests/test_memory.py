@@ -0,0 +1,146 @@
+import pytest
+from django.core.cache import caches
+from django.urls import reverse
+
+from apps.core.memory import TOP_OFFENDERS_CACHE_KEY, RequestMemory, get_top_offenders
+from apps.images.api.links import get_expiring_link
+from apps.images.conftest import get_thumbnail_url
+
+
+class FakeProbe:
+    """
+    Memory probe returning the given current and peak usage.
+    """
+
+    def __init__(self, current=0):
+        self.current = self.peak = current
+
+    def allocate(self, size):
+        self.current += size
+        self.peak = max(self.peak, self.current)
+
+    def reset_peak(self):
+        self.peak = self.current
+
+    def read(self):
+        return self.current, self.peak
+
+
+@pytest.fixture
+def memory_tracking(settings):
+    settings.MEMORY_TRACKING = True
+    settings.MEMORY_TRACKING_THRESHOLD = 0
+    caches[settings.MEMORY_TRACKING_CACHE_ALIAS].delete(TOP_OFFENDERS_CACHE_KEY)
+    yield
+    caches[settings.MEMORY_TRACKING_CACHE_ALIAS].delete(TOP_OFFENDERS_CACHE_KEY)
+
+
+class TestRequestMemory:
+    def test_peaks(self):
+        """
+        Assert that the peaks of the request and of its sections are measured above their starting usage.
+        """
+        probe = FakeProbe(current=1000)
+        memory = RequestMemory(probe)
+        probe.allocate(500)
+        with memory.section("render"):
+            probe.allocate(300)
+            probe.allocate(-800)
+        probe.allocate(100)
+
+        memory.checkpoint()
+
+        assert memory.sections == {"render": 300}
+        assert memory.peak == 800
+
+    def test_overlapped(self):
+        """
+        Assert that requests tracked at the same time are marked as overlapped, unlike the requests tracked after them.
+        """
+        first, second = RequestMemory(FakeProbe()), RequestMemory(FakeProbe())
+        first.close()
+        second.close()
+
+        third = RequestMemory(FakeProbe())
+        third.close()
+
+        assert first.overlapped and second.overlapped
+        assert not third.overlapped
+
+
+class TestMemoryTrackingMiddleware:
+    def test_thumbnail(self, memory_tracking, api_client, image_premium_account_fixture):
+        """
+        Assert that rendering a thumbnail is recorded as a top offender, with its render section and the pixel count
+        of the source image.
+        """
+        url = get_thumbnail_url(image_premium_account_fixture)
+
+        response = api_client.get(url)
+        response.getvalue()
+        (offender,) = get_top_offenders()
+
+        assert response.status_code == 200
+        assert offender["path"] == url
+        assert offender["peak_bytes"] >= 0
+        assert offender["approximate"] is False
+        assert "render" in offender["sections"]
+        assert offender["source_pixels"] > 0
+
+    def test_streamed_response(self, memory_tracking, api_client, image_enterprise_account_fixture):
+        """
+        Assert that requests with streamed responses are recorded once their body is sent.
+        """
+        link = get_expiring_link(
+            image_enterprise_account_fixture.uuid, image_enterprise_account_fixture.image.name, 300
+        )
+
+        response = api_client.get(link)
+        assert get_top_offenders() == []
+        b"".join(response.streaming_content)
+
+        (offender,) = get_top_offenders()
+        assert "stream" in offender["sections"]
+
+    def test_top_offenders(self, memory_tracking, settings, api_client, account_basic_fixture):
+        """
+        Assert that only the requests with the highest peaks are kept, from the highest one.
+        """
+        settings.MEMORY_TRACKING_TOP_OFFENDERS = 2
+        for _ in range(3):
+            api_client.get(reverse("apiv1:images-list"))
+
+        peaks = [offender["peak_bytes"] for offender in get_top_offenders()]
+        assert len(peaks) == 2
+        assert peaks == sorted(peaks, reverse=True)
+
+    def test_below_threshold(self, memory_tracking, settings, api_client, account_basic_fixture):
+        """
+        Assert that requests peaking below the threshold are not recorded.
+        """
+        settings.MEMORY_TRACKING_THRESHOLD = 1024**4
+
+        api_client.get(reverse("apiv1:images-list"))
+
+        assert get_top_offenders() == []
+
+
+class TestMemoryOffendersView:
+    def test_anonymous(self, client):
+        """
+        Assert that the top offenders endpoint refuses non-staff requests.
+        """
+        assert client.get(reverse("memory_offenders")).status_code == 403
+
+    def test_staff(self, memory_tracking, client, admin_user):
+        """
+        Assert that the top offenders endpoint lists the recorded requests to staff users.
+        """
+        client.force_login(admin_user)
+        client.get(reverse("memory_offenders"))
+
+        response = client.get(reverse("memory_offenders"))
+
+        assert response.status_code == 200
+        assert response.json()["tracking"] is True
+        assert response.json()["offenders"][0]["path"] == reverse("memory_offenders")
@@ -0,0 +1,152 @@
+import pytest
+from django.urls import reverse
+
+from apps.core.metrics import MetricsRegistry, registry
+from apps.images.cache import ThumbnailCache
+
+
+def get_sample(name, label_values=()):
+    return registry.collect().get((name, label_values), 0)
+
+
+class TestMetricsRegistry:
+    def test_render_counter(self, settings):
+        """
+        Assert that counters are rendered in Prometheus text format, with escaped label values.
+        """
+        settings.METRICS_DIRECTORY = ""
+        metrics = MetricsRegistry()
+        counter = metrics.counter("uploads", "Uploads by result.", labelnames=("result",))
+        counter.inc(result="valid")
+        counter.inc(2, result="valid")
+        counter.inc(result='in"valid')
+
+        assert metrics.render().splitlines() == [
+            "# HELP uploads Uploads by result.",
+            "# TYPE uploads counter",
+            'uploads_total{result="in\\"valid"} 1',
+            'uploads_total{result="valid"} 3',
+        ]
+
+    def test_render_histogram(self, settings):
+        """
+        Assert that histograms are rendered with cumulative bucket counts, their count and their sum.
+        """
+        settings.METRICS_DIRECTORY = ""
+        metrics = MetricsRegistry()
+        histogram = metrics.histogram("render_seconds", "Render time.", labelnames=("format",), buckets=(0.1, 1.0))
+        histogram.observe(0.05, format="JPEG")
+        histogram.observe(0.5, format="JPEG")
+        histogram.observe(5, format="JPEG")
+
+        assert metrics.render().splitlines() == [
+            "# HELP render_seconds Render time.",
+            "# TYPE render_seconds histogram",
+            'render_seconds_bucket{format="JPEG",le="0.1"} 1',
+            'render_seconds_bucket{format="JPEG",le="1.0"} 2',
+            'render_seconds_bucket{format="JPEG",le="+Inf"} 3',
+            'render_seconds_count{format="JPEG"} 3',
+            'render_seconds_sum{format="JPEG"} 5.55',
+        ]
+
+    def test_register_twice(self, settings):
+        """
+        Assert that a metric name can only be registered once.
+        """
+        metrics = MetricsRegistry()
+        metrics.counter("uploads", "Uploads.")
+
+        with pytest.raises(ValueError):
+            metrics.counter("uploads", "Uploads.")
+
+    def test_collect_processes(self, settings, tmp_path):
+        """
+        Assert that values written by several processes to the metrics directory are summed when collected.
+        """
+        settings.METRICS_DIRECTORY = str(tmp_path)
+        settings.METRICS_FLUSH_INTERVAL = 3600
+        first_process, second_process = MetricsRegistry(), MetricsRegistry()
+        first_process.counter("uploads", "Uploads.").inc(2)
+        second_process.counter("uploads", "Uploads.").inc(3)
+        second_process.flush()
+
+        assert first_process.collect() == {("uploads_total", ()): 5}
+        assert len(list(tmp_path.glob("metrics-*.json"))) == 2
+
+
+class TestMetricsView:
+    def test_metrics_anonymous(self, client):
+        """
+        Assert that the metrics endpoint refuses anonymous requests.
+        """
+        response = client.get(reverse("metrics"))
+
+        assert response.status_code == 403
+
+    def test_metrics_staff(self, client, admin_user):
+        """
+        Assert that the metrics endpoint returns the metrics in Prometheus text format to staff users.
+        """
+        client.force_login(admin_user)
+        response = client.get(reverse("metrics"))
+
+        assert response.status_code == 200
+        assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert "# TYPE thumbnail_requests counter" in response.content.decode()
+
+    def test_metrics_token(self, client, settings):
+        """
+        Assert that the metrics endpoint accepts requests authorized by the metrics bearer token only.
+        """
+        settings.METRICS_AUTH_TOKEN = "secret"
+
+        assert client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret").status_code == 200
+        assert client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer wrong").status_code == 403
+
+
+class TestThumbnailMetrics:
+    def test_thumbnail_requests(self, api_client, image_premium_account_fixture):
+        """
+        Assert that thumbnail requests are counted by the source of the thumbnail, and their responses by status.
+        """
+        url = reverse(
+            "apiv1:images_render_thumbnail",
+            kwargs={
+                "uuid": image_premium_account_fixture.uuid,
+                "height": image_premium_account_fixture.account.plan.available_thumbnail_heights[0],
+            },
+        )
+        rendered = get_sample("thumbnail_requests_total", ("render",))
+        indexed = get_sample("thumbnail_requests_total", ("index",))
+        succeeded = get_sample("responses_total", ("thumbnail", "200"))
+        sent_bytes = get_sample("response_bytes_total", ("thumbnail",))
+
+        api_client.get(url)
+        api_client.get(url)
+
+        assert get_sample("thumbnail_requests_total", ("render",)) == rendered + 1
+        assert get_sample("thumbnail_requests_total", ("index",)) == indexed + 1
+        assert get_sample("responses_total", ("thumbnail", "200")) == succeeded + 2
+        assert get_sample("response_bytes_total", ("thumbnail",)) > sent_bytes
+
+    def test_thumbnail_cache(self, api_client, monkeypatch, image_premium_account_fixture):
+        """
+        Assert that lookups in the in-memory thumbnail cache are counted by their result.
+        """
+        thumbnail_cache = ThumbnailCache(max_bytes=1024 * 1024, max_item_bytes=1024 * 1024)
+        monkeypatch.setattr("apps.images.api.views.get_thumbnail_cache", lambda: thumbnail_cache)
+        url = reverse(
+            "apiv1:images_render_thumbnail",
+            kwargs={
+                "uuid": image_premium_account_fixture.uuid,
+                "height": image_premium_account_fixture.account.plan.available_thumbnail_heights[0],
+            },
+        )
+        hits = get_sample("thumbnail_cache_lookups_total", ("hit",))
+        misses = get_sample("thumbnail_cache_lookups_total", ("miss",))
+
+        api_client.get(url)
+        api_client.get(url)
+
+        assert get_sample("thumbnail_cache_lookups_total", ("miss",)) == misses + 1
+        assert get_sample("thumbnail_cache_lookups_total", ("hit",)) == hits + 1
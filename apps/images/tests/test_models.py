@@ -1,10 +1,16 @@
+import io
 import os
 
+import PIL
 import pytest
 from django.conf import settings
 from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
 
-from apps.images.models import Image
+from apps.images.cache import CachedThumbnail, ThumbnailCache
+from apps.images.conftest import IMAGE_FILE_JPEG_TEST, delete_image_files
+from apps.images.content import get_thumbnail_directory
+from apps.images.models import Image, ImageContent
 
 
 class TestImage:
@@ -14,14 +20,79 @@ class TestImage:
         """
         test_image = image_premium_account_fixture
         assert Image.objects.all().count() == 1
-        assert test_image.image.name.endswith("image.jpg")
+        assert test_image.image.name.endswith(".jpg")
 
     def test_image_directory_path(self, image_premium_account_fixture, account_premium_fixture):
         """
-        Assert that the Image instance's image file exists at the desired directory.
+        Assert that the Image instance's image file exists at the path given by the hash of its content.
         """
-        desired_path = os.path.join(
-            settings.MEDIA_ROOT,
-            f"images/{account_premium_fixture.username}/{image_premium_account_fixture.uuid}/image.jpg",
+        content_hash = image_premium_account_fixture.content_hash
+        desired_name = f"originals/{content_hash[:2]}/{content_hash[2:4]}/{content_hash}.jpg"
+        assert image_premium_account_fixture.image.name == desired_name
+        assert default_storage.exists(os.path.join(settings.MEDIA_ROOT, desired_name))
+
+
+class TestImageContent:
+    def create_image(self, account):
+        return Image.objects.create(
+            account=account,
+            image=SimpleUploadedFile(name="image.jpeg", content=IMAGE_FILE_JPEG_TEST, content_type="image/jpeg"),
         )
-        assert default_storage.exists(desired_path)
+
+    def test_identical_uploads_share_file(self, image_premium_account_fixture, account_basic_fixture):
+        """
+        Assert that images with identical content share a single original file, counted by ImageContent.
+        """
+        image = self.create_image(account_basic_fixture)
+
+        assert image.image.name == image_premium_account_fixture.image.name
+        assert image.content_hash == image_premium_account_fixture.content_hash
+        assert ImageContent.objects.get(content_hash=image.content_hash).reference_count == 2
+        assert len(os.listdir(os.path.dirname(image.image.path))) == 1
+
+    def test_delete_releases_content(
+        self, image_premium_account_fixture, account_basic_fixture, django_capture_on_commit_callbacks
+    ):
+        """
+        Assert that deleting an image keeps the shared files while another image references its content,
+        and deletes them with the last image.
+        """
+        image = self.create_image(account_basic_fixture)
+        thumbnail_directory = default_storage.path(get_thumbnail_directory(image.content_hash))
+        os.makedirs(thumbnail_directory, exist_ok=True)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            image.delete()
+
+        assert ImageContent.objects.get(content_hash=image.content_hash).reference_count == 1
+        assert default_storage.exists(image.image.name)
+        assert os.path.exists(thumbnail_directory)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            image_premium_account_fixture.delete()
+
+        assert not ImageContent.objects.filter(content_hash=image.content_hash).exists()
+        assert not default_storage.exists(image.image.name)
+        assert not os.path.exists(thumbnail_directory)
+
+    def test_replace_file_invalidates_cached_thumbnails(
+        self, monkeypatch, image_premium_account_fixture, django_capture_on_commit_callbacks
+    ):
+        """
+        Assert that replacing the file of an image removes its thumbnails from the in-memory cache once committed.
+        """
+        thumbnail_cache = ThumbnailCache(max_bytes=100, max_item_bytes=100)
+        monkeypatch.setattr("apps.images.models.get_thumbnail_cache", lambda: thumbnail_cache)
+        key = (image_premium_account_fixture.uuid, 200, "JPEG", "version", image_premium_account_fixture.content_hash)
+        thumbnail_cache.set(key, CachedThumbnail("account_premium", b"x", '"etag"', 0, None))
+        image = Image.objects.get(pk=image_premium_account_fixture.pk)
+        replacement = io.BytesIO()
+        PIL.Image.new("RGB", (400, 300), "blue").save(replacement, format="JPEG")
+        image.image = SimpleUploadedFile(name="blue.jpg", content=replacement.getvalue(), content_type="image/jpeg")
+
+        with django_capture_on_commit_callbacks(execute=True):
+            image.save()
+            assert thumbnail_cache.stats()["items"] == 1
+        delete_image_files(image)
+
+        assert thumbnail_cache.stats()["items"] == 0
@@ -0,0 +1,97 @@
+import os
+import re
+import time
+
+import pytest
+from django.core.exceptions import MiddlewareNotUsed
+
+from apps.core.middleware import profiling_middleware
+from apps.core.profiling import RequestProfile, StackSampler, tag_profile
+from apps.images.conftest import get_thumbnail_height, get_thumbnail_url
+
+
+def busy_wait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class TestRequestProfile:
+    def test_samples(self, tmp_path):
+        """
+        Assert that the profile samples the stacks of the profiled thread and writes them in collapsed stack format,
+        tagged with the values given while it was open.
+        """
+        with RequestProfile(StackSampler(interval=0.001)) as profile:
+            tag_profile(source="640x480")
+            busy_wait(0.05)
+        path = profile.write(str(tmp_path), "sampled-50ms-View", max_files=10)
+
+        assert re.fullmatch(
+            r"\d{8}T\d{12}-sampled-50ms-View-source_640x480-[0-9a-f]{8}\.collapsed", os.path.basename(path)
+        )
+        with open(path) as profile_file:
+            lines = profile_file.read().splitlines()
+        assert any("busy_wait (test_profiling.py:" in line for line in lines)
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+    def test_tag_outside_profile(self):
+        """
+        Assert that tags given outside of a profiled request are ignored.
+        """
+        tag_profile(source="640x480")
+        with RequestProfile(StackSampler(interval=0.001)) as profile:
+            pass
+
+        assert profile.tags == {}
+
+    def test_rotate(self, tmp_path):
+        """
+        Assert that only the newest profiles are kept.
+        """
+        paths = []
+        for number in range(3):
+            with RequestProfile(StackSampler(interval=0.001)) as profile:
+                pass
+            paths.append(profile.write(str(tmp_path), f"sampled-{number}ms-View", max_files=2))
+
+        assert sorted(os.path.join(tmp_path, name) for name in os.listdir(tmp_path)) == paths[1:]
+
+
+class TestProfilingMiddleware:
+    def test_disabled(self):
+        """
+        Assert that the middleware is not used unless a profiles directory and a rate or threshold are set.
+        """
+        with pytest.raises(MiddlewareNotUsed):
+            profiling_middleware(lambda request: None)
+
+    def test_sampled(self, settings, tmp_path, api_client, image_premium_account_fixture):
+        """
+        Assert that sampled requests are profiled, tagged with the view, the image's dimensions and the height.
+        """
+        settings.PROFILER_DIRECTORY = str(tmp_path)
+        settings.PROFILER_SAMPLE_RATE = 1.0
+
+        response = api_client.get(get_thumbnail_url(image_premium_account_fixture))
+        (profile_name,) = os.listdir(tmp_path)
+
+        assert response.status_code == 200
+        assert "-sampled-" in profile_name
+        assert "-ThumbnailRenderAPIView-source_" in profile_name
+        assert f"-height_{get_thumbnail_height(image_premium_account_fixture)}-" in profile_name
+
+    def test_slow(self, settings, tmp_path, api_client, image_premium_account_fixture):
+        """
+        Assert that requests are profiled if they are slower than the threshold only.
+        """
+        settings.PROFILER_DIRECTORY = str(tmp_path)
+        settings.PROFILER_SLOW_THRESHOLD = 60
+
+        api_client.get(get_thumbnail_url(image_premium_account_fixture))
+        assert os.listdir(tmp_path) == []
+
+        settings.PROFILER_SLOW_THRESHOLD = 0.000001
+        api_client.get(get_thumbnail_url(image_premium_account_fixture))
+        (profile_name,) = os.listdir(tmp_path)
+        assert "-slow-" in profile_name
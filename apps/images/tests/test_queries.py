@@ -0,0 +1,217 @@
+import json
+import os
+
+import pytest
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from apps.images.models import Image
+from apps.plans.cache import get_plan_cache
+
+
+@pytest.fixture
+def images_premium_account_fixture(account_premium_fixture, image_premium_account_fixture):
+    """
+    Creates 50 more Image instances of the Premium account, sharing the image file of `image_premium_account_fixture`.
+    """
+    Image.objects.bulk_create(
+        Image(account=account_premium_fixture, image=image_premium_account_fixture.image.name, alt=f"Image {number}")
+        for number in range(50)
+    )
+
+
+def authenticate_fresh_account(api_client, account):
+    """
+    Authenticates a freshly fetched copy of the account, so that its plan is not cached yet,
+    as it is the case for a real request (with a cold plan cache).
+    """
+    plan_cache = get_plan_cache()
+    if plan_cache is not None:
+        plan_cache.clear()
+    api_client.force_authenticate(user=type(account).objects.get(pk=account.pk))
+
+
+class TestImageViewsetsQueries:
+    def test_list_constant_queries(self, api_client, account_premium_fixture, image_premium_account_fixture):
+        """
+        Assert that listing images runs the same number of queries regardless of the number of images.
+        """
+        authenticate_fresh_account(api_client, account_premium_fixture)
+        with CaptureQueriesContext(connection) as single_image_queries:
+            api_client.get(reverse("apiv1:images-list"))
+
+        Image.objects.bulk_create(
+            Image(account=account_premium_fixture, image=image_premium_account_fixture.image.name) for _ in range(50)
+        )
+        authenticate_fresh_account(api_client, account_premium_fixture)
+        with CaptureQueriesContext(connection) as many_images_queries:
+            response = api_client.get(reverse("apiv1:images-list"))
+
+        assert len(json.loads(response.content)["results"]) == 50
+        assert len(many_images_queries) == len(single_image_queries)
+
+    def test_list_next_page_constant_queries(
+        self, api_client, django_assert_max_num_queries, images_premium_account_fixture, account_premium_fixture
+    ):
+        """
+        Assert that listing a further page of images stays within the query budget and never counts the images.
+        """
+        authenticate_fresh_account(api_client, account_premium_fixture)
+        next_url = json.loads(api_client.get(reverse("apiv1:images-list")).content)["next"]
+
+        authenticate_fresh_account(api_client, account_premium_fixture)
+        with django_assert_max_num_queries(3) as captured:
+            response = api_client.get(next_url)
+
+        assert len(json.loads(response.content)["results"]) == 1
+        assert not any("COUNT(" in query["sql"] for query in captured.captured_queries)
+
+    def test_list_queries(
+        self, api_client, django_assert_max_num_queries, images_premium_account_fixture, account_premium_fixture
+    ):
+        """
+        Assert that listing images stays within the query budget: plan, images and their renditions.
+        """
+        authenticate_fresh_account(api_client, account_premium_fixture)
+        with django_assert_max_num_queries(3):
+            api_client.get(reverse("apiv1:images-list"))
+
+    def test_retrieve_queries(self, api_client, django_assert_max_num_queries, image_premium_account_fixture):
+        """
+        Assert that retrieving an image stays within the query budget: plan, image and its renditions.
+        """
+        authenticate_fresh_account(api_client, image_premium_account_fixture.account)
+        with django_assert_max_num_queries(3):
+            api_client.get(reverse("apiv1:images-detail", kwargs={"uuid": image_premium_account_fixture.uuid}))
+
+    def test_create_queries(
+        self, api_client, django_assert_max_num_queries, image_serializer_valid_data_fixture, account_premium_fixture
+    ):
+        """
+        Assert that creating an image stays within the query budget.
+        """
+        authenticate_fresh_account(api_client, account_premium_fixture)
+        with django_assert_max_num_queries(5):
+            response = api_client.post(reverse("apiv1:images-list"), image_serializer_valid_data_fixture)
+
+        assert response.status_code == 201
+
+    def test_update_queries(self, api_client, django_assert_max_num_queries, image_premium_account_fixture):
+        """
+        Assert that updating an image stays within the query budget.
+        """
+        authenticate_fresh_account(api_client, image_premium_account_fixture.account)
+        with django_assert_max_num_queries(5):
+            response = api_client.patch(
+                reverse("apiv1:images-detail", kwargs={"uuid": image_premium_account_fixture.uuid}),
+                {"alt": "updated alt field"},
+            )
+
+        assert response.status_code == 200
+
+    def test_delete_queries(self, api_client, django_assert_max_num_queries, image_premium_account_fixture):
+        """
+        Assert that deleting an image stays within the query budget.
+        """
+        authenticate_fresh_account(api_client, image_premium_account_fixture.account)
+        with django_assert_max_num_queries(6):
+            response = api_client.delete(
+                reverse("apiv1:images-detail", kwargs={"uuid": image_premium_account_fixture.uuid})
+            )
+
+        assert response.status_code == 204
+
+
+class TestImageAPIViewsQueries:
+    def test_render_thumbnail_queries(self, api_client, django_assert_max_num_queries, image_premium_account_fixture):
+        """
+        Assert that serving an already rendered thumbnail stays within the query budget: plan and rendition index.
+        """
+        url = reverse(
+            "apiv1:images_render_thumbnail",
+            kwargs={
+                "uuid": image_premium_account_fixture.uuid,
+                "height": image_premium_account_fixture.account.plan.available_thumbnail_heights[0],
+            },
+        )
+        api_client.get(url)
+
+        authenticate_fresh_account(api_client, image_premium_account_fixture.account)
+        with django_assert_max_num_queries(2):
+            response = api_client.get(url)
+
+        assert response.status_code == 200
+
+    def test_render_thumbnail_cached_plan_queries(
+        self, api_client, django_assert_max_num_queries, image_premium_account_fixture
+    ):
+        """
+        Assert that serving an already rendered thumbnail does not query the plan once it is cached.
+        """
+        account = image_premium_account_fixture.account
+        url = reverse(
+            "apiv1:images_render_thumbnail",
+            kwargs={"uuid": image_premium_account_fixture.uuid, "height": account.plan.available_thumbnail_heights[0]},
+        )
+        authenticate_fresh_account(api_client, account)
+        api_client.get(url)
+
+        api_client.force_authenticate(user=type(account).objects.get(pk=account.pk))
+        with django_assert_max_num_queries(1) as captured:
+            response = api_client.get(url)
+
+        assert response.status_code == 200
+        assert not any("plans_plan" in query["sql"] for query in captured.captured_queries)
+
+    def test_generate_link_queries(self, api_client, django_assert_max_num_queries, image_enterprise_account_fixture):
+        """
+        Assert that generating an expiring link stays within the query budget: plan and image.
+        """
+        url = reverse(
+            "apiv1:images_generate_link", kwargs={"uuid": image_enterprise_account_fixture.uuid, "expiry_time": 450}
+        )
+
+        authenticate_fresh_account(api_client, image_enterprise_account_fixture.account)
+        with django_assert_max_num_queries(2):
+            response = api_client.get(url)
+
+        assert response.status_code == 200
+
+    def test_expiring_link_queries(self, api_client, django_assert_num_queries, image_enterprise_account_fixture):
+        """
+        Assert that opening an expiring link does not query the database at all.
+        """
+        url = reverse(
+            "apiv1:images_generate_link", kwargs={"uuid": image_enterprise_account_fixture.uuid, "expiry_time": 450}
+        )
+        expiring_link = json.loads(api_client.get(url).content)["Expiring link"]
+        api_client.logout()
+
+        with django_assert_num_queries(0):
+            response = api_client.get(expiring_link)
+
+        assert response.status_code == 200
+
+
+class TestImageBatchQueries:
+    @pytest.mark.parametrize("count", [1, 10])
+    def test_batch_queries(
+        self, count, api_client, django_assert_num_queries, account_premium_fixture, batch_upload_cleanup
+    ):
+        """
+        Assert that a batch upload runs the same queries whatever the number of images: a savepoint, a single upsert
+        of their contents, a single insert of the images, the plan, the savepoint's release and the renditions.
+        """
+        with open(os.path.join(settings.BASE_DIR, "test_media_files/test_image.jpg"), "rb") as image_file:
+            jpeg = image_file.read()
+        images = [SimpleUploadedFile(f"{number}.jpg", jpeg, content_type="image/jpeg") for number in range(count)]
+
+        authenticate_fresh_account(api_client, account_premium_fixture)
+        with django_assert_num_queries(6):
+            response = api_client.post(reverse("apiv1:images-batch"), {"images": images}, format="multipart")
+
+        assert response.status_code == 201
+        assert response.json()["created"] == count
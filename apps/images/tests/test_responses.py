@@ -0,0 +1,243 @@
+import os
+from email import message_from_bytes
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.http import FileResponse
+from django.utils.http import http_date
+
+from apps.images.api.responses import (
+    afile_response,
+    file_response,
+    get_file_validators,
+    parse_range_header,
+)
+
+
+class TestFileResponse:
+    def test_file_response_streams_file(self, rf, settings):
+        """
+        Assert that by default the file is streamed by Django instead of being read into memory.
+        """
+        settings.MEDIA_SENDFILE_BACKEND = ""
+        path = os.path.join(settings.BASE_DIR, "test_media_files/test_image.jpg")
+
+        response = file_response(rf.get("/"), path, content_type="image/jpeg")
+
+        assert isinstance(response, FileResponse)
+        assert response["Content-Type"] == "image/jpeg"
+        assert int(response["Content-Length"]) == os.path.getsize(path)
+        assert response.getvalue() == open(path, "rb").read()
+
+    def test_file_response_x_accel_redirect(self, rf, settings):
+        """
+        Assert that with `x-accel-redirect` backend the response is empty and points nginx to the internal location.
+        """
+        settings.MEDIA_SENDFILE_BACKEND = "x-accel-redirect"
+        settings.MEDIA_ACCEL_REDIRECT_PREFIX = "/protected-media/"
+        settings.MEDIA_ROOT = os.path.join(settings.BASE_DIR, "test_media_files")
+        path = os.path.join(settings.MEDIA_ROOT, "test_image.jpg")
+
+        response = file_response(rf.get("/"), path, content_type="image/jpeg")
+
+        assert response["X-Accel-Redirect"] == "/protected-media/test_image.jpg"
+        assert response.content == b""
+
+    def test_file_response_x_sendfile(self, rf, settings):
+        """
+        Assert that with `x-sendfile` backend the response is empty and points the proxy to the file.
+        """
+        settings.MEDIA_SENDFILE_BACKEND = "x-sendfile"
+        settings.MEDIA_ROOT = os.path.join(settings.BASE_DIR, "test_media_files")
+        path = os.path.join(settings.MEDIA_ROOT, "test_image.jpg")
+
+        response = file_response(rf.get("/"), path, content_type="image/jpeg")
+
+        assert response["X-Sendfile"] == path
+        assert response.content == b""
+
+    def test_file_response_validators(self, rf, settings):
+        """
+        Assert that the response carries ETag, Last-Modified and the given Cache-Control directives.
+        """
+        path = os.path.join(settings.BASE_DIR, "test_media_files/test_image.jpg")
+        etag, last_modified = get_file_validators(path)
+
+        response = file_response(rf.get("/"), path, content_type="image/jpeg", cache_control={"private": True})
+
+        assert response["ETag"] == etag
+        assert response["Last-Modified"] == http_date(last_modified)
+        assert response["Cache-Control"] == "private"
+
+    def test_file_response_if_none_match(self, rf, settings):
+        """
+        Assert that `304 Not Modified` is returned when the request's If-None-Match matches the file's ETag.
+        """
+        path = os.path.join(settings.BASE_DIR, "test_media_files/test_image.jpg")
+        etag, _ = get_file_validators(path)
+
+        response = file_response(rf.get("/", HTTP_IF_NONE_MATCH=etag), path, content_type="image/jpeg")
+
+        assert response.status_code == 304
+        assert response["ETag"] == etag
+
+    def test_file_response_if_modified_since(self, rf, settings):
+        """
+        Assert that `304 Not Modified` is returned only when the file was not modified since the given date.
+        """
+        path = os.path.join(settings.BASE_DIR, "test_media_files/test_image.jpg")
+        _, last_modified = get_file_validators(path)
+
+        not_modified = file_response(
+            rf.get("/", HTTP_IF_MODIFIED_SINCE=http_date(last_modified)), path, content_type="image/jpeg"
+        )
+        modified = file_response(
+            rf.get("/", HTTP_IF_MODIFIED_SINCE=http_date(last_modified - 1)), path, content_type="image/jpeg"
+        )
+
+        assert not_modified.status_code == 304
+        assert modified.status_code == 200
+
+
+class TestRangeRequests:
+    @pytest.fixture
+    def path(self, settings):
+        settings.MEDIA_SENDFILE_BACKEND = ""
+        return os.path.join(settings.BASE_DIR, "test_media_files/test_image.jpg")
+
+    @pytest.mark.parametrize(
+        "header, expected_ranges",
+        [
+            ("bytes=0-99", [(0, 99)]),
+            ("bytes=100-", [(100, 999)]),
+            ("bytes=-100", [(900, 999)]),
+            ("bytes=0-9999", [(0, 999)]),
+            ("bytes=500-599, 0-99", [(0, 99), (500, 599)]),
+            ("bytes=0-99,50-149,150-199", [(0, 199)]),
+            ("bytes=1000-1099", []),
+            ("bytes=-0", []),
+            ("bytes=99-0", None),
+            ("bytes=a-b", None),
+            ("items=0-99", None),
+            ("bytes=" + ",".join(["0-1"] * 17), None),
+        ],
+    )
+    def test_parse_range_header(self, header, expected_ranges):
+        """
+        Assert that byte ranges are parsed, clamped to the file size and merged, and malformed headers are ignored.
+        """
+        assert parse_range_header(header, 1000) == expected_ranges
+
+    def test_file_response_accept_ranges(self, rf, path):
+        """
+        Assert that the whole file advertises range support and ranges are ignored unless enabled.
+        """
+        assert file_response(rf.get("/"), path, "image/jpeg", accept_ranges=True)["Accept-Ranges"] == "bytes"
+        assert file_response(rf.get("/", HTTP_RANGE="bytes=0-99"), path, "image/jpeg").status_code == 200
+
+    def test_file_response_single_range(self, rf, path):
+        """
+        Assert that a single range is streamed as `206 Partial Content` with its Content-Range.
+        """
+        request = rf.get("/", HTTP_RANGE="bytes=100-199")
+
+        response = file_response(request, path, content_type="image/jpeg", accept_ranges=True)
+
+        assert response.status_code == 206
+        assert response.streaming
+        assert response["Content-Range"] == f"bytes 100-199/{os.path.getsize(path)}"
+        assert response["Content-Length"] == "100"
+        assert response.getvalue() == open(path, "rb").read()[100:200]
+
+    def test_file_response_multiple_ranges(self, rf, path):
+        """
+        Assert that several ranges are returned as `multipart/byteranges` parts of the right length.
+        """
+        request = rf.get("/", HTTP_RANGE="bytes=0-9,-20")
+        data = open(path, "rb").read()
+
+        response = file_response(request, path, content_type="image/jpeg", accept_ranges=True)
+        content = response.getvalue()
+        parts = message_from_bytes(
+            f"Content-Type: {response['Content-Type']}\r\n\r\n".encode() + content
+        ).get_payload()
+
+        assert response.status_code == 206
+        assert int(response["Content-Length"]) == len(content)
+        assert [part["Content-Range"] for part in parts] == [
+            f"bytes 0-9/{len(data)}",
+            f"bytes {len(data) - 20}-{len(data) - 1}/{len(data)}",
+        ]
+        assert content.endswith(b"--\r\n")
+
+    def test_file_response_range_not_satisfiable(self, rf, path):
+        """
+        Assert that `416 Range Not Satisfiable` is returned when no range is within the file.
+        """
+        request = rf.get("/", HTTP_RANGE="bytes=99999999-")
+
+        response = file_response(request, path, content_type="image/jpeg", accept_ranges=True)
+
+        assert response.status_code == 416
+        assert response["Content-Range"] == f"bytes */{os.path.getsize(path)}"
+
+    def test_file_response_if_range(self, rf, path):
+        """
+        Assert that ranges are served only if If-Range matches the file's current ETag or Last-Modified.
+        """
+        etag, last_modified = get_file_validators(path)
+
+        def get(if_range):
+            request = rf.get("/", HTTP_RANGE="bytes=0-99", HTTP_IF_RANGE=if_range)
+            return file_response(request, path, content_type="image/jpeg", accept_ranges=True)
+
+        assert get(etag).status_code == 206
+        assert get(http_date(last_modified)).status_code == 206
+        assert get('"outdated"').status_code == 200
+        assert get("W/" + etag).status_code == 200
+        assert get(http_date(last_modified - 1)).status_code == 200
+
+    def test_file_response_range_sendfile(self, rf, settings, path):
+        """
+        Assert that with a sendfile backend the range request is handed over to the web server as is.
+        """
+        settings.MEDIA_SENDFILE_BACKEND = "x-accel-redirect"
+        settings.MEDIA_ACCEL_REDIRECT_PREFIX = "/protected-media/"
+        settings.MEDIA_ROOT = os.path.join(settings.BASE_DIR, "test_media_files")
+        request = rf.get("/", HTTP_RANGE="bytes=0-99")
+
+        response = file_response(request, path, content_type="image/jpeg", accept_ranges=True)
+
+        assert response.status_code == 200
+        assert response["X-Accel-Redirect"] == "/protected-media/test_image.jpg"
+        assert not response.has_header("Content-Range")
+        assert not response.has_header("Accept-Ranges")
+
+    def test_afile_response_single_range(self, rf, path):
+        """
+        Assert that the async variant returns only the requested range.
+        """
+        request = rf.get("/", HTTP_RANGE="bytes=-50")
+
+        response = async_to_sync(afile_response)(request, path, content_type="image/jpeg", accept_ranges=True)
+
+        assert response.status_code == 206
+        assert response.content == open(path, "rb").read()[-50:]
+
+    def test_afile_response_large_file(self, rf, settings, path):
+        """
+        Assert that the async variant streams files larger than the buffering limit instead of reading them
+        into memory, while their small byte ranges are still served from memory.
+        """
+        settings.IMAGES_ASYNC_MAX_BUFFERED_BYTES = 100
+
+        response = async_to_sync(afile_response)(rf.get("/"), path, content_type="image/jpeg", accept_ranges=True)
+        range_response = async_to_sync(afile_response)(
+            rf.get("/", HTTP_RANGE="bytes=0-99"), path, content_type="image/jpeg", accept_ranges=True
+        )
+
+        assert isinstance(response, FileResponse)
+        assert response["Accept-Ranges"] == "bytes"
+        assert response.getvalue() == open(path, "rb").read()
+        assert not range_response.streaming
+        assert range_response.content == open(path, "rb").read()[:100]
@@ -19,11 +19,12 @@ class TestImageSerializer:
 
     def test_contains_expected_fields(self, image_premium_account_fixture):
         """
-        Assert that the serialized Image data contain all the correct fields, including `thumbnails` field.
+        Assert that the serialized Image data contain all the correct fields, including `thumbnails` and `renditions`
+        fields.
         """
         serializer = ImageSerializer(image_premium_account_fixture)
         base_fields = ["id", "account", "image", "alt", "uuid"]
-        to_representation_fields = ["thumbnails"]  # field added from "to representation" Image method
+        to_representation_fields = ["thumbnails", "renditions"]  # fields added from "to representation" Image method
 
         assert set(serializer.data.keys()) == set(base_fields + to_representation_fields)
 
@@ -0,0 +1,46 @@
+from django.urls import reverse
+
+
+class TestSessionAuthentication:
+    """
+    Requests authenticated by a session login, whose `request.user` is lazily loaded by AuthenticationMiddleware
+    (unlike the users set by `force_authenticate` in the other view tests).
+    """
+
+    def test_render_thumbnail(self, client, image_premium_account_fixture):
+        """
+        Assert that the thumbnail view serves a session-authenticated user.
+        """
+        client.force_login(image_premium_account_fixture.account)
+        height = image_premium_account_fixture.account.plan.available_thumbnail_heights[0]
+
+        response = client.get(
+            reverse(
+                "apiv1:images_render_thumbnail", kwargs={"uuid": image_premium_account_fixture.uuid, "height": height}
+            )
+        )
+
+        assert response.status_code == 200
+
+    def test_generate_link(self, client, image_enterprise_account_fixture):
+        """
+        Assert that the generate link view serves a session-authenticated user.
+        """
+        client.force_login(image_enterprise_account_fixture.account)
+
+        response = client.get(
+            reverse(
+                "apiv1:images_generate_link",
+                kwargs={"uuid": image_enterprise_account_fixture.uuid, "expiry_time": 450},
+            )
+        )
+
+        assert response.status_code == 200
+
+    def test_list(self, client, account_premium_fixture):
+        """
+        Assert that the image list serves a session-authenticated user.
+        """
+        client.force_login(account_premium_fixture)
+
+        assert client.get(reverse("apiv1:images-list")).status_code == 200
@@ -0,0 +1,54 @@
+import hashlib
+import os
+
+import pytest
+from django.core.files.base import ContentFile
+from django.test import RequestFactory
+
+from apps.images.content import get_content_hash, get_original_name
+from apps.images.storage import ContentAddressedStorage
+
+
+class TestContentAddressedStorage:
+    def test_save_existing_content(self, tmp_path):
+        """
+        Assert that saving a file stored by content hash under an existing name keeps the existing file.
+        """
+        storage = ContentAddressedStorage(location=tmp_path)
+        name = get_original_name(hashlib.sha256(b"content").hexdigest(), "image.jpg")
+
+        first_name = storage.save(name, ContentFile(b"content"))
+        second_name = storage.save(name, ContentFile(b"other content"))
+
+        assert first_name == second_name == name
+        assert storage.open(name).read() == b"content"
+        assert os.listdir(os.path.dirname(storage.path(name))) == [os.path.basename(name)]
+
+    def test_save_other_file(self, tmp_path):
+        """
+        Assert that other files are saved under an available name, as by FileSystemStorage.
+        """
+        storage = ContentAddressedStorage(location=tmp_path)
+
+        first_name = storage.save("images/account/image.jpg", ContentFile(b"content"))
+        second_name = storage.save("images/account/image.jpg", ContentFile(b"other content"))
+
+        assert first_name == "images/account/image.jpg"
+        assert second_name != first_name
+        assert storage.open(second_name).read() == b"other content"
+
+
+class TestContentHashUploadHandlers:
+    @pytest.mark.parametrize("max_memory_size", [2621440, 0])
+    def test_upload_content_hash(self, max_memory_size, settings):
+        """
+        Assert that uploaded files, kept in memory or streamed to temporary files, are hashed while they stream in.
+        """
+        settings.FILE_UPLOAD_MAX_MEMORY_SIZE = max_memory_size
+        content = os.urandom(100 * 1024)
+        request = RequestFactory().post("/", {"image": ContentFile(content, name="image.jpg")})
+
+        uploaded_file = request.FILES["image"]
+
+        assert uploaded_file.content_hash == hashlib.sha256(content).hexdigest()
+        assert get_content_hash(uploaded_file) == uploaded_file.content_hash
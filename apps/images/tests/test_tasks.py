@@ -0,0 +1,100 @@
+import os
+import threading
+import uuid as uuid_lib
+
+import PIL
+import pytest
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from apps.images.api.utils import get_thumbnail_path
+from apps.images.conftest import IMAGE_FILE_JPEG_TEST, delete_image_files
+from apps.images.models import Image
+from apps.images.tasks import BoundedExecutor, ThumbnailWorkerPool, get_thumbnail_pool
+
+
+class TestThumbnailWorkerPool:
+    def test_submit_renders_thumbnail(self, image_premium_account_fixture):
+        """
+        Assert that a submitted render creates a thumbnail of the requested height at the given path.
+        """
+        thumbnail_pool = ThumbnailWorkerPool(max_workers=1, max_queue_size=1)
+        request_height = 100
+        thumbnail_file_path = get_thumbnail_path(
+            image_premium_account_fixture.account, image_premium_account_fixture.uuid, request_height
+        )
+
+        future = thumbnail_pool.submit(image_premium_account_fixture.image.path, {request_height: thumbnail_file_path})
+
+        assert request_height in future.result(timeout=10)["heights"]
+        assert PIL.Image.open(thumbnail_file_path).height == request_height
+
+    def test_submit_retries_failed_render(self, monkeypatch, tmp_path):
+        """
+        Assert that a failing render is retried `max_retries` times before the error is propagated.
+        """
+        attempts = []
+
+        def failing_create_thumbnails(image_file, thumbnail_paths, encoder_profile=None):
+            attempts.append(thumbnail_paths)
+            raise OSError("Render failed.")
+
+        monkeypatch.setattr("apps.images.tasks.create_thumbnails", failing_create_thumbnails)
+        source_path = os.path.join(settings.BASE_DIR, "test_media_files/test_image.jpg")
+        thumbnail_pool = ThumbnailWorkerPool(max_workers=1, max_queue_size=1, max_retries=2)
+
+        future = thumbnail_pool.submit(source_path, {100: str(tmp_path / "thumbnail.jpg")})
+
+        with pytest.raises(OSError):
+            future.result(timeout=10)
+        assert len(attempts) == 3
+
+    def test_wait_not_queued(self, tmp_path):
+        """
+        Assert that waiting for a thumbnail which was never queued returns immediately.
+        """
+        thumbnail_pool = ThumbnailWorkerPool(max_workers=1, max_queue_size=1)
+
+        assert not thumbnail_pool.wait(str(tmp_path / "thumbnail.jpg"))
+
+
+class TestBoundedExecutor:
+    def test_submit_refused_when_full(self):
+        """
+        Assert that tasks beyond the running and queued ones are refused until a slot is released.
+        """
+        executor = BoundedExecutor(max_workers=1, max_queue_size=1)
+        release = threading.Event()
+
+        running = executor.submit(release.wait)
+        queued = executor.submit(release.wait)
+        assert executor.submit(release.wait) is None
+
+        release.set()
+        running.result(timeout=10)
+        queued.result(timeout=10)
+        assert executor.submit(lambda: 1).result(timeout=10) == 1
+
+
+class TestPregenerateThumbnails:
+    def test_image_upload_pregenerates_plan_thumbnails(
+        self, account_premium_fixture, django_capture_on_commit_callbacks, request
+    ):
+        """
+        Assert that saving a new Image queues all thumbnail heights of the owner's plan.
+        """
+        with django_capture_on_commit_callbacks(execute=True):
+            image = Image.objects.create(
+                account=account_premium_fixture,
+                image=SimpleUploadedFile(name="image.jpg", content=IMAGE_FILE_JPEG_TEST, content_type="image/jpeg"),
+                uuid=uuid_lib.uuid4(),
+            )
+        request.addfinalizer(lambda: delete_image_files(image))
+
+        for height in account_premium_fixture.plan.available_thumbnail_heights:
+            thumbnail_file_path = get_thumbnail_path(
+                account_premium_fixture, image.uuid, height, content_hash=image.content_hash
+            )
+            get_thumbnail_pool().wait(thumbnail_file_path, timeout=10)
+
+            assert PIL.Image.open(thumbnail_file_path).height == height
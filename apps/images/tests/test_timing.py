@@ -0,0 +1,108 @@
+import json
+import logging
+
+from asgiref.sync import async_to_sync
+from django.test import RequestFactory
+
+from apps.core.middleware import server_timing_middleware
+from apps.core.timing import span, start_request_timing
+from apps.images.api.async_views import thumbnail_render_view
+from apps.images.conftest import get_thumbnail_height, get_thumbnail_url
+
+
+def parse_server_timing(header):
+    return {metric.split(";")[0]: metric for metric in header.split(", ")}
+
+
+class TestTimingSpans:
+    def test_span_outside_request(self):
+        """
+        Assert that spans outside of a timed request are not recorded anywhere.
+        """
+        with span("decode"):
+            pass
+
+        with start_request_timing() as timing:
+            pass
+
+        assert timing.spans == {}
+
+    def test_span_inside_request(self):
+        """
+        Assert that spans of a timed request are summed and counted by name.
+        """
+        with start_request_timing() as timing:
+            with span("storage"):
+                pass
+            with span("storage"):
+                pass
+
+        assert list(timing.spans) == ["storage"]
+        assert timing.spans["storage"][1] == 2
+        assert timing.header(0.0125).endswith('desc="2x";dur=0.0, total;dur=12.5')
+
+
+class TestServerTimingMiddleware:
+    def test_header_thumbnail(self, settings, api_client, image_premium_account_fixture):
+        """
+        Assert that a rendered thumbnail's response reports the time spent on every phase of the request.
+        """
+        settings.SERVER_TIMING_HEADER = True
+
+        response = api_client.get(get_thumbnail_url(image_premium_account_fixture))
+
+        assert response.status_code == 200
+        assert set(parse_server_timing(response["Server-Timing"])) >= {
+            "db",
+            "storage",
+            "decode",
+            "resize",
+            "encode",
+            "total",
+        }
+
+    def test_header_async_thumbnail(self, settings, image_premium_account_fixture):
+        """
+        Assert that spans recorded by worker threads of the async thumbnail view are reported too.
+        """
+        settings.SERVER_TIMING_HEADER = True
+        request = RequestFactory().get("/")
+        request.user = image_premium_account_fixture.account
+
+        async def view(request):
+            return await thumbnail_render_view(
+                request,
+                uuid=image_premium_account_fixture.uuid,
+                height=get_thumbnail_height(image_premium_account_fixture),
+            )
+
+        middleware = server_timing_middleware(view)
+
+        response = async_to_sync(middleware)(request)
+
+        assert response.status_code == 200
+        assert {"db", "decode", "encode", "total"} <= set(parse_server_timing(response["Server-Timing"]))
+
+    def test_log(self, settings, api_client, image_premium_account_fixture, caplog):
+        """
+        Assert that the timing of a request is logged as JSON, without the header if it is disabled.
+        """
+        settings.SERVER_TIMING_LOG = True
+
+        with caplog.at_level(logging.INFO, logger="apps.core.middleware"):
+            response = api_client.get(get_thumbnail_url(image_premium_account_fixture))
+        record = json.loads(caplog.records[-1].getMessage())
+
+        assert not response.has_header("Server-Timing")
+        assert record["status"] == 200
+        assert record["path"] == get_thumbnail_url(image_premium_account_fixture)
+        assert record["spans"]["decode"]["count"] == 1
+
+    def test_disabled(self, api_client, image_premium_account_fixture):
+        """
+        Assert that no timing is reported by default.
+        """
+        response = api_client.get(get_thumbnail_url(image_premium_account_fixture))
+
+        assert response.status_code == 200
+        assert not response.has_header("Server-Timing")
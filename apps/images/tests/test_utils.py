@@ -1,11 +1,43 @@
+import io
 import os
+import threading
 
 import PIL
+import PIL.ImageCms
+import PIL.ImageDraw
+import PIL.ImageFilter
 import pytest
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
+from imagekit.utils import process_image
 
-from apps.images.api.utils import create_thumbnail
+from apps.images.api.utils import (
+    THUMBNAIL_FORMATS,
+    create_thumbnail,
+    create_thumbnails,
+    decode_image,
+    encode_thumbnail,
+    get_rendition_version,
+    get_structural_similarity,
+    get_thumbnail_lock_path,
+    get_thumbnail_path,
+    thumbnail_lock,
+    thumbnail_locks,
+    write_file_atomic,
+)
+from apps.plans.models import EncoderProfile
+
+
+@pytest.fixture
+def detailed_thumbnail():
+    """
+    Returns a 400x300 px image with gradients, lines and noise, so that its encoded size depends on quality.
+    """
+    img = PIL.Image.radial_gradient("L").resize((400, 300)).convert("RGB")
+    draw = PIL.ImageDraw.Draw(img)
+    for x in range(0, 400, 13):
+        draw.line((x, 0, 400 - x, 300), fill=(x % 255, 100, 200 - x % 200), width=2)
+    return PIL.Image.blend(img, PIL.Image.effect_noise((400, 300), 40).convert("RGB"), 0.3)
 
 
 class TestCreateThumbnail:
@@ -32,3 +64,293 @@ class TestCreateThumbnail:
         assert open(thumbnail_file_path, "rb").read()
         assert img.format == "JPEG"
         assert img.height == request_height
+
+
+class TestCreateThumbnailFormats:
+    @pytest.mark.parametrize("format", THUMBNAIL_FORMATS)
+    def test_create_thumbnail_format(self, format, account_premium_fixture, image_premium_account_fixture):
+        """
+        Assert that `create_thumbnail` function encodes the thumbnail in the given format,
+        at a path with the format's extension.
+        """
+        thumbnail_file_path = get_thumbnail_path(
+            account_premium_fixture, image_premium_account_fixture.uuid, 100, format
+        )
+
+        create_thumbnail(
+            image_file=image_premium_account_fixture.image, height=100, path=thumbnail_file_path, format=format
+        )
+
+        assert thumbnail_file_path.endswith("." + THUMBNAIL_FORMATS[format]["extension"])
+        assert PIL.Image.open(thumbnail_file_path).format == format
+
+    def test_rendition_version_per_format(self):
+        """
+        Assert that every thumbnail format has its own rendition version.
+        """
+        versions = {get_rendition_version(format) for format in THUMBNAIL_FORMATS}
+
+        assert len(versions) == len(THUMBNAIL_FORMATS)
+
+
+class TestCreateThumbnails:
+    def test_create_thumbnails(self, account_premium_fixture, image_premium_account_fixture):
+        """
+        Assert that `create_thumbnails` function creates image files of all the given heights from a single source
+        and reports decode and per-height render timings.
+        """
+        request_heights = [50, 100, 200]
+        thumbnail_paths = {
+            height: get_thumbnail_path(account_premium_fixture, image_premium_account_fixture.uuid, height)
+            for height in request_heights
+        }
+
+        timings = create_thumbnails(image_file=image_premium_account_fixture.image, thumbnail_paths=thumbnail_paths)
+
+        for height, thumbnail_file_path in thumbnail_paths.items():
+            img = PIL.Image.open(thumbnail_file_path)
+            assert img.format == "JPEG"
+            assert img.height == height
+        assert timings["decode"] > 0
+        assert set(timings["heights"]) == set(request_heights)
+        assert timings["sizes"] == {height: os.path.getsize(path) for height, path in thumbnail_paths.items()}
+        assert timings["bytes_saved"] == {}
+
+    def test_create_thumbnails_encoder_profile(self, account_premium_fixture, image_premium_account_fixture):
+        """
+        Assert that `create_thumbnails` function encodes thumbnails with the given encoder profile
+        and does not encode them again to report the bytes saved by default.
+        """
+        thumbnail_paths = {
+            height: get_thumbnail_path(account_premium_fixture, image_premium_account_fixture.uuid, height)
+            for height in [100, 200]
+        }
+        encoder_profile = EncoderProfile(name="Progressive", quality=40, progressive=True)
+
+        timings = create_thumbnails(
+            image_file=image_premium_account_fixture.image,
+            thumbnail_paths=thumbnail_paths,
+            encoder_profile=encoder_profile,
+        )
+
+        for height, thumbnail_file_path in thumbnail_paths.items():
+            assert PIL.Image.open(thumbnail_file_path).info.get("progressive")
+            assert timings["sizes"][height] == os.path.getsize(thumbnail_file_path)
+        assert timings["bytes_saved"] == {}
+
+    def test_create_thumbnails_report_bytes_saved(
+        self, settings, account_premium_fixture, image_premium_account_fixture
+    ):
+        """
+        Assert that `create_thumbnails` function reports the bytes saved by the encoder profile compared to the default
+        encoder settings if `THUMBNAIL_REPORT_BYTES_SAVED` setting is enabled.
+        """
+        settings.THUMBNAIL_REPORT_BYTES_SAVED = True
+        thumbnail_paths = {
+            height: get_thumbnail_path(account_premium_fixture, image_premium_account_fixture.uuid, height)
+            for height in [100, 200]
+        }
+
+        timings = create_thumbnails(
+            image_file=image_premium_account_fixture.image,
+            thumbnail_paths=thumbnail_paths,
+            encoder_profile=EncoderProfile(name="Progressive", quality=40, progressive=True),
+        )
+
+        assert set(timings["bytes_saved"]) == {100, 200}
+
+
+class TestEncodeThumbnail:
+    def test_encode_default_settings(self, detailed_thumbnail):
+        """
+        Assert that without an encoder profile, thumbnails are encoded with the default settings of the format.
+        """
+        data = encode_thumbnail(detailed_thumbnail)
+        expected = process_image(detailed_thumbnail, format="JPEG", options=THUMBNAIL_FORMATS["JPEG"]["options"])
+
+        assert data == expected.read()
+
+    def test_encode_byte_budget(self, detailed_thumbnail):
+        """
+        Assert that with a byte budget, thumbnails are encoded with the highest quality that fits in it.
+        """
+        encoder_profile = EncoderProfile(name="Budget", target_bits_per_pixel=1.0, min_quality=10, max_quality=95)
+
+        data = encode_thumbnail(detailed_thumbnail, encoder_profile=encoder_profile)
+        larger = encode_thumbnail(detailed_thumbnail, encoder_profile=EncoderProfile(name="Larger", quality=95))
+
+        assert len(data) <= 400 * 300 / 8
+        assert len(larger) > 400 * 300 / 8
+
+    def test_encode_byte_budget_unreachable(self, detailed_thumbnail):
+        """
+        Assert that thumbnails which do not fit in the byte budget are encoded with the minimum quality.
+        """
+        encoder_profile = EncoderProfile(name="Budget", target_bits_per_pixel=0.01, min_quality=20)
+
+        data = encode_thumbnail(detailed_thumbnail, encoder_profile=encoder_profile)
+
+        assert data == encode_thumbnail(detailed_thumbnail, encoder_profile=EncoderProfile(name="Min", quality=20))
+
+    def test_encode_ssim_target(self, detailed_thumbnail):
+        """
+        Assert that with a structural similarity target, thumbnails are encoded with the lowest quality reaching it.
+        """
+        encoder_profile = EncoderProfile(name="Similar", target_ssim=0.9, min_quality=10, max_quality=95)
+
+        data = encode_thumbnail(detailed_thumbnail, encoder_profile=encoder_profile)
+        similarity = get_structural_similarity(detailed_thumbnail, PIL.Image.open(io.BytesIO(data)))
+
+        assert similarity >= 0.9
+        assert len(data) < len(
+            encode_thumbnail(detailed_thumbnail, encoder_profile=EncoderProfile(name="Max", quality=95))
+        )
+
+    def test_encode_keeps_metadata(self, detailed_thumbnail):
+        """
+        Assert that the ICC color profile is kept only when the encoder profile does not strip metadata.
+        """
+        detailed_thumbnail.info["icc_profile"] = PIL.ImageCms.ImageCmsProfile(
+            PIL.ImageCms.createProfile("sRGB")
+        ).tobytes()
+
+        stripped = encode_thumbnail(detailed_thumbnail, encoder_profile=EncoderProfile(name="Stripped"))
+        kept = encode_thumbnail(detailed_thumbnail, encoder_profile=EncoderProfile(name="Kept", strip_metadata=False))
+
+        assert "icc_profile" not in PIL.Image.open(io.BytesIO(stripped)).info
+        assert PIL.Image.open(io.BytesIO(kept)).info["icc_profile"] == detailed_thumbnail.info["icc_profile"]
+
+    def test_structural_similarity(self, detailed_thumbnail):
+        """
+        Assert that identical images have structural similarity 1 and a degraded image a lower one.
+        """
+        blurred = detailed_thumbnail.filter(PIL.ImageFilter.GaussianBlur(2))
+
+        assert get_structural_similarity(detailed_thumbnail, detailed_thumbnail) == pytest.approx(1.0)
+        assert get_structural_similarity(detailed_thumbnail, blurred) < 0.9
+
+    def test_rendition_version_per_encoder_profile(self):
+        """
+        Assert that thumbnails encoded with an encoder profile have their own rendition version.
+        """
+        encoder_profile = EncoderProfile(name="Budget", target_bits_per_pixel=1.0)
+
+        assert get_rendition_version("JPEG", encoder_profile) != get_rendition_version("JPEG")
+        encoder_profile.target_bits_per_pixel = 2.0
+        assert get_rendition_version("JPEG", encoder_profile) != get_rendition_version(
+            "JPEG", EncoderProfile(name="Budget", target_bits_per_pixel=1.0)
+        )
+
+
+class TestDecodeImage:
+    def test_decode_jpeg_reduced(self):
+        """
+        Assert that a JPEG is decoded at a reduced scale which still covers the requested height.
+        """
+        source_image_file = open(os.path.join(settings.BASE_DIR, "test_media_files/test_image.jpg"), "rb")
+
+        img = decode_image(source_image_file, height=100)
+
+        assert 100 <= img.height < 504 / 2
+
+    def test_decode_png_reduced(self):
+        """
+        Assert that a PNG is reduced by an integer factor which still covers the requested height.
+        """
+        source_image_file = io.BytesIO()
+        PIL.Image.new("RGB", (600, 900)).save(source_image_file, format="PNG")
+
+        img = decode_image(source_image_file, height=200)
+
+        assert img.size == (150, 225)
+
+    def test_decode_upscale_full_size(self):
+        """
+        Assert that the image is decoded at full size when the requested height is larger than the image.
+        """
+        source_image_file = open(os.path.join(settings.BASE_DIR, "test_media_files/test_image.jpg"), "rb")
+
+        img = decode_image(source_image_file, height=1000)
+
+        assert img.size == (360, 504)
+
+    def test_decode_exceeds_pixel_budget(self, settings):
+        """
+        Assert that an image with more pixels than `IMAGE_MAX_PIXELS` is refused before it is decoded.
+        """
+        settings.IMAGE_MAX_PIXELS = 360 * 504 - 1
+        source_image_file = open(os.path.join(settings.BASE_DIR, "test_media_files/test_image.jpg"), "rb")
+
+        with pytest.raises(PIL.Image.DecompressionBombError):
+            decode_image(source_image_file, height=100)
+
+
+class TestWriteFileAtomic:
+    def test_write_file_atomic(self, tmp_path):
+        """
+        Assert that `write_file_atomic` replaces the file's content and leaves no temporary files behind.
+        """
+        path = str(tmp_path / "thumbnail.jpg")
+        write_file_atomic(path, b"old")
+
+        write_file_atomic(path, b"new")
+
+        assert open(path, "rb").read() == b"new"
+        assert os.listdir(tmp_path) == ["thumbnail.jpg"]
+
+
+class TestThumbnailLock:
+    def test_thumbnail_lock_excludes_concurrent_holders(self, tmp_path):
+        """
+        Assert that a second holder of the thumbnail lock waits until the first one releases it.
+        """
+        path = str(tmp_path / "thumbnail.jpg")
+        events = []
+
+        def hold_lock():
+            with thumbnail_lock(path):
+                events.append("second acquired")
+
+        with thumbnail_lock(path) as acquired:
+            thread = threading.Thread(target=hold_lock)
+            thread.start()
+            thread.join(timeout=0.2)
+            events.append("first released")
+        thread.join(timeout=5)
+
+        assert acquired
+        assert events == ["first released", "second acquired"]
+
+    def test_thumbnail_lock_timeout(self, tmp_path):
+        """
+        Assert that the thumbnail lock gives up after the timeout while another holder keeps it.
+        """
+        path = str(tmp_path / "thumbnail.jpg")
+
+        with thumbnail_lock(path):
+            with thumbnail_lock(path, timeout=0.1) as acquired:
+                assert not acquired
+
+    def test_thumbnail_lock_file(self, settings, tmp_path):
+        """
+        Assert that the lock file is kept in the lock directory instead of next to the thumbnail.
+        """
+        settings.THUMBNAIL_LOCK_DIRECTORY = str(tmp_path / "locks")
+        path = str(tmp_path / "thumbnails" / "thumbnail.jpg")
+
+        with thumbnail_lock(path):
+            pass
+
+        assert not (tmp_path / "thumbnails").exists()
+        assert os.listdir(tmp_path / "locks") == [os.path.basename(get_thumbnail_lock_path(path))]
+
+    def test_thumbnail_locks_shared_lock_file(self, settings, monkeypatch, tmp_path):
+        """
+        Assert that the locks of several thumbnails sharing a lock file are acquired once for all of them.
+        """
+        settings.THUMBNAIL_LOCK_DIRECTORY = str(tmp_path)
+        monkeypatch.setattr("apps.images.api.utils.THUMBNAIL_LOCK_COUNT", 1)
+        paths = [str(tmp_path / "first.jpg"), str(tmp_path / "second.jpg")]
+
+        with thumbnail_locks(paths, timeout=0.1) as locked_paths:
+            assert locked_paths == paths
@@ -0,0 +1,108 @@
+import io
+import os
+import struct
+import zlib
+
+import PIL
+import pytest
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from apps.images.validators import validate_image_file
+
+
+class ReadTrackingFile(io.BytesIO):
+    """
+    In-memory file recording the furthest position read from it.
+    """
+
+    name = "tracked.png"
+    furthest_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.furthest_read = max(self.furthest_read, self.tell())
+        return data
+
+
+def make_png(width, height):
+    """
+    Returns a tiny PNG file declaring an image of the given dimensions (its pixel data is cut short).
+    """
+
+    def chunk(chunk_type, data):
+        return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", ihdr) + chunk(b"IDAT", zlib.compress(bytes(64))) + chunk(b"IEND", b"")
+
+
+class TestValidateImageFile:
+    def test_valid_image(self):
+        """
+        Assert that a JPEG file with a JPEG extension is valid.
+        """
+        content = open(os.path.join(settings.BASE_DIR, "test_media_files/test_image.jpg"), "rb").read()
+
+        validate_image_file(SimpleUploadedFile("test_image.jpg", content))
+
+    def test_reads_header_only(self):
+        """
+        Assert that validation reads only the beginning of the file and rewinds it afterwards.
+        """
+        content = io.BytesIO()
+        PIL.Image.effect_noise((1000, 1000), 100).save(content, format="PNG")
+        tracked = ReadTrackingFile(content.getvalue())
+
+        validate_image_file(tracked)
+
+        assert tracked.furthest_read < 64 * 1024 < len(content.getvalue())
+        assert tracked.tell() == 0
+
+    def test_unsupported_content_type(self):
+        """
+        Assert that a GIF is refused, whatever its extension.
+        """
+        content = io.BytesIO()
+        PIL.Image.new("RGB", (10, 10)).save(content, format="GIF")
+
+        with pytest.raises(ValidationError, match="Only PNG and JPEG files are supported"):
+            validate_image_file(SimpleUploadedFile("image.jpg", content.getvalue()))
+
+    def test_extension_mismatch(self):
+        """
+        Assert that a PNG with a JPEG extension is refused.
+        """
+        content = io.BytesIO()
+        PIL.Image.new("RGB", (10, 10)).save(content, format="PNG")
+
+        with pytest.raises(ValidationError, match="does not match"):
+            validate_image_file(SimpleUploadedFile("image.jpg", content.getvalue()))
+
+    def test_too_many_pixels(self, settings):
+        """
+        Assert that an image with more pixels than `IMAGE_MAX_PIXELS` is refused.
+        """
+        settings.IMAGE_MAX_PIXELS = 360 * 504 - 1
+        content = open(os.path.join(settings.BASE_DIR, "test_media_files/test_image.jpg"), "rb").read()
+
+        with pytest.raises(ValidationError, match="too large"):
+            validate_image_file(SimpleUploadedFile("test_image.jpg", content))
+
+    def test_decompression_bomb(self):
+        """
+        Assert that a small file declaring huge dimensions is refused without decoding it.
+        """
+        with pytest.raises(ValidationError, match="too large"):
+            validate_image_file(SimpleUploadedFile("bomb.png", make_png(100_000, 100_000)))
+
+    def test_corrupted_image(self):
+        """
+        Assert that a PNG with a broken header (its checksum does not match) is refused.
+        """
+        content = bytearray(make_png(10, 10))
+        content[29:33] = bytes(4)  # checksum of IHDR chunk
+
+        with pytest.raises(ValidationError, match="corrupted"):
+            validate_image_file(SimpleUploadedFile("broken.png", bytes(content)))
@@ -1,10 +1,15 @@
 import io
 import json
+import os
 import time
+import uuid as uuid_lib
+import zipfile
 
 import PIL
 import pytest
 from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.urls import resolve, reverse
 from psycopg2.extras import NumericRange
 
@@ -14,8 +19,9 @@ from apps.images.api.views import (
     ThumbnailRenderAPIView,
 )
 from apps.images.api.viewsets import ImageViewSet
-from apps.images.models import Image
-from apps.plans.models import Plan
+from apps.images.content import get_content_hash, get_original_name
+from apps.images.models import Image, ThumbnailRendition
+from apps.plans.models import EncoderProfile, Plan
 
 
 class TestImageViewsets:
@@ -27,8 +33,34 @@ class TestImageViewsets:
         response_content = json.loads(response.content)
 
         assert response.status_code == 200
-        assert len(response_content) == 1
-        assert response_content[0]["id"] == image_premium_account_fixture.id
+        assert len(response_content["results"]) == 1
+        assert response_content["results"][0]["id"] == image_premium_account_fixture.id
+        assert response_content["next"] is None
+
+    def test_list_paginated(self, api_client, account_premium_fixture, image_premium_account_fixture):
+        """
+        Assert that Image viewset lists images newest first in pages of the plan's size, following the next links.
+        """
+        account_premium_fixture.plan.images_page_size = 2
+        account_premium_fixture.plan.save()
+        Image.objects.bulk_create(
+            Image(account=account_premium_fixture, image=image_premium_account_fixture.image.name) for _ in range(4)
+        )
+        expected_ids = list(
+            Image.objects.filter(account=account_premium_fixture)
+            .order_by("-created_at", "-id")
+            .values_list("id", flat=True)
+        )
+
+        listed_ids = []
+        url = reverse("apiv1:images-list")
+        while url:
+            response_content = json.loads(api_client.get(url).content)
+            assert len(response_content["results"]) <= 2
+            listed_ids += [image["id"] for image in response_content["results"]]
+            url = response_content["next"]
+
+        assert listed_ids == expected_ids
 
     def test_list_url_resolves_image_view_set(self, api_client):
         """
@@ -46,9 +78,8 @@ class TestImageViewsets:
         response_content = json.loads(response.content)
 
         assert response.status_code == 200
-        assert (
-            len(response_content) == 6
-        )  # 5 base Image serializer fields + `thumbnails` field added from `to representation` Image method
+        # 5 base Image serializer fields + `thumbnails` and `renditions` fields added from `to representation` method
+        assert len(response_content) == 7
         assert response_content["thumbnails"]
         assert response_content["id"] == image_premium_account_fixture.id
 
@@ -76,6 +107,24 @@ class TestImageViewsets:
         print(type(data))
         assert data["account"] == image_serializer_valid_data_fixture["account"]
 
+    def test_create_too_many_pixels(
+        self, api_client, account_premium_fixture, image_serializer_valid_data_fixture, settings
+    ):
+        """
+        Assert that Image viewset refuses an image with more pixels than allowed before saving its file.
+        """
+        settings.IMAGE_MAX_PIXELS = 360 * 504 - 1
+        image_file = image_serializer_valid_data_fixture["image"]
+        original_name = get_original_name(get_content_hash(image_file), image_file.name)
+        default_storage.delete(original_name)
+
+        response = api_client.post(reverse("apiv1:images-list"), image_serializer_valid_data_fixture)
+
+        assert response.status_code == 400
+        assert "too large" in response.json()["image"][0]
+        assert not Image.objects.exists()
+        assert not default_storage.exists(original_name)
+
     def test_update(self, api_client, account_premium_fixture, image_premium_account_fixture):
         """
         Assert that Image viewset correctly updates (PUT) Image data.
@@ -110,6 +159,122 @@ class TestImageViewsets:
         assert Image.objects.all().count() == 0
 
 
+def make_zip_archive(members):
+    """
+    Returns a zip archive of the given members (mapping their names to their contents).
+    """
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        for name, content in members.items():
+            zip_file.writestr(name, content)
+    return archive.getvalue()
+
+
+class TestImageBatchUpload:
+    def test_batch_multipart(self, api_client, account_premium_fixture, batch_upload_cleanup):
+        """
+        Assert that the batch endpoint creates an image of every valid part and reports invalid parts,
+        in the order of the parts.
+        """
+        jpeg = open(os.path.join(settings.BASE_DIR, "test_media_files/test_image.jpg"), "rb").read()
+        gif = open(os.path.join(settings.BASE_DIR, "test_media_files/test_image.gif"), "rb").read()
+        images = [
+            SimpleUploadedFile("first.jpg", jpeg, content_type="image/jpeg"),
+            SimpleUploadedFile("animation.gif", gif, content_type="image/gif"),
+            SimpleUploadedFile("second.jpg", jpeg, content_type="image/jpeg"),
+        ]
+
+        response = api_client.post(reverse("apiv1:images-batch"), {"images": images}, format="multipart")
+        data = response.json()
+
+        assert response.status_code == 201
+        assert data["created"] == 2
+        assert data["invalid"] == 1
+        assert [result["status"] for result in data["results"]] == ["created", "invalid", "created"]
+        assert "image" in data["results"][1]["errors"]
+        assert data["results"][0]["image"]["account"] == account_premium_fixture.id
+        assert Image.objects.filter(account=account_premium_fixture).count() == 2
+
+    def test_batch_zip_archive(self, api_client, account_premium_fixture, batch_upload_cleanup):
+        """
+        Assert that the batch endpoint creates images from members of a zip archive sent as the request body,
+        skipping directories and hidden files.
+        """
+        jpeg = open(os.path.join(settings.BASE_DIR, "test_media_files/test_image.jpg"), "rb").read()
+        archive = make_zip_archive({"album/first.jpg": jpeg, "album/second.jpg": jpeg, "__MACOSX/._first.jpg": b"x"})
+
+        response = api_client.post(reverse("apiv1:images-batch"), archive, content_type="application/zip")
+        data = response.json()
+
+        assert response.status_code == 201
+        assert [result["name"] for result in data["results"]] == ["first.jpg", "second.jpg"]
+        assert Image.objects.filter(account=account_premium_fixture).count() == 2
+
+    def test_batch_queries(
+        self, api_client, account_premium_fixture, batch_upload_cleanup, django_assert_max_num_queries
+    ):
+        """
+        Assert that the number of queries of a batch upload does not grow with the number of images.
+        """
+        jpeg = open(os.path.join(settings.BASE_DIR, "test_media_files/test_image.jpg"), "rb").read()
+        archive = make_zip_archive({f"{number}.jpg": jpeg for number in range(10)})
+
+        with django_assert_max_num_queries(6):
+            response = api_client.post(
+                reverse("apiv1:images-batch"),
+                {"archive": SimpleUploadedFile("album.zip", archive, content_type="application/zip")},
+                format="multipart",
+            )
+
+        assert response.status_code == 201
+        assert response.json()["created"] == 10
+
+    def test_batch_all_invalid(self, api_client, account_premium_fixture):
+        """
+        Assert that the batch endpoint answers 400 Bad Request when none of the files is valid.
+        """
+        gif = open(os.path.join(settings.BASE_DIR, "test_media_files/test_image.gif"), "rb").read()
+        images = [SimpleUploadedFile("animation.gif", gif, content_type="image/gif")]
+
+        response = api_client.post(reverse("apiv1:images-batch"), {"images": images}, format="multipart")
+
+        assert response.status_code == 400
+        assert response.json()["invalid"] == 1
+        assert not Image.objects.exists()
+
+    def test_batch_limits(self, api_client, account_premium_fixture, settings):
+        """
+        Assert that batches with more files or bytes than allowed are refused before any file is validated,
+        including zip archives declaring too large members.
+        """
+        jpeg = open(os.path.join(settings.BASE_DIR, "test_media_files/test_image.jpg"), "rb").read()
+        settings.IMAGE_BATCH_MAX_FILES = 1
+        images = [SimpleUploadedFile(f"{number}.jpg", jpeg, content_type="image/jpeg") for number in range(2)]
+
+        response = api_client.post(reverse("apiv1:images-batch"), {"images": images}, format="multipart")
+
+        assert response.status_code == 400
+        assert "At most 1 images" in response.json()["images"]
+
+        settings.IMAGE_BATCH_MAX_FILES = 10
+        settings.IMAGE_BATCH_MAX_BYTES = 1024 * 1024
+        archive = make_zip_archive({"bomb.jpg": bytes(2 * 1024 * 1024)})
+
+        response = api_client.post(reverse("apiv1:images-batch"), archive, content_type="application/zip")
+
+        assert response.status_code == 400
+        assert not Image.objects.exists()
+
+    def test_batch_invalid_archive(self, api_client, account_premium_fixture):
+        """
+        Assert that the batch endpoint refuses a request body which is not a zip archive.
+        """
+        response = api_client.post(reverse("apiv1:images-batch"), b"not a zip", content_type="application/zip")
+
+        assert response.status_code == 400
+        assert "archive" in response.json()
+
+
 class TestThumbnailAPIViews:
     def test_retrieve_render_height_available(self, api_client, image_premium_account_fixture):
         """
@@ -123,12 +288,195 @@ class TestThumbnailAPIViews:
                 kwargs={"uuid": image_premium_account_fixture.uuid, "height": available_height},
             )
         )
-        rendered_image = PIL.Image.open(io.BytesIO(response.content))
+        rendered_image = PIL.Image.open(io.BytesIO(response.getvalue()))
 
         assert response.status_code == 200
         assert rendered_image.format == "JPEG"
         assert rendered_image.height == available_height
 
+    def test_retrieve_render_encoder_profile(self, api_client, image_premium_account_fixture):
+        """
+        Assert that Image thumbnail view encodes the thumbnail with the encoder profile of the owner's plan.
+        """
+        plan = image_premium_account_fixture.account.plan
+        plan.encoder_profile = EncoderProfile.objects.create(name="Progressive", progressive=True)
+        plan.save()
+
+        response = api_client.get(
+            reverse(
+                "apiv1:images_render_thumbnail",
+                kwargs={"uuid": image_premium_account_fixture.uuid, "height": plan.available_thumbnail_heights[0]},
+            )
+        )
+        rendered_image = PIL.Image.open(io.BytesIO(response.getvalue()))
+
+        assert response.status_code == 200
+        assert rendered_image.info.get("progressive")
+
+    def test_retrieve_render_shared_thumbnail(self, api_client, image_premium_account_fixture):
+        """
+        Assert that a thumbnail rendered for an image is reused, without being rendered again, for another image
+        with identical content.
+        """
+        duplicate = Image.objects.create(
+            account=image_premium_account_fixture.account,
+            image=SimpleUploadedFile(
+                name="duplicate.jpg", content=image_premium_account_fixture.image.read(), content_type="image/jpeg"
+            ),
+        )
+        available_height = image_premium_account_fixture.account.plan.available_thumbnail_heights[0]
+        api_client.get(
+            reverse(
+                "apiv1:images_render_thumbnail",
+                kwargs={"uuid": image_premium_account_fixture.uuid, "height": available_height},
+            )
+        )
+        rendition = ThumbnailRendition.objects.get(image=image_premium_account_fixture, height=available_height)
+        rendered_at = os.stat(rendition.path).st_mtime_ns
+
+        response = api_client.get(
+            reverse("apiv1:images_render_thumbnail", kwargs={"uuid": duplicate.uuid, "height": available_height})
+        )
+
+        assert response.status_code == 200
+        assert ThumbnailRendition.objects.get(image=duplicate, height=available_height).path == rendition.path
+        assert os.stat(rendition.path).st_mtime_ns == rendered_at
+
+    def test_retrieve_render_indexes_thumbnail(self, api_client, image_premium_account_fixture):
+        """
+        Assert that Image thumbnail view records the rendered thumbnail in the rendition index
+        and serves it from the index afterwards.
+        """
+        available_height = image_premium_account_fixture.account.plan.available_thumbnail_heights[0]
+        url = reverse(
+            "apiv1:images_render_thumbnail",
+            kwargs={"uuid": image_premium_account_fixture.uuid, "height": available_height},
+        )
+        api_client.get(url)
+        rendition = ThumbnailRendition.objects.get(image=image_premium_account_fixture, height=available_height)
+        response = api_client.get(url)
+
+        assert rendition.format == "JPEG"
+        assert rendition.size == len(response.getvalue())
+        assert PIL.Image.open(rendition.path).width == rendition.width
+        assert response.status_code == 200
+
+    def test_retrieve_render_stale_index(self, api_client, image_premium_account_fixture):
+        """
+        Assert that Image thumbnail view regenerates the thumbnail when its indexed file was removed.
+        """
+        available_height = image_premium_account_fixture.account.plan.available_thumbnail_heights[0]
+        url = reverse(
+            "apiv1:images_render_thumbnail",
+            kwargs={"uuid": image_premium_account_fixture.uuid, "height": available_height},
+        )
+        api_client.get(url)
+        os.remove(ThumbnailRendition.objects.get(image=image_premium_account_fixture).path)
+        response = api_client.get(url)
+
+        assert response.status_code == 200
+        assert PIL.Image.open(io.BytesIO(response.getvalue())).height == available_height
+
+    def test_retrieve_render_encoder_profile_changed(self, api_client, image_premium_account_fixture):
+        """
+        Assert that Image thumbnail view renders the thumbnail again when its indexed file was rendered before
+        the encoder profile of the owner's plan changed.
+        """
+        plan = image_premium_account_fixture.account.plan
+        url = reverse(
+            "apiv1:images_render_thumbnail",
+            kwargs={"uuid": image_premium_account_fixture.uuid, "height": plan.available_thumbnail_heights[0]},
+        )
+        api_client.get(url)
+        previous_path = ThumbnailRendition.objects.get(image=image_premium_account_fixture).path
+        plan.encoder_profile = EncoderProfile.objects.create(name="Progressive", progressive=True)
+        plan.save()
+
+        response = api_client.get(url)
+
+        assert response.status_code == 200
+        assert PIL.Image.open(io.BytesIO(response.getvalue())).info.get("progressive")
+        assert ThumbnailRendition.objects.get(image=image_premium_account_fixture).path != previous_path
+
+    def test_retrieve_render_not_modified(self, api_client, image_premium_account_fixture):
+        """
+        Assert that Image thumbnail view sends cache headers and returns 304 Not Modified when the client
+        already has the current thumbnail.
+        """
+        available_height = image_premium_account_fixture.account.plan.available_thumbnail_heights[0]
+        url = reverse(
+            "apiv1:images_render_thumbnail",
+            kwargs={"uuid": image_premium_account_fixture.uuid, "height": available_height},
+        )
+        response = api_client.get(url)
+        conditional_response = api_client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+        assert "private" in response["Cache-Control"]
+        assert conditional_response.status_code == 304
+
+    @pytest.mark.parametrize(
+        "headers, query_string, expected_format",
+        [
+            ({}, "", "JPEG"),
+            ({"HTTP_ACCEPT": "image/webp,*/*;q=0.8"}, "", "WEBP"),
+            ({"HTTP_ACCEPT": "image/jpeg"}, "", "JPEG"),
+            ({}, "?format=webp", "WEBP"),
+            ({"HTTP_ACCEPT": "image/webp,*/*;q=0.8"}, "?format=jpg", "JPEG"),
+        ],
+    )
+    def test_retrieve_render_negotiated_format(
+        self, api_client, image_premium_account_fixture, headers, query_string, expected_format
+    ):
+        """
+        Assert that Image thumbnail view renders the thumbnail in the format negotiated from Accept header
+        or `?format=` query parameter, indexes it separately and declares that the response varies on Accept.
+        """
+        available_height = image_premium_account_fixture.account.plan.available_thumbnail_heights[0]
+        url = reverse(
+            "apiv1:images_render_thumbnail",
+            kwargs={"uuid": image_premium_account_fixture.uuid, "height": available_height},
+        )
+
+        response = api_client.get(url + query_string, **headers)
+        rendered_image = PIL.Image.open(io.BytesIO(response.getvalue()))
+
+        assert response.status_code == 200
+        assert rendered_image.format == expected_format
+        assert response["Content-Type"] == PIL.Image.MIME[expected_format]
+        assert response["Vary"] == "Accept"
+        assert ThumbnailRendition.objects.get(image=image_premium_account_fixture).format == expected_format
+
+    def test_retrieve_render_formats_indexed_separately(self, api_client, image_premium_account_fixture):
+        """
+        Assert that thumbnails of the same height in different formats are stored and indexed side by side.
+        """
+        available_height = image_premium_account_fixture.account.plan.available_thumbnail_heights[0]
+        url = reverse(
+            "apiv1:images_render_thumbnail",
+            kwargs={"uuid": image_premium_account_fixture.uuid, "height": available_height},
+        )
+
+        jpeg_response = api_client.get(url)
+        webp_response = api_client.get(url, HTTP_ACCEPT="image/webp")
+
+        assert jpeg_response["ETag"] != webp_response["ETag"]
+        assert set(
+            ThumbnailRendition.objects.filter(image=image_premium_account_fixture).values_list("format", flat=True)
+        ) == {"JPEG", "WEBP"}
+
+    def test_retrieve_render_format_not_acceptable(self, api_client, image_premium_account_fixture):
+        """
+        Assert that Image thumbnail view refuses requests accepting none of the thumbnail formats.
+        """
+        available_height = image_premium_account_fixture.account.plan.available_thumbnail_heights[0]
+        url = reverse(
+            "apiv1:images_render_thumbnail",
+            kwargs={"uuid": image_premium_account_fixture.uuid, "height": available_height},
+        )
+
+        assert api_client.get(url, HTTP_ACCEPT="image/gif").status_code == 406
+        assert api_client.get(url + "?format=gif").status_code == 404
+
     def test_retrieve_render_height_unavailable(self, api_client, image_premium_account_fixture):
         """
         Assert that Image thumbnail view raises 403 Forbidden error when given height unavailable
@@ -158,6 +506,17 @@ class TestThumbnailAPIViews:
 
         assert response.status_code == 403
 
+    def test_retrieve_render_unknown_image(self, api_client, account_premium_fixture):
+        """
+        Assert that Image thumbnail view raises 404 Not Found error when no Image has the requested uuid.
+        """
+        available_height = account_premium_fixture.plan.available_thumbnail_heights[0]
+        response = api_client.get(
+            reverse("apiv1:images_render_thumbnail", kwargs={"uuid": uuid_lib.uuid4(), "height": available_height})
+        )
+
+        assert response.status_code == 404
+
     def test_retrieve_render_url_resolves_thumbnail_retrieve_api_view(
         self, api_client, account_premium_fixture, image_premium_account_fixture
     ):
@@ -185,7 +544,7 @@ class TestImageGenerateLinkAPIViews:
         """
         uuid = image_enterprise_account_fixture.uuid
         valid_expiry_time = 450
-        query_string_start = "?sesame"
+        query_string_start = "?expires="
         response = api_client.get(
             reverse("apiv1:images_generate_link", kwargs={"uuid": uuid, "expiry_time": valid_expiry_time})
         )
@@ -200,6 +559,18 @@ class TestImageGenerateLinkAPIViews:
         assert response_content["Time to expire"] == f"{valid_expiry_time} seconds"
         assert response_content["Expiring link"].startswith(expiring_link)
 
+    def test_retrieve_generate_link_wrong_user(
+        self, api_client, account_enterprise_fixture, image_premium_account_fixture
+    ):
+        """
+        Assert that the view does not generate an expiring link to another user's image.
+        """
+        api_client.force_authenticate(user=account_enterprise_fixture)
+        uuid = image_premium_account_fixture.uuid
+        response = api_client.get(reverse("apiv1:images_generate_link", kwargs={"uuid": uuid, "expiry_time": 450}))
+
+        assert response.status_code == 404
+
     def test_retrieve_generate_link_unavailable(
         self, api_client, account_premium_fixture, image_premium_account_fixture
     ):
@@ -266,10 +637,38 @@ class TestImageExpiringLinkAPIViews:
 
         # Retrieve expiring link
         response = api_client.get(expiring_link)
-        rendered_image = PIL.Image.open(io.BytesIO(response.content))
+        rendered_image = PIL.Image.open(io.BytesIO(response.getvalue()))
 
         assert response.status_code == 200
         assert rendered_image.format == "JPEG"
+        assert f"max-age={valid_expiry_time}" in response["Cache-Control"]
+
+    def test_retrieve_expiring_link_range(self, api_client, image_enterprise_account_fixture):
+        """
+        Assert that the view serves a requested byte range of the original image.
+        """
+        uuid = image_enterprise_account_fixture.uuid
+        response = api_client.get(reverse("apiv1:images_generate_link", kwargs={"uuid": uuid, "expiry_time": 450}))
+        expiring_link = json.loads(response.content)["Expiring link"]
+        api_client.logout()
+
+        response = api_client.get(expiring_link, HTTP_RANGE="bytes=0-1")
+
+        assert response.status_code == 206
+        assert response.getvalue() == b"\xff\xd8"  # JPEG start of image marker
+
+    def test_retrieve_expiring_link_tampered(self, api_client, image_enterprise_account_fixture):
+        """
+        Assert that the view does not render the image when the link was altered after it was signed.
+        """
+        uuid = image_enterprise_account_fixture.uuid
+        response = api_client.get(reverse("apiv1:images_generate_link", kwargs={"uuid": uuid, "expiry_time": 450}))
+        expiring_link = json.loads(response.content)["Expiring link"]
+        api_client.logout()
+
+        response = api_client.get(expiring_link.replace("expires=", "expires=1"))
+
+        assert response.status_code == 403
 
     def test_retrieve_expiring_link_expired(self, api_client, image_enterprise_account_fixture):
         """
@@ -290,8 +689,8 @@ class TestImageExpiringLinkAPIViews:
         generate_link_content = json.loads(response.content)
         expiring_link = generate_link_content["Expiring link"]
 
-        # Wait through expiry time and retrieve expiring link
-        time.sleep(valid_expiry_time)
+        # Wait through expiry time (rounded up to a whole second when signing) and retrieve the link
+        time.sleep(valid_expiry_time + 1)
         response = api_client.get(expiring_link)
 
         assert response.status_code == 403
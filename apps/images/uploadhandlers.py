@@ -0,0 +1,43 @@
+import hashlib
+
+from django.core.files.uploadhandler import (
+    MemoryFileUploadHandler,
+    TemporaryFileUploadHandler,
+)
+
+
+class ContentHashMixin:
+    """
+    Hashes (SHA-256) uploaded files while they stream in and sets the hex digest as `content_hash` attribute
+    of the uploaded file (see apps.images.content.get_content_hash), so that they are not read again to be hashed.
+    """
+
+    def new_file(self, *args, **kwargs):
+        # Set before calling the handler, which may stop other handlers by raising StopFutureHandlers
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining_data = super().receive_data_chunk(raw_data, start)
+        if remaining_data is None:
+            # Only the handler which keeps the data hashes it
+            self.sha256.update(raw_data)
+        return remaining_data
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.content_hash = self.sha256.hexdigest()
+        return file
+
+
+class ContentHashMemoryFileUploadHandler(ContentHashMixin, MemoryFileUploadHandler):
+    """
+    Keeps small uploaded files in memory, hashing them while they stream in.
+    """
+
+
+class ContentHashTemporaryFileUploadHandler(ContentHashMixin, TemporaryFileUploadHandler):
+    """
+    Streams large uploaded files to temporary files, hashing them while they stream in.
+    """
@@ -1,17 +1,87 @@
+import os
+
 import magic
+import PIL.Image
+from django.conf import settings
 from django.core.exceptions import ValidationError
 
+from apps.core.memory import memory_section, tag_memory
+
+from .metrics import upload_validation_seconds, upload_validations
+
+# Supported content types of uploaded images, with their file extensions and Pillow format names
+IMAGE_CONTENT_TYPES = {
+    "image/jpeg": {"extensions": (".jpg", ".jpeg"), "format": "JPEG"},
+    "image/png": {"extensions": (".png",), "format": "PNG"},
+}
+
+# Number of bytes at the start of a file which libmagic looks at to recognize its content type
+CONTENT_SNIFF_BYTES = 2048
+
+
+def sniff_content_type(object):
+    """
+    Returns the content type of the file, recognized by libmagic from its first `CONTENT_SNIFF_BYTES` bytes only.
+    """
+    object.seek(0)
+    header = object.read(CONTENT_SNIFF_BYTES)
+    object.seek(0)
+    return magic.from_buffer(header, mime=True)
+
 
 def validate_content_type(object):
     """
     Validates that the image is a JPEG or PNG.
     """
-    valid_content_types = (
-        "image/jpeg",
-        "image/png",
-    )
-    content_type = magic.from_buffer(object.read(), mime=True)
-    object.seek(0)
-    
-    if not content_type in valid_content_types:
+    if sniff_content_type(object) not in IMAGE_CONTENT_TYPES:
         raise ValidationError("Unsupported file extension. Only PNG and JPEG files are supported.")
+
+
+def validate_image_file(object):
+    """
+    Validates that the uploaded image is a JPEG or PNG (both by its content and by its file extension), and that
+    its dimensions fit in `IMAGE_MAX_PIXELS` setting. Only the file's header is read: the content type is sniffed
+    from a bounded buffer and the dimensions are parsed by Pillow without decoding the image, so oversized images
+    and decompression bombs are refused before anything is decoded or written to the storage.
+    """
+    with upload_validation_seconds.time(), memory_section("validate"):
+        try:
+            check_image_file(object)
+        except ValidationError:
+            upload_validations.inc(result="invalid")
+            raise
+    upload_validations.inc(result="valid")
+
+
+def check_image_file(object):
+    """
+    Validates the uploaded image (see `validate_image_file`) without recording metrics.
+    """
+    content_type = sniff_content_type(object)
+    if content_type not in IMAGE_CONTENT_TYPES:
+        raise ValidationError("Unsupported file extension. Only PNG and JPEG files are supported.")
+
+    _, extension = os.path.splitext(object.name.lower())
+    if extension not in IMAGE_CONTENT_TYPES[content_type]["extensions"]:
+        raise ValidationError("The file extension does not match the image format.")
+
+    try:
+        with PIL.Image.open(object) as img:
+            format = img.format
+            width, height = img.size
+    except PIL.Image.DecompressionBombError:
+        # Raised by Pillow for images far beyond its own pixel limit
+        raise ValidationError(f"The image is too large. Images can have at most {settings.IMAGE_MAX_PIXELS} pixels.")
+    except (PIL.UnidentifiedImageError, OSError, SyntaxError):
+        raise ValidationError("The image file is corrupted.")
+    finally:
+        object.seek(0)
+
+    if format != IMAGE_CONTENT_TYPES[content_type]["format"] or not width or not height:
+        raise ValidationError("The image file is corrupted.")
+    tag_memory(source_pixels=width * height)
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            f"The image is too large ({width}x{height} px). Images can have at most {settings.IMAGE_MAX_PIXELS} "
+            f"pixels."
+        )
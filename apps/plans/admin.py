@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Plan
+from .models import EncoderProfile, Plan
 
 # Register your models here.
 
@@ -18,4 +18,26 @@ class PlanAdmin(admin.ModelAdmin):
         "can_access_original_image",
         "can_fetch_expiring_link",
         "expiring_link_time_range",
+        "images_page_size",
+        "encoder_profile",
+    ]
+
+
+@admin.register(EncoderProfile)
+class EncoderProfileAdmin(admin.ModelAdmin):
+    """
+    Base admin for EncoderProfile model.
+    """
+
+    model = EncoderProfile
+    list_display = [
+        "name",
+        "quality",
+        "optimize",
+        "progressive",
+        "strip_metadata",
+        "target_bits_per_pixel",
+        "target_ssim",
+        "min_quality",
+        "max_quality",
     ]
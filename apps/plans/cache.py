@@ -0,0 +1,176 @@
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+
+from .metrics import plan_cache_lookups
+from .models import Plan
+
+
+class PlanCache:
+    """
+    Cache of user plans (keyed by plan id) and of the plan id of every account (keyed by account id).
+
+    Entries are kept either in a per-process dictionary (`backend="memory"`) or in Django's cache framework
+    (`backend="django"`, using the `cache_alias` cache, shared by all processes). They expire after `timeout` seconds,
+    which bounds staleness when a plan is changed without signals (e.g. by `QuerySet.update()`) or, with the
+    per-process backend, by another process. Saved and deleted plans and accounts are invalidated by signals
+    (see apps.plans.signals).
+    """
+
+    def __init__(self, backend="memory", timeout=300, cache_alias="default"):
+        if backend not in ("memory", "django"):
+            raise ValueError(f"Unsupported plan cache backend: {backend!r}.")
+        self.backend = backend
+        self.timeout = timeout
+        self.cache_alias = cache_alias
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_plan(self, plan_id):
+        """
+        Returns the plan of a given id (with its encoder profile), or None if it does not exist.
+        """
+        key = f"plans:plan:{plan_id}"
+        entry = self._get(key)
+        if entry is None:
+            entry = (Plan.objects.select_related("encoder_profile").filter(pk=plan_id).first(),)
+            self._set(key, entry)
+        # Callers get their own copy, so that they never modify the cached instance
+        return copy.copy(entry[0])
+
+    def get_account_plan(self, account_id):
+        """
+        Returns the plan of the account of a given id, or None if the account has no plan or does not exist.
+        """
+        key = f"plans:account:{account_id}"
+        entry = self._get(key)
+        if entry is None:
+            entry = (get_user_model().objects.filter(pk=account_id).values_list("plan_id", flat=True).first(),)
+            self._set(key, entry)
+
+        plan_id = entry[0]
+        return self.get_plan(plan_id) if plan_id is not None else None
+
+    def invalidate_plan(self, plan_id):
+        """
+        Removes the plan of a given id from the cache.
+        """
+        self._delete(f"plans:plan:{plan_id}")
+
+    def invalidate_account(self, account_id):
+        """
+        Removes the plan id of the account of a given id from the cache.
+        """
+        self._delete(f"plans:account:{account_id}")
+
+    def clear(self):
+        """
+        Removes all cached entries of the per-process backend. Entries of Django's cache expire on their own.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns counters describing the cache effectiveness (of this process). Lookups of all processes are exposed
+        by the metrics endpoint too (see apps.plans.metrics).
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "items": len(self._entries) if self.backend == "memory" else None,
+            }
+
+    # Entries are stored as 1-tuples, so that a cached None (e.g. an account without a plan) is told from a miss
+
+    def _get(self, key):
+        if self.backend == "django":
+            entry = caches[self.cache_alias].get(key)
+        else:
+            with self._lock:
+                entry, expires_at = self._entries.get(key, (None, None))
+                if entry is not None and expires_at <= time.monotonic():
+                    del self._entries[key]
+                    entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        plan_cache_lookups.inc(result="miss" if entry is None else "hit")
+        return entry
+
+    def _set(self, key, entry):
+        if self.backend == "django":
+            caches[self.cache_alias].set(key, entry, timeout=self.timeout)
+        else:
+            with self._lock:
+                self._entries[key] = (entry, time.monotonic() + self.timeout)
+
+    def _delete(self, key):
+        if self.backend == "django":
+            caches[self.cache_alias].delete(key)
+        else:
+            with self._lock:
+                self._entries.pop(key, None)
+
+
+_plan_cache = None
+_plan_cache_lock = threading.Lock()
+
+
+def get_plan_cache():
+    """
+    Returns the process-wide plan cache, creating it from settings on first use.
+    Returns None if the cache is disabled (`PLAN_CACHE_BACKEND` is empty).
+    """
+    global _plan_cache
+
+    if not settings.PLAN_CACHE_BACKEND:
+        return None
+
+    with _plan_cache_lock:
+        if _plan_cache is None:
+            _plan_cache = PlanCache(
+                backend=settings.PLAN_CACHE_BACKEND,
+                timeout=settings.PLAN_CACHE_TIMEOUT,
+                cache_alias=settings.PLAN_CACHE_ALIAS,
+            )
+    return _plan_cache
+
+
+def get_user_plan(user):
+    """
+    Returns the plan of the given account, taken from the plan cache if it is enabled.
+    The plan is also set on the account instance, so that further `user.plan` lookups do not query the database.
+    """
+    # Looked up on the model options, as `request.user` of session-authenticated requests is a SimpleLazyObject
+    plan_field = user._meta.get_field("plan")
+    plan_cache = get_plan_cache()
+    if plan_cache is None or plan_field.is_cached(user):
+        return user.plan
+
+    plan = plan_cache.get_plan(user.plan_id) if user.plan_id is not None else None
+    plan_field.set_cached_value(user, plan)
+    return plan
+
+
+def get_account_plan(account_id):
+    """
+    Returns the plan of the account of a given id, taken from the plan cache if it is enabled.
+    """
+    plan_cache = get_plan_cache()
+    if plan_cache is None:
+        account = get_user_model().objects.select_related("plan").filter(pk=account_id).first()
+        return account.plan if account is not None else None
+    return plan_cache.get_account_plan(account_id)
@@ -0,0 +1,9 @@
+from apps.core.metrics import registry
+
+# Metrics of plans, exposed by the metrics endpoint (see apps.core.views.metrics_view)
+
+plan_cache_lookups = registry.counter(
+    "plan_cache_lookups",
+    "Lookups in the plan cache (see apps.plans.cache) by result (hit or miss).",
+    labelnames=("result",),
+)
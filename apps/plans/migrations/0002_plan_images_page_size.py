@@ -0,0 +1,19 @@
+# Generated by Django 3.2.8 on 2026-10-17 11:36
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plan',
+            name='images_page_size',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Number of images per page of the images list. Leave empty to use the default page size.', null=True, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.8 on 2026-10-17 11:52
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plans', '0002_plan_images_page_size'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EncoderProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(help_text='Name of the encoder profile.', max_length=50)),
+                ('quality', models.PositiveSmallIntegerField(default=60, help_text='Encoder quality (1-100), used unless a byte budget or a similarity target is set.', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(100)])),
+                ('optimize', models.BooleanField(default=True, help_text='Spend more encoding time on smaller files (optimized JPEG Huffman tables, slower WebP and AVIF compression methods).')),
+                ('progressive', models.BooleanField(default=True, help_text='Encode JPEG thumbnails as progressive JPEG.')),
+                ('strip_metadata', models.BooleanField(default=True, help_text='Leave out EXIF metadata and ICC color profile of the original image.')),
+                ('target_bits_per_pixel', models.FloatField(blank=True, help_text='Byte budget of thumbnails in bits per pixel, so that it scales with thumbnail height (e.g. 1.0 allows 5000 bytes for a 200x200 px thumbnail). Encodes with the highest quality within budget.', null=True, validators=[django.core.validators.MinValueValidator(0.01)])),
+                ('target_ssim', models.FloatField(blank=True, help_text='Structural similarity (SSIM, 0-1) to the unencoded thumbnail to achieve. Encodes with the lowest quality reaching it (within the byte budget, if set).', null=True, validators=[django.core.validators.MinValueValidator(0.0), django.core.validators.MaxValueValidator(1.0)])),
+                ('min_quality', models.PositiveSmallIntegerField(default=30, help_text='Lowest quality tried by the quality search.', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(100)])),
+                ('max_quality', models.PositiveSmallIntegerField(default=90, help_text='Highest quality tried by the quality search.', validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(100)])),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='plan',
+            name='encoder_profile',
+            field=models.ForeignKey(blank=True, help_text='Encoder settings of thumbnails. Leave empty to use the default settings.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='plans', to='plans.encoderprofile'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.postgres.fields import ArrayField, IntegerRangeField
-from django.core.validators import MinValueValidator
+from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 
 from apps.core.models import TimeStampedModel
@@ -7,6 +8,69 @@ from apps.core.models import TimeStampedModel
 # Create your models here.
 
 
+class EncoderProfile(TimeStampedModel):
+    """
+    Encoder settings of thumbnails, attachable to user plans.
+    Thumbnails are encoded with a fixed quality or, if a byte budget or a structural similarity target is set,
+    with the quality found by a binary search between the minimum and maximum quality (see apps.images.api.utils).
+    Changes apply to thumbnails rendered afterwards.
+    """
+
+    name = models.CharField(max_length=50, help_text="Name of the encoder profile.")
+    quality = models.PositiveSmallIntegerField(
+        default=60,
+        validators=[MinValueValidator(1), MaxValueValidator(100)],
+        help_text="Encoder quality (1-100), used unless a byte budget or a similarity target is set.",
+    )
+    optimize = models.BooleanField(
+        default=True,
+        help_text="Spend more encoding time on smaller files (optimized JPEG Huffman tables, slower WebP and AVIF "
+        "compression methods).",
+    )
+    progressive = models.BooleanField(default=True, help_text="Encode JPEG thumbnails as progressive JPEG.")
+    strip_metadata = models.BooleanField(
+        default=True, help_text="Leave out EXIF metadata and ICC color profile of the original image."
+    )
+    target_bits_per_pixel = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(0.01)],
+        help_text="Byte budget of thumbnails in bits per pixel, so that it scales with thumbnail height "
+        "(e.g. 1.0 allows 5000 bytes for a 200x200 px thumbnail). Encodes with the highest quality within budget.",
+    )
+    target_ssim = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(0.0), MaxValueValidator(1.0)],
+        help_text="Structural similarity (SSIM, 0-1) to the unencoded thumbnail to achieve. Encodes with the lowest "
+        "quality reaching it (within the byte budget, if set).",
+    )
+    min_quality = models.PositiveSmallIntegerField(
+        default=30,
+        validators=[MinValueValidator(1), MaxValueValidator(100)],
+        help_text="Lowest quality tried by the quality search.",
+    )
+    max_quality = models.PositiveSmallIntegerField(
+        default=90,
+        validators=[MinValueValidator(1), MaxValueValidator(100)],
+        help_text="Highest quality tried by the quality search.",
+    )
+
+    def clean(self):
+        if self.min_quality > self.max_quality:
+            raise ValidationError({"min_quality": "Minimum quality cannot be higher than maximum quality."})
+
+    @property
+    def searches_quality(self):
+        """
+        Whether the quality is found by a binary search instead of being fixed.
+        """
+        return self.target_bits_per_pixel is not None or self.target_ssim is not None
+
+    def __str__(self):
+        return self.name
+
+
 class Plan(TimeStampedModel):
     """
     Base model for account tiers (user plans).
@@ -29,6 +93,20 @@ class Plan(TimeStampedModel):
         validators=[MinValueValidator(1)],
         help_text="Minimum and maximum number of seconds for the expiring link to expire. To be specified by user.",
     )
+    images_page_size = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(1)],
+        help_text="Number of images per page of the images list. Leave empty to use the default page size.",
+    )
+    encoder_profile = models.ForeignKey(
+        EncoderProfile,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="plans",
+        help_text="Encoder settings of thumbnails. Leave empty to use the default settings.",
+    )
 
     def __str__(self):
         return self.name
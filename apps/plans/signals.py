@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .cache import get_plan_cache
+from .models import EncoderProfile, Plan
+
+
+def invalidate(invalidate_entry, key):
+    """
+    Removes an entry from the plan cache right away, so that the current transaction sees the change,
+    and again once the transaction is committed, in case the entry was cached meanwhile by a concurrent request.
+    """
+    invalidate_entry(key)
+    transaction.on_commit(lambda: invalidate_entry(key))
+
+
+@receiver(post_save, sender=Plan)
+@receiver(post_delete, sender=Plan)
+def invalidate_cached_plan(sender, instance, **kwargs):
+    """
+    Removes the saved or deleted plan from the plan cache.
+    """
+    plan_cache = get_plan_cache()
+    if plan_cache is not None:
+        invalidate(plan_cache.invalidate_plan, instance.pk)
+
+
+@receiver(pre_delete, sender=Plan)
+def invalidate_cached_plan_accounts(sender, instance, **kwargs):
+    """
+    Removes accounts of the plan being deleted from the plan cache, as they are moved to the default plan
+    without sending any signals.
+    """
+    plan_cache = get_plan_cache()
+    if plan_cache is not None:
+        for account_id in instance.accounts.values_list("pk", flat=True):
+            invalidate(plan_cache.invalidate_account, account_id)
+
+
+@receiver(post_save, sender=EncoderProfile)
+@receiver(pre_delete, sender=EncoderProfile)
+def invalidate_cached_encoder_profile_plans(sender, instance, **kwargs):
+    """
+    Removes plans using the saved or deleted encoder profile from the plan cache, as they are cached together
+    with their encoder profile.
+    """
+    plan_cache = get_plan_cache()
+    if plan_cache is not None:
+        for plan_id in instance.plans.values_list("pk", flat=True):
+            invalidate(plan_cache.invalidate_plan, plan_id)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_account(sender, instance, **kwargs):
+    """
+    Removes the saved or deleted account from the plan cache.
+    """
+    plan_cache = get_plan_cache()
+    if plan_cache is not None:
+        invalidate(plan_cache.invalidate_account, instance.pk)
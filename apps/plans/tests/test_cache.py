@@ -0,0 +1,178 @@
+import pytest
+from django.contrib.auth import get_user_model
+from django.utils.functional import SimpleLazyObject
+
+from apps.core.metrics import registry
+from apps.plans.cache import PlanCache, get_plan_cache, get_user_plan
+from apps.plans.models import EncoderProfile, Plan
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def plan_cache():
+    """
+    Returns the process-wide plan cache (invalidated by signals), cleared before and after the test.
+    """
+    plan_cache = get_plan_cache()
+    plan_cache.clear()
+    yield plan_cache
+    plan_cache.clear()
+
+
+@pytest.fixture
+def account(db):
+    return get_user_model().objects.create_user(username="account", password="testpass123", plan_id=2)
+
+
+class TestPlanCache:
+    @pytest.mark.parametrize("backend", ["memory", "django"])
+    def test_get_plan_cached(self, backend, django_assert_num_queries):
+        """
+        Assert that a plan is fetched from the database only once and counted as a hit afterwards.
+        """
+        plan_cache = PlanCache(backend=backend, cache_alias="default")
+        plan_cache.invalidate_plan(2)
+
+        with django_assert_num_queries(1):
+            assert plan_cache.get_plan(2).name == "Premium"
+        with django_assert_num_queries(0):
+            assert plan_cache.get_plan(2).name == "Premium"
+
+        assert plan_cache.stats()["hits"] == 1
+        assert plan_cache.stats()["misses"] == 1
+        assert plan_cache.stats()["hit_rate"] == 0.5
+
+    def test_lookups_metric(self):
+        """
+        Assert that lookups are counted by their result in the metrics registry.
+        """
+        plan_cache = PlanCache()
+        hits = registry.collect().get(("plan_cache_lookups_total", ("hit",)), 0)
+        misses = registry.collect().get(("plan_cache_lookups_total", ("miss",)), 0)
+
+        plan_cache.get_plan(2)
+        plan_cache.get_plan(2)
+
+        assert registry.collect()[("plan_cache_lookups_total", ("miss",))] == misses + 1
+        assert registry.collect()[("plan_cache_lookups_total", ("hit",))] == hits + 1
+
+    def test_get_plan_returns_copy(self):
+        """
+        Assert that modifying a returned plan does not modify the cached one.
+        """
+        plan_cache = PlanCache()
+        plan_cache.get_plan(2).available_thumbnail_heights = []
+
+        assert plan_cache.get_plan(2).available_thumbnail_heights
+
+    def test_get_account_plan_cached(self, account, django_assert_num_queries):
+        """
+        Assert that the plan of an account is looked up in the database only once.
+        """
+        plan_cache = PlanCache()
+
+        with django_assert_num_queries(2):
+            assert plan_cache.get_account_plan(account.id).name == "Premium"
+        with django_assert_num_queries(0):
+            assert plan_cache.get_account_plan(account.id).name == "Premium"
+
+    def test_entries_expire(self, django_assert_num_queries):
+        """
+        Assert that entries are fetched again once they expire.
+        """
+        plan_cache = PlanCache(timeout=0)
+        plan_cache.get_plan(2)
+
+        with django_assert_num_queries(1):
+            plan_cache.get_plan(2)
+
+    def test_unsupported_backend(self):
+        """
+        Assert that an unknown backend is refused.
+        """
+        with pytest.raises(ValueError):
+            PlanCache(backend="redis")
+
+
+class TestPlanCacheInvalidation:
+    def test_plan_save_invalidates_plan(self, plan_cache):
+        """
+        Assert that a saved plan is fetched again from the database.
+        """
+        plan_cache.get_plan(2)
+
+        plan = Plan.objects.get(id=2)
+        plan.images_page_size = 10
+        plan.save()
+
+        assert plan_cache.get_plan(2).images_page_size == 10
+
+    def test_account_save_invalidates_account(self, plan_cache, account):
+        """
+        Assert that a new plan of a saved account is looked up again.
+        """
+        plan_cache.get_account_plan(account.id)
+
+        account.plan_id = 3
+        account.save()
+
+        assert plan_cache.get_account_plan(account.id).name == "Enterprise"
+
+    def test_plan_delete_invalidates_accounts(self, plan_cache, account):
+        """
+        Assert that accounts of a deleted plan are looked up again (they are moved to the default plan).
+        """
+        custom_plan = Plan.objects.create(
+            name="Custom",
+            can_access_original_image=False,
+            can_fetch_expiring_link=False,
+            expiring_link_time_range=(300, 30000),
+        )
+        account.plan = custom_plan
+        account.save()
+        plan_cache.get_account_plan(account.id)
+
+        custom_plan.delete()
+
+        assert plan_cache.get_account_plan(account.id).name == "Basic"
+
+    def test_encoder_profile_save_invalidates_plans(self, plan_cache, django_assert_num_queries):
+        """
+        Assert that plans are cached with their encoder profile and fetched again once the profile is saved or deleted.
+        """
+        encoder_profile = EncoderProfile.objects.create(name="Small", quality=40)
+        Plan.objects.filter(id=2).update(encoder_profile=encoder_profile)
+        plan_cache.invalidate_plan(2)
+
+        with django_assert_num_queries(1):
+            assert plan_cache.get_plan(2).encoder_profile.quality == 40
+
+        encoder_profile.quality = 50
+        encoder_profile.save()
+        assert plan_cache.get_plan(2).encoder_profile.quality == 50
+
+        encoder_profile.delete()
+        assert plan_cache.get_plan(2).encoder_profile is None
+
+
+class TestGetUserPlan:
+    def test_get_user_plan_sets_account_plan(self, plan_cache, account, django_assert_num_queries):
+        """
+        Assert that the cached plan is set on the account, so that `account.plan` does not query the database.
+        """
+        get_user_plan(get_user_model().objects.get(id=account.id))
+        fresh_account = get_user_model().objects.get(id=account.id)
+
+        with django_assert_num_queries(0):
+            assert get_user_plan(fresh_account).name == "Premium"
+            assert fresh_account.plan.name == "Premium"
+
+    def test_get_user_plan_lazy_user(self, plan_cache, account):
+        """
+        Assert that the plan of a lazily loaded user (as set on requests authenticated by a session) is returned.
+        """
+        lazy_account = SimpleLazyObject(lambda: get_user_model().objects.get(id=account.id))
+
+        assert get_user_plan(lazy_account).name == "Premium"
+        assert lazy_account.plan.name == "Premium"
@@ -1,4 +1,5 @@
 from pathlib import Path
+from tempfile import gettempdir
 
 import environ
 
@@ -71,6 +72,9 @@ INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 # ==============================================================================
 
 MIDDLEWARE = [
+    "apps.core.middleware.server_timing_middleware",
+    "apps.core.middleware.profiling_middleware",
+    "apps.core.middleware.memory_tracking_middleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -156,11 +160,139 @@ STATIC_URL = "/static/"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Storage keeping a single copy of identical originals, which are stored by content hash, and upload handlers
+# hashing the uploaded files while they stream in (see apps.images.content).
+DEFAULT_FILE_STORAGE = "apps.images.storage.ContentAddressedStorage"
+FILE_UPLOAD_HANDLERS = [
+    "apps.images.uploadhandlers.ContentHashMemoryFileUploadHandler",
+    "apps.images.uploadhandlers.ContentHashTemporaryFileUploadHandler",
+]
+
 # XXX, NOTE: Custom settings for the purpose of generating thumbnails links
 # in apps.images.api.serializer.ImageSerializer.to_representation() override.
 # This should be reviewed when the domaign changes (for example to AWS S3 or other third party).
 DEFAULT_MEDIA_DOMAIN = env("DEFAULT_MEDIA_DOMAIN", default="http://127.0.0.1:8000")
 
+# Serving of image files by the API (see apps.images.api.responses.file_response).
+# Empty value streams files from Django; "x-accel-redirect" (nginx) or "x-sendfile" (Apache, lighttpd) let
+# the fronting proxy send the file once Django has authorized the request.
+MEDIA_SENDFILE_BACKEND = env("MEDIA_SENDFILE_BACKEND", default="")
+# Internal nginx location aliased to MEDIA_ROOT, used with "x-accel-redirect" backend.
+MEDIA_ACCEL_REDIRECT_PREFIX = env("MEDIA_ACCEL_REDIRECT_PREFIX", default="/protected-media/")
+
+# Cache-Control directives of the image endpoints. Thumbnails are private to their owner. Responses to expiring links
+# are never cached for longer than the link itself is valid (see apps.images.api.views.ImageExpiringLinkAPIView).
+THUMBNAIL_CACHE_CONTROL = {"private": True, "max_age": env.int("THUMBNAIL_CACHE_MAX_AGE", default=86400)}
+EXPIRING_LINK_CACHE_CONTROL = {"private": True, "max_age": env.int("EXPIRING_LINK_CACHE_MAX_AGE", default=3600)}
+
+# Keys signing expiring links (see apps.images.api.links), by key id. New links are signed with the
+# `EXPIRING_LINK_SIGNING_KEY_ID` key and links signed with any listed key are accepted, so a key is rotated by adding
+# a new one, signing with it and removing the old one once the links it signed have expired.
+EXPIRING_LINK_SIGNING_KEYS = env.dict("EXPIRING_LINK_SIGNING_KEYS", default={"default": SECRET_KEY})
+EXPIRING_LINK_SIGNING_KEY_ID = env("EXPIRING_LINK_SIGNING_KEY_ID", default="default")
+
+# Limits of batch uploads (see apps.images.api.batch): number of images and their total size (bytes) per request,
+# and the number of threads validating the images of a batch.
+IMAGE_BATCH_MAX_FILES = env.int("IMAGE_BATCH_MAX_FILES", default=100)
+IMAGE_BATCH_MAX_BYTES = env.int("IMAGE_BATCH_MAX_BYTES", default=100 * 1024 * 1024)
+IMAGE_BATCH_VALIDATION_WORKERS = env.int("IMAGE_BATCH_VALIDATION_WORKERS", default=4)
+
+
+# ==============================================================================
+# THUMBNAILS SETTINGS
+# ==============================================================================
+
+# Background generation of all plan thumbnails right after an image is uploaded (see apps.images.tasks).
+THUMBNAIL_PREGENERATE = env.bool("THUMBNAIL_PREGENERATE", default=True)
+THUMBNAIL_WORKERS = env.int("THUMBNAIL_WORKERS", default=2)
+THUMBNAIL_QUEUE_SIZE = env.int("THUMBNAIL_QUEUE_SIZE", default=100)
+THUMBNAIL_MAX_RETRIES = env.int("THUMBNAIL_MAX_RETRIES", default=2)
+THUMBNAIL_RETRY_DELAY = env.float("THUMBNAIL_RETRY_DELAY", default=0.5)  # seconds, multiplied by attempt number
+
+# Largest source image (width x height in pixels) that is decoded; bigger images are refused as decompression bombs.
+IMAGE_MAX_PIXELS = env.int("IMAGE_MAX_PIXELS", default=50_000_000)
+
+# Maximum time (seconds) the thumbnail view waits for a queued render before rendering the thumbnail itself.
+THUMBNAIL_WAIT_TIMEOUT = env.float("THUMBNAIL_WAIT_TIMEOUT", default=10)
+# Per-process LRU cache of thumbnail bytes (see apps.images.cache); 0 disables it.
+THUMBNAIL_MEMORY_CACHE_MAX_BYTES = env.int("THUMBNAIL_MEMORY_CACHE_MAX_BYTES", default=0)
+THUMBNAIL_MEMORY_CACHE_MAX_ITEM_BYTES = env.int("THUMBNAIL_MEMORY_CACHE_MAX_ITEM_BYTES", default=256 * 1024)
+THUMBNAIL_MEMORY_CACHE_TTL = env.int("THUMBNAIL_MEMORY_CACHE_TTL", default=300)  # seconds
+
+# Maximum time (seconds) to wait for another thread or process rendering the same thumbnail.
+# After that, the thumbnail is rendered anyway (outputs are written atomically, so this is safe, only wasteful).
+THUMBNAIL_LOCK_TIMEOUT = env.float("THUMBNAIL_LOCK_TIMEOUT", default=30)
+# Directory of the lock files guarding thumbnail renders (see apps.images.api.utils.thumbnail_lock), which must be
+# on a local filesystem shared by all worker processes of the host.
+THUMBNAIL_LOCK_DIRECTORY = env("THUMBNAIL_LOCK_DIRECTORY", default=str(Path(gettempdir()) / "thumbnail-locks"))
+
+# Logs the bytes saved by plans' encoder profiles on every thumbnail compared to the default encoder settings.
+# Thumbnails are encoded a second time to measure it, so it is only meant for evaluating profiles.
+THUMBNAIL_REPORT_BYTES_SAVED = env.bool("THUMBNAIL_REPORT_BYTES_SAVED", default=False)
+
+
+# Async variants of the thumbnail and expiring link views, for ASGI deployments (see apps.images.api.async_views).
+# Their renders run in a pool of `THUMBNAIL_RENDER_WORKERS` threads, with at most `THUMBNAIL_RENDER_QUEUE_SIZE`
+# more renders waiting; requests beyond that are answered with 503 Service Unavailable.
+IMAGES_ASYNC_VIEWS = env.bool("IMAGES_ASYNC_VIEWS", default=False)
+THUMBNAIL_RENDER_WORKERS = env.int("THUMBNAIL_RENDER_WORKERS", default=2)
+THUMBNAIL_RENDER_QUEUE_SIZE = env.int("THUMBNAIL_RENDER_QUEUE_SIZE", default=20)
+# Largest file or byte range (bytes) the async views read into memory to serve it. Larger ones are streamed, which
+# reads them on the event loop, so a sendfile backend (see `MEDIA_SENDFILE_BACKEND`) should serve them instead.
+IMAGES_ASYNC_MAX_BUFFERED_BYTES = env.int("IMAGES_ASYNC_MAX_BUFFERED_BYTES", default=1024 * 1024)
+
+
+# ==============================================================================
+# PLANS SETTINGS
+# ==============================================================================
+
+# Cache of user plans read by every API request (see apps.plans.cache): "memory" keeps them per process, "django"
+# in the `PLAN_CACHE_ALIAS` cache of CACHES setting (shared by processes), and an empty value disables the cache.
+# Entries expire after `PLAN_CACHE_TIMEOUT` seconds, which bounds staleness of plans changed by another process
+# when they are kept per process.
+PLAN_CACHE_BACKEND = env("PLAN_CACHE_BACKEND", default="memory")
+PLAN_CACHE_ALIAS = env("PLAN_CACHE_ALIAS", default="default")
+PLAN_CACHE_TIMEOUT = env.int("PLAN_CACHE_TIMEOUT", default=300)
+
+
+# ==============================================================================
+# METRICS SETTINGS
+# ==============================================================================
+
+# Metrics exposed in Prometheus text format at /metrics/ (see apps.core.metrics). Deployments with several worker
+# processes must set `METRICS_DIRECTORY`, shared by the processes (and emptied when the deployment starts), to which
+# every process writes its values at most `METRICS_FLUSH_INTERVAL` seconds after they change. The endpoint is
+# available to staff users and to scrapers sending `Authorization: Bearer <METRICS_AUTH_TOKEN>` header.
+METRICS_DIRECTORY = env("METRICS_DIRECTORY", default="")
+METRICS_FLUSH_INTERVAL = env.float("METRICS_FLUSH_INTERVAL", default=1.0)
+METRICS_AUTH_TOKEN = env("METRICS_AUTH_TOKEN", default="")
+
+# Timing of the phases of every request (database queries, storage I/O, image decoding, resizing and encoding,
+# see apps.core.timing), reported in `Server-Timing` response header, which browser devtools display, and/or in
+# a JSON log line of `apps.core.middleware` logger. The header discloses server internals to clients.
+SERVER_TIMING_HEADER = env.bool("SERVER_TIMING_HEADER", default=False)
+SERVER_TIMING_LOG = env.bool("SERVER_TIMING_LOG", default=False)
+
+# Sampling profiler of requests (see apps.core.profiling), writing profiles to `PROFILER_DIRECTORY`, which keeps
+# the `PROFILER_MAX_FILES` newest ones. It profiles a `PROFILER_SAMPLE_RATE` fraction of requests (0 to 1) and every
+# request slower than `PROFILER_SLOW_THRESHOLD` seconds (0 disables it), sampling stacks every `PROFILER_INTERVAL`
+# seconds. It is disabled, at no cost, unless the directory and a rate or threshold are set.
+PROFILER_DIRECTORY = env("PROFILER_DIRECTORY", default="")
+PROFILER_SAMPLE_RATE = env.float("PROFILER_SAMPLE_RATE", default=0.0)
+PROFILER_SLOW_THRESHOLD = env.float("PROFILER_SLOW_THRESHOLD", default=0.0)
+PROFILER_INTERVAL = env.float("PROFILER_INTERVAL", default=0.005)
+PROFILER_MAX_FILES = env.int("PROFILER_MAX_FILES", default=200)
+
+# Tracking of the memory high-water mark of every request (see apps.core.memory), tagged with the pixel count of
+# the source image. Requests peaking `MEMORY_TRACKING_THRESHOLD` bytes above their start are logged, and the
+# `MEMORY_TRACKING_TOP_OFFENDERS` highest ones are kept in the `MEMORY_TRACKING_CACHE_ALIAS` cache of CACHES
+# setting (which must be shared by the processes to collect all of them) and listed to staff users at
+# /memory/offenders/.
+MEMORY_TRACKING = env.bool("MEMORY_TRACKING", default=False)
+MEMORY_TRACKING_THRESHOLD = env.int("MEMORY_TRACKING_THRESHOLD", default=256 * 1024 * 1024)
+MEMORY_TRACKING_TOP_OFFENDERS = env.int("MEMORY_TRACKING_TOP_OFFENDERS", default=50)
+MEMORY_TRACKING_CACHE_ALIAS = env("MEMORY_TRACKING_CACHE_ALIAS", default="default")
+
 
 # ==============================================================================
 # THIRD-PARTY SETTINGS
@@ -170,11 +302,3 @@ DEFAULT_MEDIA_DOMAIN = env("DEFAULT_MEDIA_DOMAIN", default="http://127.0.0.1:800
 REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAdminUser",),
 }
-
-# Django Sesame
-
-AUTHENTICATION_BACKENDS += [
-    "sesame.backends.ModelBackend",
-]
-
-SESAME_MAX_AGE = 300  # arbitrary value, it can be updated on a per view basis
@@ -13,15 +13,20 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
+from apps.core.views import memory_offenders_view, metrics_view
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/v1/", include("apps.core.apiv1_urls", namespace="apiv1")),
     path("api-auth/", include("rest_framework.urls")),
+    path("metrics/", metrics_view, name="metrics"),
+    path("memory/offenders/", memory_offenders_view, name="memory_offenders"),
 ]
 
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)